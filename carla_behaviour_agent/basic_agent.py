@@ -10,11 +10,14 @@ It can also make use of the global route planner to follow a specifed route
 """
 
 import carla
-from shapely.geometry import Polygon
 
 from local_planner import LocalPlanner, RoadOption
 from global_route_planner import GlobalRoutePlanner
-from misc import (get_speed, is_within_distance,
+from world_snapshot import WorldSnapshot
+from waypoint_cache import WaypointCache
+from lane_occupancy import LaneOccupancy
+from route_corridor import RouteCorridor
+from misc import (is_within_distance,
                                get_trafficlight_trigger_location,
                                compute_distance)
 # from perception.perfectTracker.gt_tracker import PerfectTracker
@@ -68,6 +71,16 @@ class BasicAgent(object):
         self._speed_ratio = 1
         self._max_brake = 0.5
         self._offset = 0
+        self._grp_cache_dir = None
+        self._grp_landmarks = 0
+        self._grp_lazy = False
+        self._grp_tile_size = 0.0
+        self._grp_tile_budget = 200000
+        self._grp_workers = 1
+        self._grp_alternatives = 0
+        self._grp_alternatives_window = 200.0
+        self._waypoint_cache_resolution = 0.1
+        self._waypoint_cache_size = 4096
 
         # Change parameters according to the dictionary
         if 'target_speed' in opt_dict:
@@ -92,6 +105,26 @@ class BasicAgent(object):
             self._max_brake = opt_dict['max_brake']
         if 'offset' in opt_dict:
             self._offset = opt_dict['offset']
+        if 'grp_cache_dir' in opt_dict:
+            self._grp_cache_dir = opt_dict['grp_cache_dir']
+        if 'grp_landmarks' in opt_dict:
+            self._grp_landmarks = opt_dict['grp_landmarks']
+        if 'grp_lazy' in opt_dict:
+            self._grp_lazy = opt_dict['grp_lazy']
+        if 'grp_tile_size' in opt_dict:
+            self._grp_tile_size = opt_dict['grp_tile_size']
+        if 'grp_tile_budget' in opt_dict:
+            self._grp_tile_budget = opt_dict['grp_tile_budget']
+        if 'grp_workers' in opt_dict:
+            self._grp_workers = opt_dict['grp_workers']
+        if 'grp_alternatives' in opt_dict:
+            self._grp_alternatives = opt_dict['grp_alternatives']
+        if 'grp_alternatives_window' in opt_dict:
+            self._grp_alternatives_window = opt_dict['grp_alternatives_window']
+        if 'waypoint_cache_resolution' in opt_dict:
+            self._waypoint_cache_resolution = opt_dict['waypoint_cache_resolution']
+        if 'waypoint_cache_size' in opt_dict:
+            self._waypoint_cache_size = opt_dict['waypoint_cache_size']
         print("Massima frenata: ", self._max_brake)
         print("Ignora veicolo,", self._ignore_vehicles)
         # Initialize the planners
@@ -101,14 +134,125 @@ class BasicAgent(object):
                 self._global_planner = grp_inst
             else:
                 print("Warning: Ignoring the given map as it is not a 'carla.Map'")
-                self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+                self._global_planner = GlobalRoutePlanner(
+                    self._map, self._sampling_resolution, cache_dir=self._grp_cache_dir,
+                    landmarks=self._grp_landmarks, lazy=self._grp_lazy,
+                    tile_size=self._grp_tile_size, tile_budget=self._grp_tile_budget,
+                    workers=self._grp_workers, alternatives=self._grp_alternatives,
+                    alternatives_window=self._grp_alternatives_window)
         else:
-            self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+            self._global_planner = GlobalRoutePlanner(
+                self._map, self._sampling_resolution, cache_dir=self._grp_cache_dir,
+                landmarks=self._grp_landmarks, lazy=self._grp_lazy,
+                tile_size=self._grp_tile_size, tile_budget=self._grp_tile_budget,
+                workers=self._grp_workers, alternatives=self._grp_alternatives,
+                alternatives_window=self._grp_alternatives_window)
+        # Distance between the waypoints of the plans, the look-aheads along them are multiples of it
+        self._plan_resolution = self._global_planner.get_sampling_resolution()
 
         # Get the static elements of the scene
         self._lights_list = self._world.get_actors().filter("*traffic_light*")
         self._lights_map = {}  # Dictionary mapping a traffic light to a wp corrspoing to its trigger volume location
 
+        # State of the actors at the current tick, see _update_snapshot
+        self._snapshot = None
+        # Projections of the actors on the map, used by the detectors
+        self._waypoint_cache = WaypointCache(
+            self._map, resolution=self._waypoint_cache_resolution, maxsize=self._waypoint_cache_size)
+        # Vehicles around the ego grouped by lane, built at the first use of a tick
+        self._lane_occupancy = None
+        # Actors around the ego in the (s, d) coordinates of the plan, built at the first use of a tick
+        self._route_actors = None
+        self._route_actors_distance = 100.0
+        # Area swept by the ego along the plan, kept between ticks, and the actors it hits at the current tick
+        self._route_corridor = RouteCorridor()
+        self._corridor_hits = None
+
+    def _update_snapshot(self):
+        """
+        Reads the state of the ego vehicle and of the other actors for the current tick.
+        It is called once per run_step, and the snapshot is used instead of querying
+        the simulator until the next call.
+        """
+        self._snapshot = WorldSnapshot(self._world, self._vehicle, previous=self._snapshot)
+        self._waypoint_cache.new_tick()
+        self._lane_occupancy = None
+        self._route_actors = None
+        self._corridor_hits = None
+        return self._snapshot
+
+    def _tick_snapshot(self):
+        """
+        Returns the snapshot of the current tick, read if no step has run yet,
+        e.g. when a detector is called before the first run_step
+        """
+        if self._snapshot is None:
+            self._update_snapshot()
+        return self._snapshot
+
+    def _get_lane_occupancy(self):
+        """Returns the LaneOccupancy of the vehicles around the ego at the current tick"""
+        snapshot = self._tick_snapshot()
+        if self._lane_occupancy is None:
+            self._lane_occupancy = LaneOccupancy(snapshot, self._waypoint_cache)
+        return self._lane_occupancy
+
+    def _get_route_actors(self):
+        """
+        Returns the FrenetActors of the actors around the ego at the current tick, projected
+        on the plan, None if the plan is too short to project on
+        """
+        snapshot = self._tick_snapshot()
+        if self._route_actors is None:
+            frame = self._local_planner.get_reference_line(self._route_actors_distance)
+            if frame is None:
+                return None
+            self._route_actors = frame.project_snapshot(snapshot, self._route_actors_distance)
+        return self._route_actors
+
+    def _get_corridor_hits(self, ego_transform, right, left, max_distance=0.0):
+        """
+        Returns {actor id: distance} of the actors intersecting the route corridor at the
+        current tick, see RouteCorridor.query, or None if the plan is empty.
+        The corridor is queried once per tick for each pair of borders.
+
+            :param ego_transform: carla.Transform the corridor starts from
+            :param right, left: displacement of the borders from the plan, in meters
+            :param max_distance: distance the corridor has to reach, its horizon is
+                extended if it is shorter
+        """
+        snapshot = self._tick_snapshot()
+        self._route_corridor.cover(max_distance)
+        key = (right, left, self._route_corridor.horizon)
+        if self._corridor_hits is None or self._corridor_hits[0] != key:
+            plan = self._local_planner.get_plan_trace()
+            hits = None
+            if len(plan) > 0:
+                self._route_corridor.update(plan, right, left)
+                near = snapshot.near_indices(ego_transform.location, self._route_corridor.horizon + 10.0,
+                                                   exclude_ego=True)
+                hits = self._route_corridor.query(snapshot, ego_transform, near)
+            self._corridor_hits = (key, hits)
+        return self._corridor_hits[1]
+
+    def _lane_waypoint_of(self, actor, location):
+        """
+        Returns the waypoint of an actor on any lane, taken from the lane occupancy index
+        of the tick when the actor is in it, and projected from location otherwise
+        """
+        waypoint = self._get_lane_occupancy().waypoint(actor)
+        if waypoint is not None:
+            return waypoint
+        return self._waypoint_cache.get_waypoint(location, lane_type=carla.LaneType.Any)
+
+    def _transform_of(self, actor):
+        """Returns the carla.Transform of an actor, from the snapshot of the current tick"""
+        return self._tick_snapshot().transform(actor)
+
+    def _location_of(self, actor):
+        """Returns the carla.Location of an actor, from the snapshot of the current tick"""
+        return self._tick_snapshot().location(actor)
+
     def add_emergency_stop(self, control):
         """
         Overwrites the throttle a brake values of a control to perform an emergency stop.
@@ -145,6 +289,10 @@ class BasicAgent(object):
         """Get method for protected member local planner"""
         return self._global_planner
 
+    def waypoint_cache_info(self):
+        """Returns the statistics of the waypoint projections cache, see WaypointCache.info"""
+        return self._waypoint_cache.info()
+
     def set_destination(self, end_location, start_location=None):
         """
         This method creates a list of waypoints between a starting and ending location,
@@ -168,6 +316,38 @@ class BasicAgent(object):
         route_trace = self.trace_route(start_waypoint, end_waypoint)
         self._local_planner.set_global_plan(route_trace, clean_queue=clean_queue)
 
+    def repair_plan(self, start_location, min_distance=0.0):
+        """
+        This method replaces the beginning of the current plan with a detour from start_location,
+        e.g. a waypoint of the adjacent lane, that rejoins the plan at least min_distance ahead.
+        The rest of the plan is kept, so only the detour is traced.
+
+            :param start_location (carla.Location): starting location of the detour
+            :param min_distance (float): distance along the plan before which the detour can't rejoin it
+            :return: True if the plan was repaired, False if the detour can't rejoin the plan
+        """
+        detour, end_index = self._global_planner.repair_route(
+            self._local_planner.get_plan_trace(), start_location, min_distance)
+        if detour is None:
+            return False
+        self._local_planner.splice_plan(detour, end_index)
+        return True
+
+    def use_alternative_route(self, blocked_location):
+        """
+        This method switches the upcoming part of the plan to an alternative route avoiding
+        blocked_location, among those prepared in background by the global planner.
+
+            :param blocked_location (carla.Location): location of the obstacle blocking the lane
+            :return: True if the plan was switched, False if no alternative is ready
+        """
+        alternative, start_index, end_index = self._global_planner.alternative_route(
+            self._local_planner.get_plan_trace(), blocked_location)
+        if alternative is None:
+            return False
+        self._local_planner.splice_plan(alternative, end_index, start_index)
+        return True
+
     def set_global_plan(self, plan, stop_waypoint_creation=True, clean_queue=True):
         """
         Adds a specific plan to the agent.
@@ -201,10 +381,11 @@ class BasicAgent(object):
         #  Retrieve all relevant actors
         #####
         # Basic Agent :
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
+        snapshot = self._update_snapshot()
+        vehicle_list = snapshot.filter("*vehicle*")
         ### 
 
-        vehicle_speed = get_speed(self._vehicle) / 3.6
+        vehicle_speed = snapshot.ego_speed / 3.6
 
         # Check for possible vehicle obstacles
         max_vehicle_distance = self._base_vehicle_threshold + self._speed_ratio * vehicle_speed
@@ -219,7 +400,7 @@ class BasicAgent(object):
         if affected_by_tlight:
             hazard_detected = True
 
-        control = self._local_planner.run_step()
+        control = self._local_planner.run_step(snapshot=snapshot)
         if hazard_detected:
             control = self.add_emergency_stop(control)
 
@@ -282,7 +463,7 @@ class BasicAgent(object):
             return (False, None)
 
         if not lights_list:
-            lights_list = self._world.get_actors().filter("*traffic_light*")
+            lights_list = self._tick_snapshot().filter("*traffic_light*")
 
         if not max_distance:
             max_distance = self._base_tlight_threshold
@@ -293,8 +474,8 @@ class BasicAgent(object):
             else:
                 return (True, self._last_traffic_light)
 
-        ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
+        ego_vehicle_location = self._location_of(self._vehicle)
+        ego_vehicle_waypoint = self._waypoint_cache.get_waypoint(ego_vehicle_location)
 
         for traffic_light in lights_list:
             if traffic_light.id in self._lights_map:
@@ -320,7 +501,7 @@ class BasicAgent(object):
             if traffic_light.state != carla.TrafficLightState.Red:
                 continue
 
-            if is_within_distance(trigger_wp.transform, self._vehicle.get_transform(), max_distance, [0, 90]):
+            if is_within_distance(trigger_wp.transform, self._transform_of(self._vehicle), max_distance, [0, 90]):
                 self._last_traffic_light = traffic_light
                 return (True, traffic_light)
 
@@ -332,19 +513,30 @@ class BasicAgent(object):
             return (False, None)
         
         if not static_obstacle_list:
-            static_obstacle_list = self._world.get_actors().filter("*static.prop.*")
+            static_obstacle_list = self._tick_snapshot().filter("*static.prop.*")
 
         if not max_distance:
             max_distance = self._base_static_obstacle_threshold
 
-        ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
+        ego_vehicle_location = self._location_of(self._vehicle)
+        ego_vehicle_waypoint = self._waypoint_cache.get_waypoint(ego_vehicle_location)
 
         obstacle_list = []
 
+        # Along the plan, an obstacle is ahead if it overlaps the lane of the ego
+        route_actors = self._get_route_actors()
+        if route_actors is not None:
+            half_width = ego_vehicle_waypoint.lane_width / 2.0
+            in_path = {actor.id for _, actor in route_actors.in_path(max_distance, half_width)}
+            for obstacle in static_obstacle_list:
+                if obstacle.id in in_path:
+                    obstacle_list.append((True, obstacle, compute_distance(
+                        self._location_of(obstacle), ego_vehicle_location)))
+            return sorted(obstacle_list, key=lambda x: x[2])
+
         for obstacle in static_obstacle_list:
-            obstacle_transform = obstacle.get_transform()
-            obstacle_wpt = self._map.get_waypoint(obstacle_transform.location, lane_type=carla.LaneType.Any)
+            obstacle_transform = self._transform_of(obstacle)
+            obstacle_wpt = self._waypoint_cache.get_waypoint(obstacle_transform.location, lane_type=carla.LaneType.Any)
 
             if obstacle_wpt.transform.location.distance(ego_vehicle_location) > max_distance:
                 continue
@@ -360,7 +552,7 @@ class BasicAgent(object):
             if dot_ve_wp < 0:
                 continue
 
-            ego_transform = self._vehicle.get_transform()
+            ego_transform = self._transform_of(self._vehicle)
 
             if is_within_distance(obstacle_wpt.transform, ego_transform, max_distance, [0, 30]):
                 #print(f"Ostacolo è davanti a me:\troad_id obstacle: {obstacle_wpt.road_id}, lane: {obstacle_wpt.lane_id},\nroad_id vehicle road: {ego_vehicle_waypoint.road_id} \
@@ -379,43 +571,18 @@ class BasicAgent(object):
             :param max_distance: max freespace to check for obstacles.
                 If None, the base threshold value is used
         """
-        def get_route_polygon():
-            route_bb = []
-            extent_y = self._vehicle.bounding_box.extent.y
-            r_ext = extent_y + self._offset
-            l_ext = -extent_y + self._offset
-            r_vec = ego_transform.get_right_vector()
-            p1 = ego_location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-            p2 = ego_location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-            route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            for wp, _ in self._local_planner.get_plan():
-                if ego_location.distance(wp.transform.location) > max_distance:
-                    break
-
-                r_vec = wp.transform.get_right_vector()
-                p1 = wp.transform.location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-                p2 = wp.transform.location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-                route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            # Two points don't create a polygon, nothing to check
-            if len(route_bb) < 3:
-                return None
-
-            return Polygon(route_bb)
-
         if self._ignore_vehicles:
             return (False, None, -1)
 
         if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+            vehicle_list = self._tick_snapshot().filter("*vehicle*")
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
-        ego_transform = self._vehicle.get_transform()
+        ego_transform = self._transform_of(self._vehicle)
         ego_location = ego_transform.location
-        ego_wpt = self._map.get_waypoint(ego_location)
+        ego_wpt = self._waypoint_cache.get_waypoint(ego_location)
 
         # Get the right offset
         if ego_wpt.lane_id < 0 and lane_offset != 0:
@@ -429,35 +596,34 @@ class BasicAgent(object):
         opposite_invasion = abs(self._offset) + self._vehicle.bounding_box.extent.y > ego_wpt.lane_width / 2
         use_bbs = self._use_bbs_detection or opposite_invasion or ego_wpt.is_junction
 
-        # Get the route bounding box
-        route_polygon = get_route_polygon()
+        # Get the actors intersecting the route bounding box
+        extent_y = self._vehicle.bounding_box.extent.y
+        corridor_hits = self._get_corridor_hits(
+            ego_transform, extent_y + self._offset, -extent_y + self._offset, max_distance)
+        # Waypoint of the plan three waypoints ahead, for the vehicles in another lane
+        next_plan_wpt = self._local_planner.waypoint_at_distance(3 * self._plan_resolution)[0]
 
         for target_vehicle in vehicle_list:
             if target_vehicle.id == self._vehicle.id:
                 continue
 
-            target_transform = target_vehicle.get_transform()
+            target_transform = self._transform_of(target_vehicle)
             if target_transform.location.distance(ego_location) > max_distance:
                 continue
 
-            target_wpt = self._map.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
+            target_wpt = self._waypoint_cache.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
 
             # General approach for junctions and vehicles invading other lanes due to the offset
-            if (use_bbs or target_wpt.is_junction) and route_polygon:
+            if (use_bbs or target_wpt.is_junction) and corridor_hits is not None:
 
-                target_bb = target_vehicle.bounding_box
-                target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                target_polygon = Polygon(target_list)
-
-                if route_polygon.intersects(target_polygon):
-                    return (True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location))
+                if corridor_hits.get(target_vehicle.id, float('inf')) <= max_distance:
+                    return (True, target_vehicle, compute_distance(self._location_of(target_vehicle), ego_location))
 
             # Simplified approach, using only the plan waypoints (similar to TM)
             else:
 
                 if target_wpt.road_id != ego_wpt.road_id or target_wpt.lane_id != ego_wpt.lane_id  + lane_offset:
-                    next_wpt = self._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
+                    next_wpt = next_plan_wpt
                     if not next_wpt:
                         continue
                     if target_wpt.road_id != next_wpt.road_id or target_wpt.lane_id != next_wpt.lane_id  + lane_offset:
@@ -489,14 +655,18 @@ class BasicAgent(object):
             return [(False, None, -1)]
 
         if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+            vehicle_list = self._tick_snapshot().filter("*vehicle*")
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
-        ego_transform = self._vehicle.get_transform()
-        ego_wpt = self._map.get_waypoint(self._vehicle.get_location())
+        ego_transform = self._transform_of(self._vehicle)
+        ego_wpt = self._waypoint_cache.get_waypoint(self._location_of(self._vehicle))
         
+        # Side of the adjacent lane on the plan, before it becomes a lane id offset:
+        # -1 is the lane on the left, as d grows to the right
+        side = lane_offset
+
         # Get the right offset
         if ego_wpt.lane_id < 0 and lane_offset != 0:
             print("changed value lane_offset")
@@ -512,21 +682,43 @@ class BasicAgent(object):
             y=ego_extent * ego_forward_vector.y,
         )
 
+        # Along the plan, being in the path or in the adjacent lane are interval tests
+        # on the (s, d) coordinates of the actors. The cone reaches behind the ego above 90 degrees
+        frenet_hits = None
+        route_actors = self._get_route_actors()
+        if route_actors is not None:
+            ahead = ego_extent + max_distance
+            behind = max_distance if up_angle_th > 90 else 0.0
+            if side == 0:
+                found = route_actors.in_path(ahead, ego_wpt.lane_width / 2.0, behind=behind)
+            else:
+                found = route_actors.adjacent(side, ego_wpt.lane_width, behind, ahead)
+            frenet_hits = {actor.id for _, actor in found}
+
         # lista perché considero ognuno e prendo quello più vicino
         temp_vehicle_list = []
+        junction_checked = False
+        # Waypoint of the plan three waypoints ahead, for the vehicles in another lane
+        next_plan_wpt = self._local_planner.waypoint_at_distance(3 * self._plan_resolution)[0]
 
         for target_vehicle in vehicle_list:
-            target_transform = target_vehicle.get_transform()
-            target_wpt = self._map.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
+            target_transform = self._transform_of(target_vehicle)
+            target_wpt = self._lane_waypoint_of(target_vehicle, target_transform.location)
             #print(target_vehicle)
             # Simplified version for outside junctions
-            if not ego_wpt.is_junction or not target_wpt.is_junction:
+            if (not ego_wpt.is_junction or not target_wpt.is_junction) and frenet_hits is not None:
+
+                if target_vehicle.id in frenet_hits:
+                    temp_vehicle_list.append((True, target_vehicle, compute_distance(target_transform.location, ego_transform.location)))
+
+            # Without a plan to project on, compare the lanes of the waypoints
+            elif not ego_wpt.is_junction or not target_wpt.is_junction:
 
                 if target_wpt.road_id != ego_wpt.road_id or target_wpt.lane_id != ego_wpt.lane_id  + lane_offset:
                     # print("ROAD OR LANE DIVERSA!")
                     # print(f"TARGET VEHICLE: {target_vehicle}:\t{target_wpt.road_id}\t{target_wpt.lane_id}" )
                     # print(f"EGO VEHICLE:\t{ego_wpt.road_id}\t{ego_wpt.lane_id}\t{lane_offset}\t")
-                    next_wpt = self._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
+                    next_wpt = next_plan_wpt
                     if not next_wpt:
                         continue
 
@@ -546,54 +738,35 @@ class BasicAgent(object):
                     #print("è davanti a me")
                     temp_vehicle_list.append((True, target_vehicle, compute_distance(target_transform.location, ego_transform.location)))
 
-            # Waypoints aren't reliable, check the proximity of the vehicle to the route
-            else:
+            # Waypoints aren't reliable, check the proximity of the vehicles to the route
+            elif not junction_checked:
                 print("else Waypoints aren't reliable")
-                route_bb = []
+                junction_checked = True
                 ego_location = ego_transform.location
                 extent_y = self._vehicle.bounding_box.extent.y
-                r_vec = ego_transform.get_right_vector()
-                p1 = ego_location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
-                p2 = ego_location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
-                route_bb.append([p1.x, p1.y, p1.z])
-                route_bb.append([p2.x, p2.y, p2.z])
-
-                for wp, _ in self._local_planner.get_plan():
-                    if ego_location.distance(wp.transform.location) > max_distance:
-                        break
-
-                    r_vec = wp.transform.get_right_vector()
-                    p1 = wp.transform.location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
-                    p2 = wp.transform.location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
-                    route_bb.append([p1.x, p1.y, p1.z])
-                    route_bb.append([p2.x, p2.y, p2.z])
-
-                if len(route_bb) < 3:
-                    # 2 points don't create a polygon, nothing to check
-                    return temp_list.append((False, None, -1))
-
-                ego_polygon = Polygon(route_bb)
-
-                # Compare the two polygons
-                for target_vehicle in vehicle_list:
-                    target_extent = target_vehicle.bounding_box.extent.x
-                    if target_vehicle.id == self._vehicle.id:
+
+                # Compare the footprints of all the vehicles with the route corridor, queried once per tick
+                corridor_hits = self._get_corridor_hits(ego_transform, extent_y, -extent_y, max_distance)
+                if not corridor_hits:
+                    continue
+                for other_vehicle in vehicle_list:
+                    if other_vehicle.id == self._vehicle.id:
                         continue
-                    if ego_location.distance(target_vehicle.get_location()) > max_distance:
+                    other_location = self._location_of(other_vehicle)
+                    if ego_location.distance(other_location) > max_distance:
                         continue
+                    if corridor_hits.get(other_vehicle.id, float('inf')) <= max_distance:
+                        temp_vehicle_list.append((True, other_vehicle, compute_distance(other_location, ego_location)))
 
-                    target_bb = target_vehicle.bounding_box
-                    target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                    target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                    target_polygon = Polygon(target_list)
-
-                    if ego_polygon.intersects(target_polygon):
-                        temp_vehicle_list.append((True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location)))
-
-                
         if len(temp_vehicle_list) > 0:
-            # in base alla distanza prendo quello più vicino
-            return sorted(temp_vehicle_list, key=lambda x: x[2])
+            # in base alla distanza prendo quello più vicino, una volta sola per veicolo
+            found = []
+            found_ids = set()
+            for entry in sorted(temp_vehicle_list, key=lambda x: x[2]):
+                if entry[1].id not in found_ids:
+                    found_ids.add(entry[1].id)
+                    found.append(entry)
+            return found
             
         return [(False, None, -1)]
 
@@ -18,6 +18,7 @@ from leaderboard.autoagents.autonomous_agent import AutonomousAgent, Track
 
 import json
 from utils import Streamer
+from sampling_profiler import SamplingProfiler
 
 def get_entry_point():
     return 'MyTeamAgent'
@@ -48,6 +49,12 @@ class MyTeamAgent(AutonomousAgent):
         if self.__show:
             self.showServer = Streamer(self.configs["Visualizer_IP"])
 
+        # Statistical profiler of the agent steps, disabled with a rate of 0
+        self._profiler = None
+        if self.configs.get("profiler_rate", 0) > 0:
+            self._profiler = SamplingProfiler(rate=self.configs["profiler_rate"])
+            self._profiler.start()
+
     def sensors(self):
         """
         Define the sensor suite required by the agent
@@ -97,7 +104,12 @@ class MyTeamAgent(AutonomousAgent):
             return carla.VehicleControl()
 
         else:
-            controls = self._agent.run_step()
+            if self._profiler:
+                self._profiler.begin()
+                controls = self._agent.run_step()
+                self._profiler.end(self._agent.get_branch(), self._agent.get_route_distance())
+            else:
+                controls = self._agent.run_step()
             if self.__show:
                 self.showServer.send_frame("RGB", input_data["Center"][1])
                 self.showServer.send_data("Controls",{ 
@@ -116,6 +128,16 @@ class MyTeamAgent(AutonomousAgent):
 
     def destroy(self):
         print("DESTROY")
-        if self._agent:
-            self._agent.reset()
+        try:
+            if self._profiler:
+                self._profiler.stop()
+                info = self._profiler.info()
+                print("Profiler: {} samples over {} steps, overhead {:.1%}".format(
+                    info['samples'], info['ticks'], info['overhead']))
+                self._profiler.write(self.configs.get("profiler_dir", "team_code/profile"))
+        finally:
+            if self._agent:
+                print("Waypoint cache: {queries} queries, {memo_hits} in the tick, {cell_hits} in the cells, "
+                      "{misses} misses, hit rate {hit_rate:.1%}".format(**self._agent.waypoint_cache_info()))
+                self._agent.reset()
             
\ No newline at end of file
@@ -15,7 +15,7 @@ from basic_agent import BasicAgent
 from local_planner import RoadOption
 from behavior_types import Cautious, Aggressive, Normal
 
-from misc import get_speed, positive, is_within_distance, compute_distance
+from misc import positive, is_within_distance, compute_distance
 
 class BehaviorAgent(BasicAgent):
     """
@@ -39,7 +39,7 @@ class BehaviorAgent(BasicAgent):
         """
 
         super().__init__(vehicle, opt_dict=opt_dict, map_inst=map_inst, grp_inst=grp_inst)
-        self._look_ahead_steps = 0
+        self._look_ahead_distance = 0
 
         # Vehicle information
         self._speed = 0
@@ -51,6 +51,8 @@ class BehaviorAgent(BasicAgent):
         self._behavior = None
         self._sampling_resolution = 4.5
         self._overtaking = None
+        # Behavior branch taken by the last step, see get_branch
+        self._branch = None
 
         # Parameters for agent behavior
         if behavior == 'cautious':
@@ -67,38 +69,54 @@ class BehaviorAgent(BasicAgent):
         This method updates the information regarding the ego
         vehicle based on the surrounding world.
         """
-        self._speed = get_speed(self._vehicle)
+        snapshot = self._update_snapshot()
+        self._speed = snapshot.ego_speed
         print("velocità del veicolo ", self._speed)
-        self._speed_limit = self._vehicle.get_speed_limit()
+        self._speed_limit = snapshot.speed_limit
         self._local_planner.set_speed(self._speed_limit)
         self._direction = self._local_planner.target_road_option
         if self._direction is None:
             self._direction = RoadOption.LANEFOLLOW
 
-        self._look_ahead_steps = int((self._speed_limit) / 10)
+        # One waypoint of the plan every 10 km/h of speed limit
+        self._look_ahead_distance = int((self._speed_limit) / 10) * self._plan_resolution
 
-        self._incoming_waypoint, self._incoming_direction = self._local_planner.get_incoming_waypoint_and_direction(
-            steps=self._look_ahead_steps)
+        self._incoming_waypoint, self._incoming_direction = self._local_planner.waypoint_at_distance(
+            self._look_ahead_distance)
         if self._incoming_direction is None:
             self._incoming_direction = RoadOption.LANEFOLLOW
 
+    def get_branch(self):
+        """
+        Returns the behavior branch taken by the last step: 'red_light', 'walker',
+        'car_following', 'junction', 'normal', 'obstacle' or 'overtaking'
+        """
+        return self._branch
+
+    def get_route_distance(self):
+        """Returns the arc length of the vehicle along the trajectory it follows, in meters"""
+        progress = self._local_planner.get_route_progress()
+        if progress.trace is None or len(progress.trace) == 0:
+            return 0.0
+        return float(progress.trace.distance[progress.index])
+
     def traffic_light_manager(self):
         """
         This method is in charge of behaviors for red lights.
         """
-        actor_list = self._world.get_actors()
-        lights_list = actor_list.filter("*traffic_light*")
+        lights_list = self._snapshot.filter("*traffic_light*")
         affected, _ = self._affected_by_traffic_light(lights_list)
 
         return affected
 
-    def _tailgating(self, waypoint, vehicle_list):
+    def _tailgating(self, waypoint):
         """
         This method is in charge of tailgating behaviors.
+        The vehicle behind is found on the plan in (s, d) coordinates, and the vehicles
+        of the adjacent lanes in the lane occupancy index of the tick.
 
             :param location: current location of the agent
             :param waypoint: current waypoint of the agent
-            :param vehicle_list: list of all the nearby vehicles
         """
 
         left_turn = waypoint.left_lane_marking.lane_change
@@ -107,29 +125,41 @@ class BehaviorAgent(BasicAgent):
         left_wpt = waypoint.get_left_lane()
         right_wpt = waypoint.get_right_lane()
 
-        behind_vehicle_state, behind_vehicle, _ = self._vehicle_obstacle_detected(vehicle_list, max(
-            self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, low_angle_th=160)[0]
+        occupancy = self._get_lane_occupancy()
+        check_distance = max(self._behavior.min_proximity_threshold, self._speed_limit / 2)
+
+        # Along the plan, the vehicle behind is the closest one in the lane of the ego with s below it
+        route_actors = self._get_route_actors()
+        if route_actors is not None:
+            behind = route_actors.behind(check_distance, waypoint.lane_width / 2.0, "*vehicle*")
+            behind_vehicle = behind[0][1] if behind else None
+        else:
+            _, behind_vehicle = occupancy.behind(waypoint, check_distance)
+
+        def lane_free(side, lane_wpt):
+            # Along the plan, the lanes next to it are checked as intervals of d, across sections
+            if route_actors is not None:
+                return not route_actors.adjacent(side, waypoint.lane_width, check_distance, check_distance, "*vehicle*")
+            return not occupancy.within(lane_wpt, check_distance, check_distance)
 
-        if behind_vehicle_state and self._speed < get_speed(behind_vehicle):
+        if behind_vehicle is not None and self._speed < self._snapshot.speed(behind_vehicle):
             if (right_turn == carla.LaneChange.Right or right_turn ==
                     carla.LaneChange.Both) and waypoint.lane_id * right_wpt.lane_id > 0 and right_wpt.lane_type == carla.LaneType.Driving:
-                new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1)[0]
-                if not new_vehicle_state:
+                if lane_free(1, right_wpt):
                     print("Tailgating, moving to the right!")
-                    end_waypoint = self._local_planner.target_waypoint
                     self._behavior.tailgate_counter = 200
-                    self.set_destination(end_waypoint.transform.location,
-                                         right_wpt.transform.location)
+                    if not self.repair_plan(right_wpt.transform.location, self._behavior.min_proximity_threshold):
+                        end_waypoint = self._local_planner.target_waypoint
+                        self.set_destination(end_waypoint.transform.location,
+                                             right_wpt.transform.location)
             elif left_turn == carla.LaneChange.Left and waypoint.lane_id * left_wpt.lane_id > 0 and left_wpt.lane_type == carla.LaneType.Driving:
-                new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1)[0]
-                if not new_vehicle_state:
+                if lane_free(-1, left_wpt):
                     print("Tailgating, moving to the left!")
-                    end_waypoint = self._local_planner.target_waypoint
                     self._behavior.tailgate_counter = 200
-                    self.set_destination(end_waypoint.transform.location,
-                                         left_wpt.transform.location)
+                    if not self.repair_plan(left_wpt.transform.location, self._behavior.min_proximity_threshold):
+                        end_waypoint = self._local_planner.target_waypoint
+                        self.set_destination(end_waypoint.transform.location,
+                                             left_wpt.transform.location)
 
     def collision_and_car_avoid_manager(self, waypoint):
         """
@@ -142,10 +172,7 @@ class BehaviorAgent(BasicAgent):
             :return vehicle: nearby vehicle
             :return distance: distance to nearby vehicle
         """
-        #print(self._world.get_actors())
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+        vehicle_list = self._snapshot.near("*vehicle*", waypoint.transform.location, 45, exclude_ego=True)
 
         print("direzione ", self._direction)
         
@@ -168,7 +195,7 @@ class BehaviorAgent(BasicAgent):
                     and not waypoint.is_junction and self._speed > 10 \
                     and self._behavior.tailgate_counter == 0:
                 print("CHECK FOR TALIGATING")
-                self._tailgating(waypoint, vehicle_list)
+                self._tailgating(waypoint)
 
         return vehicle_state, vehicle, distance
 
@@ -184,9 +211,7 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-        def dist(w): return w.get_location().distance(waypoint.transform.location)
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        walker_list = self._snapshot.near("*walker.pedestrian*", waypoint.transform.location, 10)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
@@ -204,12 +229,8 @@ class BehaviorAgent(BasicAgent):
 
     def static_obstacle_avoid_manager(self, waypoint):
 
-        actor_list = self._world.get_actors()
-        obstacle_list = actor_list.filter("*static.prop.*") # tutti gli oggetti statici
-        
-        # consideriamo gli oggetti a una certa distanza
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        obstacle_list = [obstacle for obstacle in obstacle_list if dist(obstacle) < 35]
+        # tutti gli oggetti statici, consideriamo gli oggetti a una certa distanza
+        obstacle_list = self._snapshot.near("*static.prop.*", waypoint.transform.location, 35)
 
         obstacle_detected = self._static_obstacle_detected(obstacle_list, 35)
 
@@ -240,7 +261,7 @@ class BehaviorAgent(BasicAgent):
             :return control: carla.VehicleControl
         """
 
-        vehicle_speed = get_speed(vehicle)
+        vehicle_speed = self._snapshot.speed(vehicle)
         delta_v = max(1, (self._speed - vehicle_speed) / 3.6)
         ttc = distance / delta_v if delta_v != 0 else distance / np.nextafter(0., 1.)
 
@@ -252,7 +273,7 @@ class BehaviorAgent(BasicAgent):
                 self._behavior.max_speed,
                 self._speed_limit - self._behavior.speed_lim_dist])
             self._local_planner.set_speed(target_speed)
-            control = self._local_planner.run_step(debug=debug)
+            control = self._local_planner.run_step(debug=debug, snapshot=self._snapshot)
 
         # Actual safety distance area, try to follow the speed of the vehicle in front.
         elif 2 * self._behavior.safety_time > ttc >= self._behavior.safety_time:
@@ -262,7 +283,7 @@ class BehaviorAgent(BasicAgent):
                 self._behavior.max_speed,
                 self._speed_limit - self._behavior.speed_lim_dist])
             self._local_planner.set_speed(target_speed)
-            control = self._local_planner.run_step(debug=debug)
+            control = self._local_planner.run_step(debug=debug, snapshot=self._snapshot)
 
         # Normal behavior.
         else:
@@ -271,7 +292,7 @@ class BehaviorAgent(BasicAgent):
                 self._behavior.max_speed,
                 self._speed_limit - self._behavior.speed_lim_dist])
             self._local_planner.set_speed(target_speed)
-            control = self._local_planner.run_step(debug=debug)
+            control = self._local_planner.run_step(debug=debug, snapshot=self._snapshot)
 
         return control
 
@@ -291,11 +312,13 @@ class BehaviorAgent(BasicAgent):
         if self._behavior.tailgate_counter > 0:
             self._behavior.tailgate_counter -= 1
 
-        ego_vehicle_loc = self._vehicle.get_location()
-        ego_vehicle_wp = self._map.get_waypoint(ego_vehicle_loc)
+        ego_vehicle_loc = self._snapshot.ego_location
+        ego_vehicle_wp = self._waypoint_cache.get_waypoint(ego_vehicle_loc)
+        self._global_planner.prefetch_ahead(ego_vehicle_loc)
 
         # 1: Red lights and stops behavior
         if self.traffic_light_manager():
+            self._branch = 'red_light'
             return self.emergency_stop()
 
         # 2.1: Pedestrian avoidance behaviors
@@ -310,6 +333,7 @@ class BehaviorAgent(BasicAgent):
 
             # Emergency brake if the car is very close.
             if distance < self._behavior.braking_distance:
+                self._branch = 'walker'
                 return self.emergency_stop()
 
         # 2.2: Car following behaviors
@@ -317,6 +341,7 @@ class BehaviorAgent(BasicAgent):
         
         print("stato veicolo: ", vehicle_state, vehicle, distance)
         if vehicle_state:
+            self._branch = 'car_following'
             # Distance is computed from the center of the two cars,
             # we use bounding boxes to calculate the actual distance
             distance = distance - max(
@@ -331,26 +356,38 @@ class BehaviorAgent(BasicAgent):
 
         # 3: Intersection behavior
         elif self._incoming_waypoint.is_junction and (self._incoming_direction in [RoadOption.LEFT, RoadOption.RIGHT]):
+            self._branch = 'junction'
             target_speed = min([
                 self._behavior.max_speed,
                 self._speed_limit - 5])
             self._local_planner.set_speed(target_speed)
-            control = self._local_planner.run_step(debug=debug)
+            control = self._local_planner.run_step(debug=debug, snapshot=self._snapshot)
 
         # 4: Normal behavior
         else:
+            self._branch = 'normal'
             target_speed = min([
                 self._behavior.max_speed,
                 self._speed_limit - self._behavior.speed_lim_dist])
             self._local_planner.set_speed(target_speed)
-            control = self._local_planner.run_step(debug=debug)
+            control = self._local_planner.run_step(debug=debug, snapshot=self._snapshot)
 
         # static obstacle
         print("\nOBSTACLE")
         obstacle_state, obstacle, o_distance = self.static_obstacle_avoid_manager(ego_vehicle_wp)
         print("OBSTACLE STATE: ", obstacle_state, obstacle, o_distance)
 
+        # Alternatives to the route are prepared in background once an obstacle is ahead, and
+        # taken only if the ego stopped behind it and it can't be overtaken
+        if obstacle_state and self._overtaking != True:
+            self._global_planner.prepare_alternatives(self._local_planner.get_plan_trace())
+            if self._speed < 1.0 and not self._generate_lane_change_path(ego_vehicle_wp) \
+                    and self.use_alternative_route(self._snapshot.location(obstacle)):
+                print("Lane blocked, switching to an alternative route")
+                obstacle_state = False
+
         if obstacle_state and self._overtaking != True:
+            self._branch = 'obstacle'
             distance = o_distance - max(
                 obstacle.bounding_box.extent.y, obstacle.bounding_box.extent.x) - max(
                     self._vehicle.bounding_box.extent.y, self._vehicle.bounding_box.extent.x)
@@ -376,7 +413,7 @@ class BehaviorAgent(BasicAgent):
                     self._behavior.max_speed,
                     self._speed_limit - self._behavior.speed_lim_dist])
                 self._local_planner.set_speed(target_speed)
-                control = self._local_planner.run_step(debug=debug)
+                control = self._local_planner.run_step(debug=debug, snapshot=self._snapshot)
             
             # veicolo fermo perché sta l'ostacolo e bisogna superarlo
             # sovraggiungono veicoli dal senso di marcia opposto
@@ -392,6 +429,7 @@ class BehaviorAgent(BasicAgent):
         print("HERE AFTER OBSTACLE")
         print("OVERTAKING VALUE:", self._overtaking)
         if self._overtaking:
+            self._branch = 'overtaking'
             print("STARTING OVERTAKING...")
             plan = self._generate_lane_change_path(ego_vehicle_wp)
             print(plan)
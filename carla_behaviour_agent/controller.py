@@ -7,6 +7,7 @@
 
 from collections import deque
 import math
+import time
 import numpy as np
 import carla
 from misc import get_speed
@@ -23,7 +24,7 @@ class VehicleController():
     """
 
     def __init__(self, vehicle, args_lateral, args_longitudinal, offset=0, max_throttle=0.75, max_brake=0.3,
-                 max_steering=0.8):
+                 max_steering=0.8, progress=None):
         """
         Constructor method.
 
@@ -40,6 +41,8 @@ class VehicleController():
         :param offset: If different than zero, the vehicle will drive displaced from the center line.
         Positive values imply a right offset while negative ones mean a left one. Numbers high enough
         to cause the vehicle to drive through other lanes might break the controller.
+        :param progress: RouteProgress on the trajectory, updated by the local planner every tick.
+        If None, the lateral controller searches the whole trajectory for the closest point.
         """
 
         self.max_brake = max_brake
@@ -50,12 +53,12 @@ class VehicleController():
         self._world = self._vehicle.get_world()
         self.past_steering = self._vehicle.get_control().steer
         self._lon_controller = PIDLongitudinalController(self._vehicle, **args_longitudinal)
-        self._lat_controller = StanleyLateralController(self._vehicle, offset, **args_lateral)
+        self._lat_controller = StanleyLateralController(self._vehicle, offset, progress=progress, **args_lateral)
 
         print("siamo in init Vehicle")
 
 
-    def run_step(self, target_speed, waypoint):
+    def run_step(self, target_speed, waypoint, snapshot=None):
         """
         Execute one step of control invoking both lateral and longitudinal
         PID controllers to reach a target waypoint
@@ -63,11 +66,15 @@ class VehicleController():
 
             :param target_speed: desired vehicle speed
             :param waypoint: target location encoded as a waypoint
+            :param snapshot: WorldSnapshot of the current tick. If None, the vehicle is queried
             :return: distance (in meters) to the waypoint
         """
-
-        acceleration = self._lon_controller.run_step(target_speed)
-        current_steering = self._lat_controller.run_step()
+        if snapshot is not None:
+            acceleration = self._lon_controller.run_step(target_speed, current_speed=snapshot.ego_speed)
+            current_steering = self._lat_controller.run_step(snapshot)
+        else:
+            acceleration = self._lon_controller.run_step(target_speed)
+            current_steering = self._lat_controller.run_step()
         control = carla.VehicleControl()
         if acceleration >= 0.0:
             control.throttle = min(acceleration, self.max_throt)
@@ -104,8 +111,13 @@ class VehicleController():
         self._lat_controller.change_parameters(**args_lateral)
     
     def setWaypoints(self, waypoints):
+        """Sets the trajectory (RouteTrace) followed by the lateral controller"""
         self._lat_controller.setWaypoints(waypoints)
 
+    def latency_info(self):
+        """Returns the latency statistics of the lateral controller, see StanleyLateralController.latency_info"""
+        return self._lat_controller.latency_info()
+
 
 class PIDLongitudinalController():
     """
@@ -129,15 +141,17 @@ class PIDLongitudinalController():
         self._dt = dt
         self._error_buffer = deque(maxlen=10)
 
-    def run_step(self, target_speed, debug=False):
+    def run_step(self, target_speed, debug=False, current_speed=None):
         """
         Execute one step of longitudinal control to reach a given target speed.
 
             :param target_speed: target speed in Km/h
             :param debug: boolean for debugging
+            :param current_speed: current speed of the vehicle in Km/h. If None, the vehicle is queried
             :return: throttle control
         """
-        current_speed = get_speed(self._vehicle)
+        if current_speed is None:
+            current_speed = get_speed(self._vehicle)
 
         if debug:
             print('Current speed = {}'.format(current_speed))
@@ -177,7 +191,7 @@ class StanleyLateralController():
     StanleyLateralController implements lateral control using a Stanley.
     """
 
-    def __init__(self, vehicle, offset=0, lookahead_distance=1.0, K_V=1.0, K_S=0.0, dt=0.03):
+    def __init__(self, vehicle, offset=0, lookahead_distance=1.0, K_V=1.0, K_S=0.0, dt=0.03, progress=None):
         """
         Constructor method.
 
@@ -188,80 +202,88 @@ class StanleyLateralController():
             :param K_V: Proportional term
             :param K_S: Differential term
             :param dt: time differential in seconds
+            :param progress: RouteProgress on the trajectory, updated by the local planner
         """
         self._vehicle = vehicle
         self._kv = K_V
         self._ks = K_S
         self._dt = dt
         self._wps = None
+        # Indices in the given trajectory of the points kept in self._wps
+        self._kept = None
+        self._progress = progress
+        self._x = self._y = self._s = None
+        self._x_list = self._y_list = None
+        self._dx = self._dy = self._ds = None
+        # Duration of the last ticks, see latency_info
+        self._latencies = deque(maxlen=1000)
         self._lookahead_distance = lookahead_distance
         self._offset = offset
 
-    def run_step(self):
+    def run_step(self, snapshot=None):
         """
         Execute one step of lateral control to steer
         the vehicle towards a certain waypoin.
 
+            :param snapshot: WorldSnapshot of the current tick. If None, the vehicle is queried
             :return: steering control in the range [-1, 1] where:
             -1 maximum steering to left
             +1 maximum steering to right
         """
+        if snapshot is not None:
+            return self._stanley_control(snapshot.ego_transform, snapshot.ego_speed)
         return self._stanley_control(self._vehicle.get_transform())
     
     def _get_lookahead_index(self, ego_loc, lookahead_distance):
-        min_idx       = 0
-        min_dist      = float("inf")
-        for i in range(len(self._wps)):
-            dist = np.linalg.norm(np.array([
-                    self._wps[i][0].transform.location.x - ego_loc.x,
-                    self._wps[i][0].transform.location.y - ego_loc.y]))
-            if dist < min_dist:
-                min_dist = dist
-                min_idx = i
-
-        total_dist = min_dist
-        lookahead_idx = min_idx
-        for i in range(min_idx + 1, len(self._wps)):
-            if total_dist >= lookahead_distance:
-                break
-            total_dist += np.linalg.norm(np.array([
-                    self._wps[i][0].transform.location.x - self._wps[i-1][0].transform.location.x,
-                    self._wps[i][0].transform.location.y - self._wps[i-1][0].transform.location.y]))
-            lookahead_idx = i
-        return lookahead_idx
+        """
+        Returns the index of the first point at least lookahead_distance ahead of the
+        vehicle, measured as the distance to the closest point plus the arc length from it
+        """
+        xs, ys = self._x, self._y
+        if self._progress is not None and self._progress.trace is not None:
+            # Closest point given by the shared cursor, mapped to the kept points
+            min_idx = max(int(np.searchsorted(self._kept, self._progress.index, side='right')) - 1, 0)
+        else:
+            min_idx = int(np.argmin((xs - ego_loc.x) ** 2 + (ys - ego_loc.y) ** 2))
+        min_dist = hypot(xs[min_idx] - ego_loc.x, ys[min_idx] - ego_loc.y)
+
+        # First point whose arc length from the closest one covers the rest of the lookahead
+        target = self._s[min_idx] + lookahead_distance - min_dist
+        lookahead_idx = int(np.searchsorted(self._s, target, side='left'))
+        return min(max(lookahead_idx, min_idx), len(xs) - 1)
     
-    def _stanley_control(self, vehicle_transform):
+    def _stanley_control(self, vehicle_transform, speed=None):
         """
         Estimate the steering angle of the vehicle based on the Stanley equations
 
             :param vehicle_transform: current transform of the vehicle
+            :param speed: current speed of the vehicle in Km/h. If None, the vehicle is queried
             :return: steering control in the range [-1, 1]
         """
+        start = time.perf_counter()
+
         # Get ego vehicle observations
         ego_loc = vehicle_transform.location
-        speed_estimate = get_speed(self._vehicle)
-        observed_heading = np.deg2rad(vehicle_transform.rotation.yaw)
+        speed_estimate = speed if speed is not None else get_speed(self._vehicle)
+        observed_heading = math.radians(vehicle_transform.rotation.yaw)
         observed_x = ego_loc.x
         observed_y = ego_loc.y
         
         # Get Target Waypoint
         ce_idx = self._get_lookahead_index(ego_loc,self._lookahead_distance)
-        desired_x = self._wps[ce_idx][0].transform.location.x
-        desired_y = self._wps[ce_idx][0].transform.location.y
+        desired_x = self._x_list[ce_idx]
+        desired_y = self._y_list[ce_idx]
         
-        # Get Target Heading
-        if ce_idx < len(self._wps)-1:
-            desired_heading_x = self._wps[ce_idx+1][0].transform.location.x - self._wps[ce_idx][0].transform.location.x
-            desired_heading_y = self._wps[ce_idx+1][0].transform.location.y - self._wps[ce_idx][0].transform.location.y
-        else:
-            desired_heading_x = self._wps[ce_idx][0].transform.location.x - self._wps[ce_idx-1][0].transform.location.x
-            desired_heading_y = self._wps[ce_idx][0].transform.location.y - self._wps[ce_idx-1][0].transform.location.y
+        # Get Target Heading, from the segment leaving the target (entering it for the last one)
+        heading_idx = ce_idx if ce_idx < len(self._x_list) - 1 else ce_idx - 1
+        desired_heading_x = self._dx[heading_idx]
+        desired_heading_y = self._dy[heading_idx]
         
         # Trajectory Heading
         desired_heading = atan2(desired_heading_y, desired_heading_x)
         
         # Trajectory Distance
-        dd=hypot(desired_heading_x, desired_heading_y)
+        dd = self._ds[heading_idx]
         
         # Crosstrack error
         lateral_error = \
@@ -285,9 +307,25 @@ class StanleyLateralController():
         # print("Current Heading: ", observed_heading, " - Desired Heading: ", desired_heading)
         # print("Heading error: ", steering_error, "Crosstrack error: ", lateral_error)
         # print("Output: ", steering)
-        
+
+        self._latencies.append(time.perf_counter() - start)
         return np.clip(steering, -1.0, 1.0)
 
+    def latency_info(self):
+        """
+        Returns the time taken by the last ticks of the controller, as a dictionary
+        with the 'ticks', 'mean', 'p95' and 'max' entries, in milliseconds
+        """
+        if not self._latencies:
+            return {'ticks': 0, 'mean': 0.0, 'p95': 0.0, 'max': 0.0}
+        latencies = np.array(self._latencies) * 1000.0
+        return {
+            'ticks': len(latencies),
+            'mean': float(latencies.mean()),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(latencies.max()),
+        }
+
     def change_parameters(self, Kv, Ks, dt):
         """Changes the Stanley parameters"""
         self._kv = Kv
@@ -295,15 +333,29 @@ class StanleyLateralController():
         self._dt = dt
     
     def setWaypoints(self, wps):
-        """Sets trajectory to follow and filters spurious points"""
-        self._wps = [wps[0]]
-        for i in range(1, len(wps) - 1):
-            trj_heading_x = wps[i][0].transform.location.x - self._wps[-1][0].transform.location.x
-            trj_heading_y = wps[i][0].transform.location.y - self._wps[-1][0].transform.location.y
-            
-            dd = hypot(trj_heading_x, trj_heading_y)
-            if dd > 0:
-                self._wps.append(wps[i])
+        """
+        Sets trajectory to follow and filters spurious points
+
+            :param wps: RouteTrace of the trajectory
+        """
+        # A point is kept if it moved from the previous one, the last point is dropped
+        moved = np.hypot(np.diff(wps.x), np.diff(wps.y)) > 0
+        keep = np.concatenate(([True], moved[:-1]))
+        self._kept = np.flatnonzero(keep)
+        self._wps = wps.take(self._kept)
+
+        # Contiguous coordinates, segments and cumulative arc length of the kept points
+        self._x = np.ascontiguousarray(self._wps.x)
+        self._y = np.ascontiguousarray(self._wps.y)
+        self._dx, self._dy = np.diff(self._x), np.diff(self._y)
+        self._ds = np.hypot(self._dx, self._dy)
+        self._s = np.concatenate(([0.0], np.cumsum(self._ds)))
+        # Python lists are faster than numpy arrays to read one element at a time
+        self._x_list, self._y_list = self._x.tolist(), self._y.tolist()
+        self._dx, self._dy, self._ds = self._dx.tolist(), self._dy.tolist(), self._ds.tolist()
+        if not self._ds:
+            # A single point has no heading
+            self._dx, self._dy, self._ds = [0.0], [0.0], [0.0]
         
 class PIDLateralController():
     """
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Reports the time taken by every tick of the Stanley lateral controller, comparing
+the current implementation with the legacy one (closest point and lookahead searched
+one waypoint at a time over the whole trajectory), and checks that both steer the same.
+The vehicle is replayed along a route of the offline stand-in map, with lateral noise.
+
+    python controller_latency_report.py --size 6 --noise 0.5
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+
+import numpy as np
+
+import carla
+from controller import StanleyLateralController
+from global_route_planner import GlobalRoutePlanner
+from misc import get_speed
+from offline_map import OfflineMap
+from route_progress import RouteProgress
+
+
+class ReplayVehicle(object):
+    """Stand-in for the carla.Vehicle read by the controller"""
+
+    def __init__(self):
+        self.transform = carla.Transform()
+        self.velocity = carla.Vector3D()
+
+    def get_transform(self):
+        return self.transform
+
+    def get_velocity(self):
+        return self.velocity
+
+
+def legacy_steering(controller, vehicle_transform):
+    """Steering of the Stanley controller as computed before the vectorized implementation"""
+    xs, ys = controller._wps.x, controller._wps.y
+    ego_loc = vehicle_transform.location
+    min_idx, min_dist = 0, float("inf")
+    for i in range(len(xs)):
+        dist = np.linalg.norm(np.array([xs[i] - ego_loc.x, ys[i] - ego_loc.y]))
+        if dist < min_dist:
+            min_dist, min_idx = dist, i
+    total_dist, ce_idx = min_dist, min_idx
+    for i in range(min_idx + 1, len(xs)):
+        if total_dist >= controller._lookahead_distance:
+            break
+        total_dist += np.linalg.norm(np.array([xs[i] - xs[i-1], ys[i] - ys[i-1]]))
+        ce_idx = i
+
+    if ce_idx < len(xs) - 1:
+        heading_x, heading_y = xs[ce_idx+1] - xs[ce_idx], ys[ce_idx+1] - ys[ce_idx]
+    else:
+        heading_x, heading_y = xs[ce_idx] - xs[ce_idx-1], ys[ce_idx] - ys[ce_idx-1]
+    lateral_error = ((ego_loc.x - xs[ce_idx]) * heading_y - (ego_loc.y - ys[ce_idx]) * heading_x) / \
+        (math.hypot(heading_x, heading_y) + sys.float_info.epsilon)
+    steering = math.atan2(heading_y, heading_x) - np.deg2rad(vehicle_transform.rotation.yaw)
+    while steering < -np.pi:
+        steering += 2*np.pi
+    while steering > np.pi:
+        steering -= 2*np.pi
+    steering += math.atan(controller._kv * lateral_error / (controller._ks + get_speed(controller._vehicle)))
+    return np.clip(steering, -1.0, 1.0)
+
+
+def summary(latencies):
+    latencies = np.array(latencies) * 1000.0
+    return latencies.mean(), np.percentile(latencies, 95), latencies.max()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--size', default=6, type=int, help='crossings per side of the offline map')
+    argparser.add_argument('--noise', default=0.5, type=float, help='lateral noise of the replayed positions [m]')
+    argparser.add_argument('--seed', default=0, type=int)
+    args = argparser.parse_args()
+
+    wmap = OfflineMap(size=args.size)
+    grp = GlobalRoutePlanner(wmap, 2.0)
+    far = (args.size - 1) * 100.0
+    route = grp.trace_route(carla.Location(x=15.0, y=1.75), carla.Location(x=far - 20.0, y=far + 1.75))
+
+    vehicle = ReplayVehicle()
+    progress = RouteProgress()
+    progress.reset(route)
+    controller = StanleyLateralController(vehicle, K_V=4.0, K_S=1.0, progress=progress)
+    controller.setWaypoints(route)
+
+    rnd = random.Random(args.seed)
+    legacy_latencies, largest_difference = [], 0.0
+    for i in range(len(route) - 1):
+        x = route.x[i] + rnd.uniform(-args.noise, args.noise)
+        y = route.y[i] + rnd.uniform(-args.noise, args.noise)
+        vehicle.transform = carla.Transform(carla.Location(x=float(x), y=float(y)),
+                                            carla.Rotation(yaw=float(route.yaw[i]) + rnd.uniform(-5, 5)))
+        vehicle.velocity = carla.Vector3D(x=8.0)
+        progress.update(vehicle.transform.location)
+
+        steering = controller.run_step()
+        start = time.perf_counter()
+        legacy = legacy_steering(controller, vehicle.transform)
+        legacy_latencies.append(time.perf_counter() - start)
+        largest_difference = max(largest_difference, abs(steering - legacy))
+
+    info = controller.latency_info()
+    print("route of {} waypoints, {} ticks".format(len(route), info['ticks']))
+    print("{:>10} {:>10} {:>10} {:>10}".format("", "mean [ms]", "p95 [ms]", "max [ms]"))
+    print("{:>10} {:>10.3f} {:>10.3f} {:>10.3f}".format("legacy", *summary(legacy_latencies)))
+    print("{:>10} {:>10.3f} {:>10.3f} {:>10.3f}".format("current", info['mean'], info['p95'], info['max']))
+    print("largest steering difference: {:.2e}".format(largest_difference))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Checks the separating axis kernel of obb_overlap against shapely, and reports the time
+both take to test random actor bounding boxes against the corridor of a curved route.
+
+    python corridor_overlap_report.py --actors 200 --trials 50
+"""
+
+import argparse
+import time
+
+import numpy as np
+import shapely
+
+from obb_overlap import box_corners, convex_overlap
+
+
+def route_corridor(half_width, step=2.0):
+    """Returns the (m, 4, 2) quadrilaterals of a corridor along a straight line, a curve and a straight line"""
+    angle = np.linspace(0.0, np.pi / 2, 12)
+    x = np.concatenate((np.arange(0.0, 40.0, step), 40.0 + 15.0 * np.sin(angle), np.full(20, 55.0)))
+    y = np.concatenate((np.zeros(20), 15.0 - 15.0 * np.cos(angle), 15.0 + step * np.arange(1, 21)))
+    yaw = np.arctan2(np.gradient(y), np.gradient(x))
+    right_x, right_y = -np.sin(yaw), np.cos(yaw)
+    right = np.stack((x + half_width * right_x, y + half_width * right_y), axis=1)
+    left = np.stack((x - half_width * right_x, y - half_width * right_y), axis=1)
+    return np.stack((right[:-1], right[1:], left[1:], left[:-1]), axis=1)
+
+
+def shapely_overlap(boxes, quads):
+    """Overlap matrix computed one actor at a time, as the detectors did with shapely"""
+    pieces = shapely.polygons(quads)
+    overlap = np.zeros((len(boxes), len(quads)), dtype=bool)
+    for i, corners in enumerate(boxes):
+        overlap[i] = shapely.intersects(shapely.Polygon(corners.tolist()), pieces)
+    return overlap
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--actors', default=200, type=int, help='bounding boxes per trial')
+    argparser.add_argument('--trials', default=50, type=int)
+    argparser.add_argument('--seed', default=0, type=int)
+    args = argparser.parse_args()
+
+    rnd = np.random.default_rng(args.seed)
+    quads = route_corridor(half_width=1.0)
+    differences, hits = 0, 0
+    kernel_time, shapely_time = 0.0, 0.0
+    for _ in range(args.trials):
+        centers = rnd.uniform((-10.0, -15.0), (70.0, 65.0), (args.actors, 2))
+        yaws = rnd.uniform(-180.0, 180.0, args.actors)
+        extents = rnd.uniform((0.3, 0.3), (2.5, 1.1), (args.actors, 2))
+
+        start = time.perf_counter()
+        overlap = convex_overlap(box_corners(centers, yaws, extents), quads)
+        kernel_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = shapely_overlap(box_corners(centers, yaws, extents), quads)
+        shapely_time += time.perf_counter() - start
+
+        differences += int((overlap != expected).sum())
+        hits += int(expected.sum())
+
+    pairs = args.trials * args.actors * len(quads)
+    print("{} trials of {} boxes against {} corridor pieces, {} intersecting pairs".format(
+        args.trials, args.actors, len(quads), hits))
+    print("{:>10} {:>12}".format("", "ms / trial"))
+    print("{:>10} {:>12.3f}".format("shapely", shapely_time / args.trials * 1000.0))
+    print("{:>10} {:>12.3f}".format("kernel", kernel_time / args.trials * 1000.0))
+    print("pairs differing from shapely: {} / {}".format(differences, pairs))
+
+
+if __name__ == '__main__':
+    main()
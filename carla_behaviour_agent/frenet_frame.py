@@ -0,0 +1,183 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides FrenetFrame, the planned route as a reference line, and
+FrenetActors, the actors of a WorldSnapshot in the (s, d) coordinates of the route.
+"""
+
+import numpy as np
+
+
+class FrenetFrame(object):
+    """
+    FrenetFrame is a polyline with its cumulative arc length. A point is projected on
+    its closest segment, and its coordinates are:
+
+        s: arc length of the projection along the line, in meters
+        d: signed distance from the line, positive to the right (as carla's right vector)
+
+    The first and the last segments are extended past the ends of the line, so points
+    behind its start get a negative s and points past its end an s beyond its length.
+    The projection only uses the geometry of the route, not the lanes of the map.
+    """
+
+    def __init__(self, x, y, s):
+        """
+        Constructor method.
+
+            :param x, y: float64 arrays with the points of the line, at least two
+            :param s: float64 array with the arc length of every point
+        """
+        # Drop repeated points, their segments have no direction
+        keep = np.concatenate(([True], np.diff(s) > 1e-6))
+        self.x, self.y, self.s = x[keep], y[keep], s[keep]
+        self._ux = np.diff(self.x)
+        self._uy = np.diff(self.y)
+        self._length = np.hypot(self._ux, self._uy)
+
+    @classmethod
+    def from_trace(cls, trace, max_distance=None):
+        """
+        Builds the FrenetFrame of a RouteTrace, None if it has less than two distinct points
+
+            :param trace: RouteTrace of the route
+            :param max_distance: length of the route kept from its start, all of it if None
+        """
+        count = len(trace)
+        if max_distance is not None and count > 0:
+            count = trace.index_at_distance(max_distance) + 1
+        if count < 2:
+            return None
+        frame = cls(trace.x[:count], trace.y[:count], trace.distance[:count])
+        return frame if len(frame.x) >= 2 else None
+
+    def project(self, x, y):
+        """
+        Returns the (s, d) arrays of the points (x, y), projected in one vectorized step
+
+            :param x, y: arrays with the coordinates of the points
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        qx = x[:, None] - self.x[None, :-1]
+        qy = y[:, None] - self.y[None, :-1]
+        along = (qx * self._ux + qy * self._uy) / self._length
+
+        low = np.zeros(len(self._length))
+        high = self._length.copy()
+        low[0], high[-1] = -np.inf, np.inf
+        along = np.clip(along, low, high)
+
+        ratio = along / self._length
+        distance2 = (qx - ratio * self._ux) ** 2 + (qy - ratio * self._uy) ** 2
+        closest = np.argmin(distance2, axis=1)
+        rows = np.arange(len(x))
+
+        s = self.s[closest] + along[rows, closest]
+        # Distance to the line, with the side given by the closest segment
+        side = self._ux[closest] * qy[rows, closest] - self._uy[closest] * qx[rows, closest]
+        d = np.where(side < 0, -1.0, 1.0) * np.sqrt(distance2[rows, closest])
+        return s, d
+
+    def project_location(self, location):
+        """Returns the (s, d) of a carla.Location"""
+        s, d = self.project([location.x], [location.y])
+        return float(s[0]), float(d[0])
+
+    def project_snapshot(self, snapshot, max_distance):
+        """
+        Returns the FrenetActors of the actors of a WorldSnapshot closer than max_distance
+        to the ego vehicle, and of the ego vehicle itself
+
+            :param snapshot: WorldSnapshot of the current tick
+            :param max_distance: distance from the ego, in meters
+        """
+        return FrenetActors(self, snapshot, max_distance)
+
+
+class FrenetActors(object):
+    """
+    FrenetActors holds the (s, d) of the actors around the ego vehicle on a FrenetFrame,
+    and answers the usual obstacle questions as interval tests on them. Lateral tests
+    take the half width of the actors from their extents, as if they were aligned with the route.
+    """
+
+    def __init__(self, frame, snapshot, max_distance):
+        """
+        Constructor method.
+
+            :param frame: FrenetFrame of the route
+            :param snapshot: WorldSnapshot of the current tick
+            :param max_distance: only the actors closer than this to the ego vehicle are projected
+        """
+        self.frame = frame
+        self._snapshot = snapshot
+        ego_location = snapshot.ego_location
+        self.ego_s, self.ego_d = frame.project_location(ego_location)
+
+        offsets = snapshot.positions[:, :2] - (ego_location.x, ego_location.y)
+        near = np.flatnonzero((np.hypot(offsets[:, 0], offsets[:, 1]) < max_distance)
+                              & (snapshot.ids != snapshot.ego_id))
+        self.indices = near
+        self.s, self.d = frame.project(snapshot.positions[near, 0], snapshot.positions[near, 1])
+        self._rows = {actor_id: row for row, actor_id in enumerate(snapshot.ids[near].tolist())}
+
+    def coordinates(self, actor):
+        """Returns the (s, d) of an actor, (None, None) if it wasn't projected"""
+        row = self._rows.get(actor.id)
+        if row is None:
+            return (None, None)
+        return float(self.s[row]), float(self.d[row])
+
+    def _select(self, pattern, s_low, s_high, d_low, d_high):
+        """Returns the (distance along s from the ego, actor) of the actors in the intervals, sorted"""
+        snapshot = self._snapshot
+        rows = np.arange(len(self.indices))
+        if pattern is not None:
+            rows = rows[np.isin(self.indices, snapshot.indices(pattern))]
+        indices = self.indices[rows]
+        half_length, half_width = snapshot.extents[indices, 0], snapshot.extents[indices, 1]
+        ds = self.s[rows] - self.ego_s
+        d = self.d[rows]
+        inside = ((ds + half_length >= s_low) & (ds - half_length <= s_high)
+                  & (d + half_width >= d_low) & (d - half_width <= d_high))
+        found = [(float(ds[k]), snapshot.actors[indices[k]]) for k in np.flatnonzero(inside).tolist()]
+        return sorted(found, key=lambda entry: entry[0])
+
+    def in_path(self, max_distance, half_width, pattern=None, behind=0.0):
+        """
+        Returns the actors overlapping the corridor of the route from behind meters behind
+        the ego vehicle to max_distance ahead of it, as a sorted list of (distance along s, actor)
+
+            :param max_distance: length of the corridor ahead of the ego, in meters
+            :param half_width: half width of the corridor, in meters
+            :param pattern: wildcard pattern of the types of the actors, all of them if None
+            :param behind: length of the corridor behind the ego, in meters
+        """
+        return self._select(pattern, -behind, max_distance, -half_width, half_width)
+
+    def adjacent(self, side, lane_width, behind, ahead, pattern=None):
+        """
+        Returns the actors overlapping the lane next to the route, from behind meters
+        behind the ego vehicle to ahead meters ahead of it, as a sorted list of (distance along s, actor)
+
+            :param side: 1 for the lane on the right, -1 for the lane on the left
+            :param lane_width: width of the lanes, in meters
+            :param behind, ahead: extent of the interval around the ego, in meters
+            :param pattern: wildcard pattern of the types of the actors, all of them if None
+        """
+        d_low, d_high = sorted((side * lane_width / 2.0, side * lane_width * 1.5))
+        return self._select(pattern, -behind, ahead, d_low, d_high)
+
+    def behind(self, max_distance, half_width, pattern=None):
+        """
+        Returns the actors overlapping the corridor of the route behind the ego vehicle,
+        up to max_distance, as a sorted list of (distance along s, actor), closest first
+
+            :param max_distance: length of the corridor, in meters
+            :param half_width: half width of the corridor, in meters
+            :param pattern: wildcard pattern of the types of the actors, all of them if None
+        """
+        found = self._select(pattern, -max_distance, 0.0, -half_width, half_width)
+        return found[::-1]
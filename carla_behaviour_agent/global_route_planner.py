@@ -9,47 +9,621 @@ This module provides GlobalRoutePlanner implementation.
 """
 
 import math
+import pickle
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import networkx as nx
 
 import carla
 from local_planner import RoadOption
 from misc import vector
+from route_graph import CSRGraph
+from route_trace import RouteTrace
+from spatial_index import PathPointIndex
+from tile_cache import TileCache, tile_of
+import graph_cache
+
+# Planner shared with the worker processes of trace_routes, inherited when they are forked
+_batch_planner = None
+
+
+def _batch_trace_worker(tasks):
+    """Traces a group of routes in a worker process of GlobalRoutePlanner.trace_routes"""
+    grp = _batch_planner
+    items = []
+    for origin, destination, origin_wp, destination_wp in tasks:
+        items.append((carla.Location(*origin), carla.Location(*destination),
+                      graph_cache.decode_waypoint(grp._wmap, origin_wp),
+                      graph_cache.decode_waypoint(grp._wmap, destination_wp)))
+    return [RouteTrace.from_waypoints(trace, keep_waypoints=False) for trace in grp._trace_batch(items)]
 
 class GlobalRoutePlanner(object):
     """
     This class provides a very high level route plan.
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, cache_dir=None, lane_change_cost=5.0, landmarks=0,
+                 route_cache_size=128, lazy=False, tile_size=0.0, tile_budget=200000, prefetch_tiles=2,
+                 workers=1, alternatives=0, alternatives_window=200.0):
+        """
+        Constructor method.
+
+            :param wmap: carla.Map instance
+            :param sampling_resolution: distance between the waypoints of the route
+            :param cache_dir: if given, directory where the graph is cached between runs.
+                The cache is keyed by map name, OpenDRIVE hash and sampling resolution.
+            :param lane_change_cost: extra cost in meters added to every lane change
+            :param landmarks: number of landmarks used to speed up the path search, 0 to disable.
+                The landmark preprocessing is stored in the cache together with the graph.
+            :param route_cache_size: maximum number of routes kept by trace_route, 0 to disable
+            :param lazy: if True, the graph is built from the segment endpoints only, and the
+                waypoints of an edge are computed the first time the edge is used
+            :param tile_size: if positive, side in meters of the map tiles used to page the edge
+                waypoints in and out of memory. Implies lazy. With a cache_dir, every tile is
+                stored the first time it is computed and loaded from there afterwards
+            :param tile_budget: maximum number of edge waypoints kept in memory by the tiles
+            :param prefetch_tiles: number of tiles of the route loaded ahead of the ego by prefetch_ahead
+            :param workers: number of threads densifying the topology segments when the graph is built.
+                The resulting graph is the same for any number of workers
+            :param alternatives: number of alternative routes prepared by prepare_alternatives, 0 to disable
+            :param alternatives_window: length in meters of the part of the route the alternatives replace
+        """
         self._sampling_resolution = sampling_resolution
+        self._lane_change_cost = lane_change_cost
+        self._landmark_count = landmarks
+        self._lazy = lazy or tile_size > 0
+        self._lazy_probe_distance = 5 * sampling_resolution
+        self._workers = workers
         self._wmap = wmap
         self._topology = None
         self._graph = None
         self._id_map = None
         self._road_id_to_edge = None
+        self._csr = None
+        self._index = None
+        self._cache_dir = cache_dir
+        self._cache_key = None
+        self._cached_landmarks = None
+
+        # Turn decisions of the intersections, see _build_turn_table
+        self._turn_table = None
+
+        # LRU cache of the route traces, see trace_route
+        self._route_cache = OrderedDict()
+        self._route_cache_size = route_cache_size
+        self._route_cache_hits = 0
+        self._route_cache_misses = 0
+
+        # Paged edge waypoints, see _edge_path
+        self._tile_size = tile_size
+        self._tiles = None
+        self._tile_edges = None
+        self._prefetch_tiles = prefetch_tiles
+        self._route_tiles = []
+        self._route_tile_position = {}
+
+        # Alternatives to the upcoming part of the route, see prepare_alternatives
+        self._alternatives_count = alternatives
+        self._alternatives_window = alternatives_window
+        self._alternatives = OrderedDict()
+        self._alternatives_cache_size = 8
+        self._alternatives_pending = set()
+        self._alternatives_lock = threading.Lock()
+        self._alternatives_executor = None
+
+        # Held while searching and tracing, as the alternatives are computed in another thread
+        # and both share the search state of the CSR graph, the lazy edge paths and the carla.Map
+        self._planner_lock = threading.RLock()
+
+        # Build the graph, unless it has already been cached
+        cached = self._load_cache()
+        if not cached:
+            self._build_topology()
+            self._build_graph()
+            self._find_loose_ends()
+            self._build_index()
+            self._lane_change_link()
+        else:
+            self._build_index()
 
-        self._intersection_end_node = -1
-        self._previous_decision = RoadOption.VOID
+        # Array-backed copy of the graph used for the path searches
+        self._csr = CSRGraph.from_networkx(self._graph, weight=self._edge_cost)
+        self._build_turn_table()
 
-        # Build the graph
-        self._build_topology()
-        self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+        # Landmark lower bounds for the path search
+        if landmarks and not self._restore_landmarks(landmarks):
+            self._csr.build_landmarks(landmarks)
+            cached = False
+
+        if not cached:
+            self._save_cache()
+
+        if tile_size > 0:
+            self._build_tiles(tile_budget)
 
     def trace_route(self, origin, destination):
         """
-        This method returns list of (carla.Waypoint, RoadOption)
-        from origin to destination
+        This method returns a RouteTrace, the sequence of (carla.Waypoint, RoadOption)
+        from origin to destination.
+
+        Routes are kept in a LRU cache, keyed by the lane (road_id, section_id, lane_id)
+        origin and destination snap to and by their position along it, quantized to the
+        sampling resolution. The same RouteTrace is returned by every hit, so it must not be modified.
+        """
+        with self._planner_lock:
+            origin_waypoint = self._wmap.get_waypoint(origin)
+            destination_waypoint = self._wmap.get_waypoint(destination)
+            key = (self._route_cache_key(origin_waypoint), self._route_cache_key(destination_waypoint))
+
+            route_trace = self._route_cache.get(key)
+            if route_trace is not None:
+                self._route_cache.move_to_end(key)
+                self._route_cache_hits += 1
+            else:
+                self._route_cache_misses += 1
+                # With the tiles, the route doesn't keep the waypoints alive, they are rebuilt when needed
+                route_trace = RouteTrace.from_waypoints(
+                    self._trace_route(origin, destination, origin_waypoint, destination_waypoint),
+                    self._wmap, keep_waypoints=self._tiles is None)
+                if self._route_cache_size > 0:
+                    self._route_cache[key] = route_trace
+                    if len(self._route_cache) > self._route_cache_size:
+                        self._route_cache.popitem(last=False)
+
+            if self._tiles is not None:
+                self._set_route_tiles(route_trace)
+            return route_trace
+
+    def trace_routes(self, pairs, processes=0):
+        """
+        This method traces many routes at once, returning the same RouteTrace
+        as calling trace_route on every pair in order.
+        Every distinct location is snapped to the map only once, and the routes
+        leaving from the same edge share a single shortest path tree.
+
+            :param pairs: list of (origin, destination) carla.Location pairs
+            :param processes: number of worker processes tracing the routes, 0 to trace them here.
+                The workers are forked, sharing the graph of this planner; their routes
+                rebuild the carla.Waypoint objects from the map when accessed
+            :return: list of RouteTrace, one per pair
+        """
+        with self._planner_lock:
+            pairs = list(pairs)
+            if not pairs:
+                return []
+
+            # Snap every distinct location once
+            locations = [location for pair in pairs for location in pair]
+            coordinates = np.array([[l.x, l.y, l.z] for l in locations], dtype=np.float64)
+            unique, inverse = np.unique(coordinates, axis=0, return_inverse=True)
+            snapped = [self._wmap.get_waypoint(locations[i]) for i in
+                       np.unique(inverse.reshape(-1), return_index=True)[1]]
+            waypoints = [snapped[i] for i in inverse.reshape(-1)]
+
+            keys = [(self._route_cache_key(waypoints[2*i]), self._route_cache_key(waypoints[2*i+1]))
+                    for i in range(len(pairs))]
+
+            # The first pair of every route not cached yet. Without the cache,
+            # trace_route traces every pair, even those with the same key
+            ids = keys if self._route_cache_size > 0 else list(range(len(pairs)))
+            traced = {}
+            misses = []
+            for i, key in enumerate(keys):
+                if ids[i] not in traced and key not in self._route_cache:
+                    traced[ids[i]] = None
+                    misses.append(i)
+
+            items = [(pairs[i][0], pairs[i][1], waypoints[2*i], waypoints[2*i+1]) for i in misses]
+            if processes > 1 and len(items) > 1:
+                route_traces = self._trace_batch_processes(items, processes)
+            else:
+                keep_waypoints = self._tiles is None
+                route_traces = [RouteTrace.from_waypoints(trace, self._wmap, keep_waypoints=keep_waypoints)
+                                for trace in self._trace_batch(items)]
+            for i, route_trace in zip(misses, route_traces):
+                traced[ids[i]] = route_trace
+
+            # Same cache updates as a sequence of trace_route calls
+            results = []
+            for i, key in enumerate(keys):
+                route_trace = self._route_cache.get(key)
+                if route_trace is not None:
+                    self._route_cache.move_to_end(key)
+                    self._route_cache_hits += 1
+                else:
+                    self._route_cache_misses += 1
+                    route_trace = traced[ids[i]]
+                    if self._route_cache_size > 0:
+                        self._route_cache[key] = route_trace
+                        if len(self._route_cache) > self._route_cache_size:
+                            self._route_cache.popitem(last=False)
+                results.append(route_trace)
+
+            if self._tiles is not None:
+                self._set_route_tiles(results[-1])
+            return results
+
+    def _trace_batch(self, items):
+        """
+        This method traces the routes of a list of (origin, destination, origin waypoint,
+        destination waypoint), bypassing the route cache. When several routes leave from the
+        same node, its shortest path tree is searched once and used for all the paths it
+        defines unambiguously; the others fall back to the usual search.
+        """
+        edges = [(self._waypoint_edge(origin_wp), self._waypoint_edge(destination_wp))
+                 for _, _, origin_wp, destination_wp in items]
+        targets = dict()
+        for start, end in edges:
+            if start is not None and end is not None:
+                targets.setdefault(start[0], set()).add(end[0])
+
+        trees = dict()
+        node_ids = self._csr.node_ids.tolist()
+        route_traces = []
+        for (origin, destination, origin_wp, destination_wp), (start, end) in zip(items, edges):
+            route = None
+            if start is not None and end is not None and len(targets[start[0]]) > 1:
+                source = self._csr.index(start[0])
+                if source not in trees:
+                    trees[source] = self._csr.shortest_path_tree(source)
+                path = self._csr.tree_path(trees[source], source, self._csr.index(end[0]))
+                if path is not None:
+                    route = [node_ids[i] for i in path] + [end[1]]
+            route_traces.append(self._trace_route(origin, destination, origin_wp, destination_wp, route))
+        return route_traces
+
+    def _trace_batch_processes(self, items, processes):
+        """
+        This method runs _trace_batch in forked worker processes,
+        keeping together the routes leaving from the same edge
+        """
+        global _batch_planner
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            print("Warning: Worker processes can't be forked here, tracing the routes sequentially")
+            return [RouteTrace.from_waypoints(trace, self._wmap, keep_waypoints=self._tiles is None)
+                    for trace in self._trace_batch(items)]
+
+        groups = OrderedDict()
+        for index, (origin, destination, origin_wp, destination_wp) in enumerate(items):
+            # Locations and waypoints are sent in picklable form, the waypoints are already snapped
+            task = ((origin.x, origin.y, origin.z), (destination.x, destination.y, destination.z),
+                    graph_cache.encode_waypoint(origin_wp), graph_cache.encode_waypoint(destination_wp))
+            groups.setdefault(self._waypoint_edge(origin_wp), []).append((index, task))
+        groups = list(groups.values())
+
+        _batch_planner = self
+        try:
+            pool = context.Pool(processes)
+            try:
+                results = pool.map(_batch_trace_worker, [[task for _, task in group] for group in groups])
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _batch_planner = None
+
+        route_traces = [None] * len(items)
+        for group, group_traces in zip(groups, results):
+            for (index, _), route_trace in zip(group, group_traces):
+                route_trace.bind(self._wmap)
+                route_traces[index] = route_trace
+        return route_traces
+
+    def repair_route(self, plan, start_location, min_distance=0.0, max_detour=500.0):
+        """
+        This method plans a detour from start_location back onto plan, a route being
+        followed, e.g. after moving to the adjacent lane. Instead of tracing the whole
+        route again, the search stops at the first edge of plan it reaches, so only
+        the detour has to be traced and the rest of plan can be kept as it is.
+
+            :param plan: RouteTrace of the route being followed, e.g. LocalPlanner.get_plan_trace()
+            :param start_location: carla.Location where the detour starts
+            :param min_distance: distance along plan before which the detour can't rejoin it
+            :param max_detour: cost of the longest detour searched, in meters
+            :return: tuple (detour RouteTrace, index of the entry of plan the detour ends on),
+                (None, None) if plan can't be rejoined
+        """
+        with self._planner_lock:
+            start_waypoint = self._wmap.get_waypoint(start_location)
+            start = self._waypoint_edge(start_waypoint)
+            if start is None or len(plan) == 0:
+                return None, None
+
+            # The edges of plan can be rejoined at their entry node
+            targets = {}
+            edges, entries = self._plan_edges(plan)
+            for index, n1, n2 in entries:
+                if plan.distance[index] - plan.distance[0] >= min_distance and n1 not in targets:
+                    targets[n1] = (index, n2)
+
+            # The edges of plan next to the start edge can be rejoined right away with its lane
+            # change links, which _trace_route follows from start_waypoint, at the first entry
+            # of the edge past min_distance
+            for neighbor in self._graph.successors(start[0]):
+                if neighbor in targets or self._graph.edges[start[0], neighbor]['type'] not in (
+                        RoadOption.CHANGELANELEFT, RoadOption.CHANGELANERIGHT):
+                    continue
+                for index, edge in enumerate(edges):
+                    if edge is not None and edge[0] == neighbor \
+                            and plan.distance[index] - plan.distance[0] >= min_distance:
+                        targets[neighbor] = (index, edge[1])
+                        break
+            targets.pop(start[0], None)
+            if not targets:
+                return None, None
+
+            # The search starts at the entry of the start edge, to go either along it or
+            # through its lane change links
+            csr = self._csr
+            path = csr.shortest_path_to_any(
+                csr.index(start[0]), set(csr.index(node) for node in targets), max_detour)
+            if path is None:
+                return None, None
+
+            route = [int(csr.node_ids[i]) for i in path]
+            end_index, end_next = targets[route[-1]]
+            route.append(end_next)
+            detour = RouteTrace.from_waypoints(
+                self._trace_route(start_location, plan.location(end_index), start_waypoint,
+                                  plan.waypoint(end_index), route),
+                self._wmap, keep_waypoints=self._tiles is None)
+            return detour, self._rejoin_index(plan, end_index, detour)
+
+    def prepare_alternatives(self, plan):
+        """
+        This method starts computing, in a background thread, the alternatives to the part
+        of plan within the alternatives window ahead, see alternative_route.
+        Does nothing if they are already known or being computed, or if the alternatives are disabled.
+
+            :param plan: RouteTrace of the route being followed, e.g. LocalPlanner.get_plan_trace()
+        """
+        if self._alternatives_count <= 0:
+            return
+        edges, entries = self._plan_edges(plan, self._alternatives_window)
+        if len(entries) < 2:
+            return
+
+        # The window goes from the first to the last edge entered by plan within it
+        (source_index, source, _), (target_index, target, target_next) = entries[0], entries[-1]
+        key = (source, target)
+        with self._alternatives_lock:
+            if key in self._alternatives or key in self._alternatives_pending:
+                return
+            self._alternatives_pending.add(key)
+
+        avoid = set(edge for edge in edges[source_index:target_index] if edge is not None)
+        if self._alternatives_executor is None:
+            self._alternatives_executor = ThreadPoolExecutor(max_workers=1)
+        self._alternatives_executor.submit(
+            self._compute_alternatives, key, target_next, avoid,
+            plan.waypoint(source_index), plan.waypoint(target_index))
+
+    def _compute_alternatives(self, key, target_next, avoid, source_waypoint, target_waypoint):
+        """
+        This method computes and stores the alternatives of a window, see prepare_alternatives
+        """
+        try:
+            csr = self._csr
+            source, target = key
+            with self._planner_lock:
+                paths = csr.alternative_paths(
+                    csr.index(source), csr.index(target), self._alternatives_count,
+                    avoid=[(csr.index(n1), csr.index(n2)) for n1, n2 in avoid])
+
+            alternatives = []
+            for path in paths:
+                route = [int(csr.node_ids[i]) for i in path] + [target_next]
+                # One route at a time, so that the main thread waits for one trace at most
+                with self._planner_lock:
+                    trace = RouteTrace.from_waypoints(
+                        self._trace_route(source_waypoint.transform.location, target_waypoint.transform.location,
+                                          source_waypoint, target_waypoint, route),
+                        self._wmap, keep_waypoints=self._tiles is None)
+                # The last edge is only entered
+                alternatives.append((set(zip(route[:-2], route[1:-1])), trace))
+
+            with self._alternatives_lock:
+                self._alternatives[key] = alternatives
+                if len(self._alternatives) > self._alternatives_cache_size:
+                    self._alternatives.popitem(last=False)
+        except Exception as e:
+            print("Warning: Unable to compute the alternative routes: {}".format(e))
+        finally:
+            with self._alternatives_lock:
+                self._alternatives_pending.discard(key)
+
+    def alternative_route(self, plan, blocked_location):
+        """
+        This method looks up, among the alternatives computed by prepare_alternatives,
+        one that avoids the edge of blocked_location, e.g. a lane blocked by an obstacle.
+        Nothing is searched or traced, so a blocked edge not yet prepared gives no alternative.
+
+            :param plan: RouteTrace of the route being followed, e.g. LocalPlanner.get_plan_trace()
+            :param blocked_location: carla.Location of the obstacle
+            :return: tuple (alternative RouteTrace, index of the entry of plan where it starts,
+                index of the entry of plan where it ends), (None, None, None) if there's none
+        """
+        if self._alternatives_count <= 0:
+            return None, None, None
+        with self._alternatives_lock:
+            known = list(self._alternatives.items())
+        if not known:
+            return None, None, None
+
+        blocked = self._localize(blocked_location)
+        edges, entries = self._plan_edges(plan, self._alternatives_window)
+        positions = {}
+        for index, n1, _ in entries:
+            positions.setdefault(n1, index)
+
+        # The most recent windows first
+        for (source, target), alternatives in reversed(known):
+            start, end = positions.get(source), positions.get(target)
+            if start is None or end is None or end <= start or blocked not in edges[start:end]:
+                continue
+            for alternative_edges, trace in alternatives:
+                if blocked not in alternative_edges:
+                    return trace, start, self._rejoin_index(plan, end, trace)
+        return None, None, None
+
+    def _plan_edges(self, plan, max_distance=float('inf')):
+        """
+        This method returns the edges plan goes through within max_distance of its start, as
+        (list with the edge of every entry, None if it isn't part of the graph,
+        list of (index, node1, node2) of the entries lying on the entry node of their edge)
+        """
+        count = int(np.searchsorted(plan.distance, plan.distance[0] + max_distance, side='right')) \
+            if len(plan) else 0
+        edges, entries = [], []
+        previous = None
+        lanes = zip(plan.road_id[:count].tolist(), plan.section_id[:count].tolist(), plan.lane_id[:count].tolist())
+        for i, (road_id, section_id, lane_id) in enumerate(lanes):
+            edge = self._road_id_to_edge.get(road_id, {}).get(section_id, {}).get(lane_id)
+            edges.append(edge)
+            if edge is None or edge == previous:
+                continue
+            # The first edge of plan started before it, and a lane change can enter an edge past its entry
+            if previous is not None:
+                entry = self._graph.edges[edge]['entry_waypoint'].transform.location
+                if math.hypot(plan.x[i] - entry.x, plan.y[i] - entry.y) <= self._sampling_resolution:
+                    entries.append((i, edge[0], edge[1]))
+            previous = edge
+        return edges, entries
+
+    def _rejoin_index(self, plan, end_index, trace):
+        """
+        This method returns the index of the entry of plan where trace, traced to
+        the entry end_index, actually ends. A trace ending with a lane change joins
+        the edge past its entry, so the closest entry of the same lane is taken.
+        """
+        lane = (plan.road_id[end_index], plan.section_id[end_index], plan.lane_id[end_index])
+        same_lane = (plan.road_id[end_index:] == lane[0]) & (plan.section_id[end_index:] == lane[1]) \
+            & (plan.lane_id[end_index:] == lane[2])
+        count = int(np.argmin(same_lane)) if not same_lane.all() else len(same_lane)
+        gaps = np.hypot(plan.x[end_index:end_index + count] - trace.x[-1],
+                        plan.y[end_index:end_index + count] - trace.y[-1])
+        return end_index + int(np.argmin(gaps))
+
+    def get_sampling_resolution(self):
+        """Returns the distance in meters between the waypoints of the traced routes"""
+        return self._sampling_resolution
+
+    def route_cache_info(self):
+        """
+        Returns the statistics of the route cache as a dictionary
+        with the 'hits', 'misses', 'size' and 'maxsize' entries
+        """
+        return {
+            'hits': self._route_cache_hits,
+            'misses': self._route_cache_misses,
+            'size': len(self._route_cache),
+            'maxsize': self._route_cache_size,
+        }
+
+    def clear_route_cache(self):
+        """Empties the route cache, keeping its statistics"""
+        self._route_cache.clear()
+
+    def prefetch_ahead(self, location):
+        """
+        Loads in background the tiles of the last traced route that come after the one
+        containing location. Does nothing if the tiles are disabled or location is off the route.
+
+            :param location: carla.Location of the ego
+        """
+        if self._tiles is None:
+            return
+        position = self._route_tile_position.get(tile_of(location.x, location.y, self._tile_size))
+        if position is not None:
+            self._tiles.prefetch(self._route_tiles[position:position + 1 + self._prefetch_tiles])
+
+    def tile_cache_info(self):
+        """
+        Returns the statistics of the tile cache as a dictionary (see TileCache.info),
+        None if the tiles are disabled
+        """
+        if self._tiles is None:
+            return None
+        return self._tiles.info()
+
+    def _set_route_tiles(self, route_trace):
+        """
+        Stores the sequence of tiles crossed by a route, used by prefetch_ahead
+        """
+        tiles, position = [], {}
+        cells = np.floor(np.stack((route_trace.x, route_trace.y), axis=1) / self._tile_size).astype(np.int64)
+        for tile in map(tuple, cells.tolist()):
+            if tile not in position:
+                position[tile] = len(tiles)
+                tiles.append(tile)
+        self._route_tiles, self._route_tile_position = tiles, position
+
+    def _build_tiles(self, budget):
+        """
+        Assigns every lane follow edge whose waypoints are not computed yet
+        to the tile containing its entry node
+        """
+        self._tile_edges = dict()
+        for n1, n2, edge in self._graph.edges(data=True):
+            if edge['type'] != RoadOption.LANEFOLLOW or edge['path'] is not None:
+                continue
+            x, y, _ = self._graph.nodes[n1]['vertex']
+            self._tile_edges.setdefault(tile_of(x, y, self._tile_size), []).append((n1, n2))
+        self._tiles = TileCache(self._load_tile, budget)
+
+    def _tile_of_edge(self, n1, n2):
+        x, y, _ = self._graph.nodes[n1]['vertex']
+        return tile_of(x, y, self._tile_size)
+
+    def _load_tile(self, tile):
+        """
+        Returns the waypoints of the edges of a tile, from the cache directory if possible
+        """
+        path = None
+        if self._cache_dir:
+            path = graph_cache.tile_path(self._cache_dir, self._cache_key, self._tile_size, tile)
+            paths = graph_cache.load_tile(path, self._cache_key, self._wmap)
+            # A stored tile missing some of the edges is stale, and built again
+            if paths is not None and all(edge in paths for edge in self._tile_edges.get(tile, ())):
+                return paths
+
+        paths = dict()
+        for n1, n2 in self._tile_edges.get(tile, ()):
+            edge = self._graph.edges[n1, n2]
+            paths[n1, n2] = self._densify(edge['entry_waypoint'], edge['exit_waypoint']) or []
+
+        if path is not None:
+            try:
+                graph_cache.save_tile(path, self._cache_key, paths)
+            except (IOError, OSError) as e:
+                print("Warning: Unable to store the map tile '{}': {}".format(path, e))
+        return paths
+
+    def _route_cache_key(self, waypoint):
+        """
+        Returns the route cache key of a waypoint: its lane and its quantized position along it
+        """
+        return (waypoint.road_id, waypoint.section_id, waypoint.lane_id,
+                int(round(waypoint.s / self._sampling_resolution)))
+
+    def _trace_route(self, origin, destination, current_waypoint, destination_waypoint, route=None):
+        """
+        This method computes the list of (carla.Waypoint, RoadOption)
+        from origin to destination, bypassing the route cache.
+        route is the path of node ids, searched if not given.
         """
         route_trace = []
-        route = self._path_search(origin, destination)
-        current_waypoint = self._wmap.get_waypoint(origin)
-        destination_waypoint = self._wmap.get_waypoint(destination)
+        if route is None:
+            route = self._route_search(self._waypoint_edge(current_waypoint), self._waypoint_edge(destination_waypoint))
+        decisions = self._turn_decisions(route)
 
         for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
+            road_option = decisions[i]
             edge = self._graph.edges[route[i], route[i+1]]
             path = []
 
@@ -58,29 +632,88 @@ class GlobalRoutePlanner(object):
                 exit_wp = edge['exit_waypoint']
                 n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
                 next_edge = self._graph.edges[n1, n2]
-                if next_edge['path']:
-                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
-                    closest_index = min(len(next_edge['path'])-1, closest_index+5)
-                    current_waypoint = next_edge['path'][closest_index]
+                next_path = self._edge_path(n1, n2)
+                if next_path:
+                    # The index stores entry, path and exit waypoints: skip the first and the last one
+                    closest_index = self._closest_on_edge((n1, n2), current_waypoint, 1, -1) - 1
+                    closest_index = min(len(next_path)-1, closest_index+5)
+                    current_waypoint = next_path[closest_index]
                 else:
                     current_waypoint = next_edge['exit_waypoint']
                 route_trace.append((current_waypoint, road_option))
 
             else:
-                path = path + [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
-                closest_index = self._find_closest_in_list(current_waypoint, path)
+                path = path + [edge['entry_waypoint']] + self._edge_path(route[i], route[i+1]) + [edge['exit_waypoint']]
+                closest_index = self._closest_on_edge((route[i], route[i+1]), current_waypoint)
                 for waypoint in path[closest_index:]:
                     current_waypoint = waypoint
                     route_trace.append((current_waypoint, road_option))
                     if len(route)-i <= 2 and waypoint.transform.location.distance(destination) < 2*self._sampling_resolution:
                         break
                     elif len(route)-i <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
-                        destination_index = self._find_closest_in_list(destination_waypoint, path)
+                        destination_index = self._closest_on_edge((route[i], route[i+1]), destination_waypoint)
                         if closest_index > destination_index:
                             break
 
         return route_trace
 
+    def _load_cache(self):
+        """
+        Restores the topology and the graph from the cache directory.
+        Returns True if the cache was found and matches the current map.
+        """
+        if not self._cache_dir:
+            return False
+
+        self._cache_key = graph_cache.cache_key(self._wmap, self._sampling_resolution, self._lazy)
+        state = graph_cache.load(
+            graph_cache.cache_path(self._cache_dir, self._cache_key), self._cache_key, self._wmap)
+        if state is None:
+            return False
+
+        self._topology = state['topology']
+        self._graph = state['graph']
+        self._id_map = state['id_map']
+        self._road_id_to_edge = state['road_id_to_edge']
+        self._cached_landmarks = state['landmarks']
+        return True
+
+    def _restore_landmarks(self, count):
+        """
+        Sets the cached landmarks to the CSR graph.
+        Returns True if they were computed with the same number of landmarks and edge costs.
+        """
+        data = self._cached_landmarks
+        if not data or data['count'] != count or data['lane_change_cost'] != self._lane_change_cost:
+            return False
+
+        self._csr.set_landmarks(data['landmarks'], data['from'], data['to'])
+        return True
+
+    def _save_cache(self):
+        """
+        Stores the topology and the graph in the cache directory, if any
+        """
+        if not self._cache_dir:
+            return
+
+        landmarks = None
+        if self._csr.landmarks is not None:
+            landmarks = {
+                'count': self._landmark_count,
+                'lane_change_cost': self._lane_change_cost,
+                'landmarks': self._csr.landmarks,
+                'from': self._csr.landmark_from,
+                'to': self._csr.landmark_to,
+            }
+
+        try:
+            graph_cache.save(graph_cache.cache_path(self._cache_dir, self._cache_key), self._cache_key,
+                             self._topology, self._graph, self._id_map, self._road_id_to_edge,
+                             landmarks=landmarks)
+        except (OSError, pickle.PicklingError) as e:
+            print("Warning: Unable to save the route planner cache: {}".format(e))
+
     def _build_topology(self):
         """
         This function retrieves topology from the server as a list of
@@ -91,35 +724,106 @@ class GlobalRoutePlanner(object):
         - entryxyz (tuple): (x,y,z) of entry point of road segment
         - exit (carla.Waypoint): waypoint of exit point of road segment
         - exitxyz (tuple): (x,y,z) of exit point of road segment
-        - path (list of carla.Waypoint):  list of waypoints between entry to exit, separated by the resolution
-        """
-        self._topology = []
-        # Retrieving waypoints to construct a detailed topology
-        for segment in self._wmap.get_topology():
-            wp1, wp2 = segment[0], segment[1]
-            l1, l2 = wp1.transform.location, wp2.transform.location
-            # Rounding off to avoid floating point imprecision
-            x1, y1, z1, x2, y2, z2 = np.round([l1.x, l1.y, l1.z, l2.x, l2.y, l2.z], 0)
-            wp1.transform.location, wp2.transform.location = l1, l2
-            seg_dict = dict()
-            seg_dict['entry'], seg_dict['exit'] = wp1, wp2
-            seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
-            seg_dict['path'] = []
-            endloc = wp2.transform.location
-            if wp1.transform.location.distance(endloc) > self._sampling_resolution:
-                w = wp1.next(self._sampling_resolution)[0]
-                while w.transform.location.distance(endloc) > self._sampling_resolution:
-                    seg_dict['path'].append(w)
-                    next_ws = w.next(self._sampling_resolution)
-                    if len(next_ws) == 0:
-                        break
-                    w = next_ws[0]
-            else:
-                next_wps = wp1.next(self._sampling_resolution)
-                if len(next_wps) == 0:
-                    continue
-                seg_dict['path'].append(next_wps[0])
-            self._topology.append(seg_dict)
+        - path (list of carla.Waypoint):  list of waypoints between entry to exit, separated by the resolution.
+            None in lazy mode, see _edge_path
+        """
+        # Retrieving waypoints to construct a detailed topology.
+        # The segments keep the order of get_topology, so that node ids don't depend on the workers
+        segments = self._map_segments(self._topology_segment, self._wmap.get_topology())
+        self._topology = [seg_dict for seg_dict in segments if seg_dict is not None]
+
+    def _topology_segment(self, segment):
+        """
+        This function processes a segment of the topology as described in _build_topology,
+        returning None if the segment has to be skipped
+        """
+        wp1, wp2 = segment[0], segment[1]
+        l1, l2 = wp1.transform.location, wp2.transform.location
+        # Rounding off to avoid floating point imprecision
+        x1, y1, z1, x2, y2, z2 = np.round([l1.x, l1.y, l1.z, l2.x, l2.y, l2.z], 0)
+        wp1.transform.location, wp2.transform.location = l1, l2
+        seg_dict = dict()
+        seg_dict['entry'], seg_dict['exit'] = wp1, wp2
+        seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
+        if self._lazy:
+            # Segments shorter than the resolution with nothing after them are skipped
+            if l1.distance(l2) <= self._sampling_resolution \
+                    and len(wp1.next(self._sampling_resolution)) == 0:
+                return None
+            seg_dict['path'] = None
+        else:
+            seg_dict['path'] = self._densify(wp1, wp2)
+            if seg_dict['path'] is None:
+                return None
+        return seg_dict
+
+    def _map_segments(self, function, segments):
+        """
+        This function applies function to every segment, using the worker threads if any,
+        and returns the results in the same order as segments
+        """
+        if self._workers > 1:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                return list(executor.map(function, segments))
+        return [function(segment) for segment in segments]
+
+    def _densify(self, entry_wp, exit_wp):
+        """
+        This function returns the list of waypoints between entry_wp and exit_wp,
+        separated by the resolution. None if the segment is shorter than the
+        resolution and there is no waypoint after it.
+        """
+        path = []
+        endloc = exit_wp.transform.location
+        if entry_wp.transform.location.distance(endloc) > self._sampling_resolution:
+            w = entry_wp.next(self._sampling_resolution)[0]
+            while w.transform.location.distance(endloc) > self._sampling_resolution:
+                path.append(w)
+                next_ws = w.next(self._sampling_resolution)
+                if len(next_ws) == 0:
+                    break
+                w = next_ws[0]
+        else:
+            next_wps = entry_wp.next(self._sampling_resolution)
+            if len(next_wps) == 0:
+                return None
+            path.append(next_wps[0])
+        return path
+
+    def _edge_path(self, n1, n2):
+        """
+        This function returns the path waypoints of the edge (n1, n2),
+        computing them the first time in lazy mode.
+        With the tiles enabled, the waypoints are kept by the tile cache instead of the graph.
+        """
+        edge = self._graph.edges[n1, n2]
+        if edge['path'] is None and self._tiles is not None:
+            path = self._tiles.get(self._tile_of_edge(n1, n2)).get((n1, n2))
+            if path is not None:
+                return path
+            # Edge missing from its tile: compute it without keeping it
+            return self._densify(edge['entry_waypoint'], edge['exit_waypoint']) or []
+        if edge['path'] is None:
+            edge['path'] = self._densify(edge['entry_waypoint'], edge['exit_waypoint']) or []
+        return edge['path']
+
+    def materialize_around(self, location, radius):
+        """
+        In lazy mode, computes the waypoints of every edge with an end closer
+        than radius to location. Does nothing otherwise.
+
+            :param location: carla.Location at the center of the area
+            :param radius: radius of the area in meters
+        """
+        with self._planner_lock:
+            if not self._lazy:
+                return
+            center = np.array([location.x, location.y, location.z])
+            near = np.linalg.norm(self._csr.coordinates - center, axis=1) <= radius
+            node_ids = set(self._csr.node_ids[near].tolist())
+            for n1, n2, edge in self._graph.edges(data=True):
+                if edge['type'] == RoadOption.LANEFOLLOW and (n1 in node_ids or n2 in node_ids):
+                    self._edge_path(n1, n2)
 
     def _build_graph(self):
         """
@@ -128,6 +832,7 @@ class GlobalRoutePlanner(object):
             Node properties:
                 vertex: (x,y,z) position in world map
             Edge properties:
+                length: arc length of the edge in meters
                 entry_vector: unit vector along tangent at entry point
                 exit_vector: unit vector along tangent at exit point
                 net_vector: unit vector of the chord from entry to exit
@@ -167,7 +872,7 @@ class GlobalRoutePlanner(object):
             # Adding edge with attributes
             self._graph.add_edge(
                 n1, n2,
-                length=len(path) + 1, path=path,
+                length=self._segment_length(n1, n2, segment), path=path,
                 entry_waypoint=entry_wp, exit_waypoint=exit_wp,
                 entry_vector=np.array(
                     [entry_carla_vector.x, entry_carla_vector.y, entry_carla_vector.z]),
@@ -182,7 +887,7 @@ class GlobalRoutePlanner(object):
         adds them to the internal graph representation
         """
         count_loose_ends = 0
-        hop_resolution = self._sampling_resolution
+        loose_ends = []
         for segment in self._topology:
             end_wp = segment['exit']
             exit_xyz = segment['exitxyz']
@@ -200,36 +905,50 @@ class GlobalRoutePlanner(object):
                 n1 = self._id_map[exit_xyz]
                 n2 = -1*count_loose_ends
                 self._road_id_to_edge[road_id][section_id][lane_id] = (n1, n2)
-                next_wp = end_wp.next(hop_resolution)
-                path = []
-                while next_wp is not None and next_wp \
-                        and next_wp[0].road_id == road_id \
-                        and next_wp[0].section_id == section_id \
-                        and next_wp[0].lane_id == lane_id:
-                    path.append(next_wp[0])
-                    next_wp = next_wp[0].next(hop_resolution)
-                if path:
-                    n2_xyz = (path[-1].transform.location.x,
-                              path[-1].transform.location.y,
-                              path[-1].transform.location.z)
-                    self._graph.add_node(n2, vertex=n2_xyz)
-                    self._graph.add_edge(
-                        n1, n2,
-                        length=len(path) + 1, path=path,
-                        entry_waypoint=end_wp, exit_waypoint=path[-1],
-                        entry_vector=None, exit_vector=None, net_vector=None,
-                        intersection=end_wp.is_junction, type=RoadOption.LANEFOLLOW)
+                loose_ends.append((n1, n2, end_wp))
+
+        # Following the loose ends is independent for each of them, the graph is updated in order afterwards
+        paths = self._map_segments(self._loose_end_path, [end_wp for _, _, end_wp in loose_ends])
+        for (n1, n2, end_wp), path in zip(loose_ends, paths):
+            if path:
+                n2_xyz = (path[-1].transform.location.x,
+                          path[-1].transform.location.y,
+                          path[-1].transform.location.z)
+                self._graph.add_node(n2, vertex=n2_xyz)
+                self._graph.add_edge(
+                    n1, n2,
+                    length=self._edge_length(n1, n2, [end_wp] + path), path=path,
+                    entry_waypoint=end_wp, exit_waypoint=path[-1],
+                    entry_vector=None, exit_vector=None, net_vector=None,
+                    intersection=end_wp.is_junction, type=RoadOption.LANEFOLLOW)
+
+    def _loose_end_path(self, end_wp):
+        """
+        This function returns the waypoints following end_wp on its same lane
+        """
+        hop_resolution = self._sampling_resolution
+        road_id, section_id, lane_id = end_wp.road_id, end_wp.section_id, end_wp.lane_id
+        next_wp = end_wp.next(hop_resolution)
+        path = []
+        while next_wp is not None and next_wp \
+                and next_wp[0].road_id == road_id \
+                and next_wp[0].section_id == section_id \
+                and next_wp[0].lane_id == lane_id:
+            path.append(next_wp[0])
+            next_wp = next_wp[0].next(hop_resolution)
+        return path
 
     def _lane_change_link(self):
         """
-        This method places zero cost links in the topology graph
-        representing availability of lane changes.
+        This method places links in the topology graph representing availability
+        of lane changes. Their length is the distance between the two nodes,
+        the lane change penalty is added by _edge_cost.
         """
 
         for segment in self._topology:
             left_found, right_found = False, False
 
-            for waypoint in segment['path']:
+            for waypoint in self._lane_change_candidates(segment):
                 if not segment['entry'].is_junction:
                     next_waypoint, next_road_option, next_segment = None, None, None
 
@@ -239,12 +958,14 @@ class GlobalRoutePlanner(object):
                                 and next_waypoint.lane_type == carla.LaneType.Driving \
                                 and waypoint.road_id == next_waypoint.road_id:
                             next_road_option = RoadOption.CHANGELANERIGHT
-                            next_segment = self._localize(next_waypoint.transform.location)
+                            next_segment = self._waypoint_edge(next_waypoint)
                             if next_segment is not None:
+                                n1 = self._id_map[segment['entryxyz']]
                                 self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
+                                    n1, next_segment[0], entry_waypoint=waypoint,
                                     exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
+                                    path=[], length=self._edge_length(n1, next_segment[0]),
+                                    type=next_road_option, change_waypoint=next_waypoint)
                                 right_found = True
                     if waypoint.left_lane_marking and waypoint.left_lane_marking.lane_change & carla.LaneChange.Left and not left_found:
                         next_waypoint = waypoint.get_left_lane()
@@ -252,22 +973,120 @@ class GlobalRoutePlanner(object):
                                 and next_waypoint.lane_type == carla.LaneType.Driving \
                                 and waypoint.road_id == next_waypoint.road_id:
                             next_road_option = RoadOption.CHANGELANELEFT
-                            next_segment = self._localize(next_waypoint.transform.location)
+                            next_segment = self._waypoint_edge(next_waypoint)
                             if next_segment is not None:
+                                n1 = self._id_map[segment['entryxyz']]
                                 self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
+                                    n1, next_segment[0], entry_waypoint=waypoint,
                                     exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
+                                    path=[], length=self._edge_length(n1, next_segment[0]),
+                                    type=next_road_option, change_waypoint=next_waypoint)
                                 left_found = True
                 if left_found and right_found:
                     break
 
+    def _segment_length(self, n1, n2, segment):
+        """
+        Returns the length in meters of the edge of a topology segment.
+        In lazy mode it comes from the OpenDRIVE s coordinates of its ends.
+        """
+        entry_wp, exit_wp = segment['entry'], segment['exit']
+        if segment['path'] is None:
+            return max(abs(exit_wp.s - entry_wp.s), self._edge_length(n1, n2))
+        return self._edge_length(n1, n2, [entry_wp] + segment['path'] + [exit_wp])
+
+    def _edge_length(self, n1, n2, waypoints=()):
+        """
+        Returns the length in meters of the edge between nodes n1 and n2,
+        following the given waypoints. It is never shorter than the straight
+        line between the two nodes, so that the distance heuristic stays consistent.
+        """
+        length = 0
+        for wp1, wp2 in zip(waypoints[:-1], waypoints[1:]):
+            length += wp1.transform.location.distance(wp2.transform.location)
+
+        x1, y1, z1 = self._graph.nodes[n1]['vertex']
+        x2, y2, z2 = self._graph.nodes[n2]['vertex']
+        return max(length, math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2))
+
+    def _edge_cost(self, edge):
+        """
+        Cost used by the path search to traverse an edge, in meters
+        """
+        if edge['type'] in (RoadOption.CHANGELANELEFT, RoadOption.CHANGELANERIGHT):
+            return edge['length'] + self._lane_change_cost
+        return edge['length']
+
+    def _lane_change_candidates(self, segment):
+        """
+        This function yields the waypoints of a segment where lane changes are looked for.
+        In lazy mode the segment is probed every few waypoints instead of being densified.
+        """
+        if segment['path'] is not None:
+            for waypoint in segment['path']:
+                yield waypoint
+            return
+
+        endloc = segment['exit'].transform.location
+        next_wps = segment['entry'].next(self._sampling_resolution)
+        while next_wps:
+            waypoint = next_wps[0]
+            yield waypoint
+            if waypoint.transform.location.distance(endloc) <= self._lazy_probe_distance:
+                break
+            next_wps = waypoint.next(self._lazy_probe_distance)
+
+    def _build_index(self):
+        """
+        This function builds the spatial index over the waypoints of every lane follow edge,
+        stored in the same order used by trace_route: entry waypoint, path, exit waypoint.
+        In lazy mode only the edges whose waypoints are already computed are indexed.
+        """
+        def edge_points():
+            for n1, n2, edge in self._graph.edges(data=True):
+                if edge['type'] != RoadOption.LANEFOLLOW or edge['path'] is None:
+                    continue
+                waypoints = [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
+                locations = [wp.transform.location for wp in waypoints]
+                yield (n1, n2), [(l.x, l.y, l.z) for l in locations]
+
+        self._index = PathPointIndex(cell_size=2 * self._sampling_resolution)
+        self._index.build(edge_points())
+
+    def _closest_on_edge(self, edge, waypoint, start=0, end=None):
+        """
+        Returns the index of the waypoint of an edge closest to the given one
+        """
+        location = waypoint.transform.location
+        if edge in self._index:
+            return self._index.closest_on_edge(edge, location.x, location.y, location.z, start, end)
+
+        # Edge not indexed, computed lazily
+        attributes = self._graph.edges[edge]
+        waypoints = [attributes['entry_waypoint']] + self._edge_path(*edge) + [attributes['exit_waypoint']]
+        start, end, _ = slice(start, end).indices(len(waypoints))
+        if end <= start:
+            return -1
+        distances = [wp.transform.location.distance(location) for wp in waypoints[start:end]]
+        return start + int(np.argmin(distances))
+
     def _localize(self, location):
         """
         This function finds the road segment that a given location
-        is part of, returning the edge it belongs to
+        is part of, returning the edge it belongs to.
+        The spatial index is used when a waypoint of the graph is close enough,
+        the carla.Map is queried otherwise.
+        """
+        nearest = self._index.nearest(location.x, location.y, location.z, self._sampling_resolution)
+        if nearest is not None:
+            return nearest[0]
+
+        return self._waypoint_edge(self._wmap.get_waypoint(location))
+
+    def _waypoint_edge(self, waypoint):
+        """
+        This function returns the edge a waypoint belongs to, None if it isn't part of the graph
         """
-        waypoint = self._wmap.get_waypoint(location)
         edge = None
         try:
             edge = self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
@@ -275,36 +1094,32 @@ class GlobalRoutePlanner(object):
             pass
         return edge
 
-    def _distance_heuristic(self, n1, n2):
-        """
-        Distance heuristic calculator for path searching
-        in self._graph
-        """
-        l1 = np.array(self._graph.nodes[n1]['vertex'])
-        l2 = np.array(self._graph.nodes[n2]['vertex'])
-        return np.linalg.norm(l1-l2)
-
     def _path_search(self, origin, destination):
         """
         This function finds the shortest path connecting origin and destination
-        using A* search with distance heuristic.
+        using A* search with distance heuristic over the CSR copy of self._graph.
         origin      :   carla.Location object of start position
         destination :   carla.Location object of of end position
         return      :   path as list of node ids (as int) of the graph self._graph
         connecting origin and destination
         """
-        start, end = self._localize(origin), self._localize(destination)
+        return self._route_search(self._localize(origin), self._localize(destination))
 
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
+    def _route_search(self, start, end):
+        """
+        This function finds the shortest path connecting two edges of the graph
+        start       :   (n1, n2) edge of the start position
+        end         :   (n1, n2) edge of the end position
+        return      :   path as list of node ids from start[0] to end[1]
+        """
+        route = self._csr.shortest_path_ids(start[0], end[0])
         route.append(end[1])
         return route
 
     def _successive_last_intersection_edge(self, index, route):
         """
         This method returns the last successive intersection edge
-        from a starting index on the route.
+        from a starting index on the route, as (last node, (node1, node2)).
         This helps moving past tiny intersection edges to calculate
         proper turn decisions.
         """
@@ -314,85 +1129,119 @@ class GlobalRoutePlanner(object):
         for node1, node2 in [(route[i], route[i+1]) for i in range(index, len(route)-1)]:
             candidate_edge = self._graph.edges[node1, node2]
             if node1 == route[index]:
-                last_intersection_edge = candidate_edge
+                last_intersection_edge = (node1, node2)
             if candidate_edge['type'] == RoadOption.LANEFOLLOW and candidate_edge['intersection']:
-                last_intersection_edge = candidate_edge
+                last_intersection_edge = (node1, node2)
                 last_node = node2
             else:
                 break
 
         return last_node, last_intersection_edge
 
-    def _turn_decision(self, index, route, threshold=math.radians(35)):
+    def _build_turn_table(self):
         """
-        This method returns the turn decision (RoadOption) for pair of edges
-        around current index of route list
+        This method precomputes the turn decision of every way of crossing an intersection:
+        for every lane follow edge (previous, current) reaching an intersection, every
+        intersection edge (current, next) leaving it, and every edge (node1, node2) ending
+        a chain of successive intersection edges from (current, next), the table maps
+        (previous, current, next, node1, node2) to the RoadOption of the turn.
         """
+        self._turn_table = dict()
+        for previous_node, current_node, current_edge in self._graph.edges(data=True):
+            if current_edge['type'] != RoadOption.LANEFOLLOW or current_edge['intersection']:
+                continue
+            for next_node in self._graph.successors(current_node):
+                next_edge = self._graph.edges[current_node, next_node]
+                if next_edge['type'] != RoadOption.LANEFOLLOW or not next_edge['intersection']:
+                    continue
+                for tail in self._intersection_chain_ends(current_node, next_node):
+                    self._turn_table[previous_node, current_node, next_node, tail[0], tail[1]] = \
+                        self._classify_turn(current_edge, current_node, next_node, self._graph.edges[tail])
 
+    def _intersection_chain_ends(self, node1, node2):
+        """
+        This method returns every intersection edge that can end a chain of successive
+        intersection edges starting with (node1, node2), the latter included.
+        These are the intersection edges reachable from (node1, node2), each visited once.
+        """
+        ends = {(node1, node2)}
+        stack = [(node1, node2)]
+        while stack:
+            last_node = stack.pop()[1]
+            for neighbor in self._graph.successors(last_node):
+                edge = self._graph.edges[last_node, neighbor]
+                if edge['type'] == RoadOption.LANEFOLLOW and edge['intersection'] \
+                        and (last_node, neighbor) not in ends:
+                    ends.add((last_node, neighbor))
+                    stack.append((last_node, neighbor))
+        return ends
+
+    def _classify_turn(self, current_edge, current_node, next_node, tail_edge, threshold=math.radians(35)):
+        """
+        This method returns the turn (RoadOption) taken going from current_edge to
+        tail_edge through the intersection edge (current_node, next_node),
+        comparing it with the other lane follow edges leaving current_node.
+        If an exit vector is missing, the type of tail_edge is returned instead, and
+        None if the direction matches none of the cases.
+        """
+        cv, nv = current_edge['exit_vector'], tail_edge['exit_vector']
+        if cv is None or nv is None:
+            return tail_edge['type']
+        cross_list = []
+        for neighbor in self._graph.successors(current_node):
+            select_edge = self._graph.edges[current_node, neighbor]
+            if select_edge['type'] == RoadOption.LANEFOLLOW:
+                if neighbor != next_node:
+                    sv = select_edge['net_vector']
+                    cross_list.append(np.cross(cv, sv)[2])
+        next_cross = np.cross(cv, nv)[2]
+        deviation = math.acos(np.clip(
+            np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
+        if not cross_list:
+            cross_list.append(0)
         decision = None
-        previous_node = route[index-1]
-        current_node = route[index]
-        next_node = route[index+1]
-        next_edge = self._graph.edges[current_node, next_node]
-        if index > 0:
-            if self._previous_decision != RoadOption.VOID \
-                    and self._intersection_end_node > 0 \
-                    and self._intersection_end_node != previous_node \
-                    and next_edge['type'] == RoadOption.LANEFOLLOW \
-                    and next_edge['intersection']:
-                decision = self._previous_decision
-            else:
-                self._intersection_end_node = -1
-                current_edge = self._graph.edges[previous_node, current_node]
-                calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
-                    'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
-                if calculate_turn:
-                    last_node, tail_edge = self._successive_last_intersection_edge(index, route)
-                    self._intersection_end_node = last_node
-                    if tail_edge is not None:
-                        next_edge = tail_edge
-                    cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
-                    if cv is None or nv is None:
-                        return next_edge['type']
-                    cross_list = []
-                    for neighbor in self._graph.successors(current_node):
-                        select_edge = self._graph.edges[current_node, neighbor]
-                        if select_edge['type'] == RoadOption.LANEFOLLOW:
-                            if neighbor != route[index+1]:
-                                sv = select_edge['net_vector']
-                                cross_list.append(np.cross(cv, sv)[2])
-                    next_cross = np.cross(cv, nv)[2]
-                    deviation = math.acos(np.clip(
-                        np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
-                    if not cross_list:
-                        cross_list.append(0)
-                    if deviation < threshold:
-                        decision = RoadOption.STRAIGHT
-                    elif cross_list and next_cross < min(cross_list):
-                        decision = RoadOption.LEFT
-                    elif cross_list and next_cross > max(cross_list):
-                        decision = RoadOption.RIGHT
-                    elif next_cross < 0:
-                        decision = RoadOption.LEFT
-                    elif next_cross > 0:
-                        decision = RoadOption.RIGHT
-                else:
-                    decision = next_edge['type']
+        if deviation < threshold:
+            decision = RoadOption.STRAIGHT
+        elif cross_list and next_cross < min(cross_list):
+            decision = RoadOption.LEFT
+        elif cross_list and next_cross > max(cross_list):
+            decision = RoadOption.RIGHT
+        elif next_cross < 0:
+            decision = RoadOption.LEFT
+        elif next_cross > 0:
+            decision = RoadOption.RIGHT
+        return decision
 
-        else:
+    def _turn_decisions(self, route):
+        """
+        This method returns the turn decision (RoadOption) of every edge of the route.
+        Edges inside an intersection keep the decision taken when entering it.
+        """
+        decisions = []
+        previous_decision = RoadOption.VOID
+        intersection_end_node = -1
+        for index in range(len(route) - 1):
+            current_node, next_node = route[index], route[index+1]
+            next_edge = self._graph.edges[current_node, next_node]
             decision = next_edge['type']
+            if index > 0:
+                previous_node = route[index-1]
+                if previous_decision != RoadOption.VOID \
+                        and intersection_end_node > 0 \
+                        and intersection_end_node != previous_node \
+                        and next_edge['type'] == RoadOption.LANEFOLLOW \
+                        and next_edge['intersection']:
+                    decision = previous_decision
+                else:
+                    intersection_end_node = -1
+                    current_edge = self._graph.edges[previous_node, current_node]
+                    calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
+                        'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
+                    if calculate_turn:
+                        intersection_end_node, tail = self._successive_last_intersection_edge(index, route)
+                        decision = self._turn_table[previous_node, current_node, next_node, tail[0], tail[1]]
 
-        self._previous_decision = decision
-        return decision
+            previous_decision = decision
+            decisions.append(decision)
 
-    def _find_closest_in_list(self, current_waypoint, waypoint_list):
-        min_distance = float('inf')
-        closest_index = -1
-        for i, waypoint in enumerate(waypoint_list):
-            distance = waypoint.transform.location.distance(
-                current_waypoint.transform.location)
-            if distance < min_distance:
-                min_distance = distance
-                closest_index = i
-
-        return closest_index
+        return decisions
@@ -0,0 +1,240 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides an on-disk cache for the GlobalRoutePlanner topology and graph.
+
+carla.Waypoint objects can't be pickled, so every waypoint is stored by its
+OpenDRIVE coordinates (road_id, lane_id, s) together with its location, and
+rebuilt with carla.Map.get_waypoint_xodr when the cache is loaded.
+"""
+
+import os
+import pickle
+import hashlib
+
+import networkx as nx
+
+import carla
+
+# Bump this whenever the layout of the cached data changes
+CACHE_VERSION = 3
+
+WAYPOINT_ATTRIBUTES = ('entry_waypoint', 'exit_waypoint', 'change_waypoint')
+
+
+def cache_key(wmap, sampling_resolution, lazy=False):
+    """
+    Returns the key identifying the graph of a map
+
+        :param wmap: carla.Map instance
+        :param sampling_resolution: sampling resolution of the route planner
+        :param lazy: whether the graph is built in lazy mode
+        :return: tuple (version, map name, OpenDRIVE hash, sampling resolution, lazy)
+    """
+    opendrive_hash = hashlib.sha1(wmap.to_opendrive().encode('utf-8')).hexdigest()
+    return (CACHE_VERSION, wmap.name, opendrive_hash, float(sampling_resolution), bool(lazy))
+
+
+def cache_path(cache_dir, key):
+    """
+    Returns the file used to store the graph identified by key
+
+        :param cache_dir: directory of the cache files
+        :param key: key returned by cache_key
+    """
+    map_name = key[1].split('/')[-1]
+    suffix = '_lazy' if key[4] else ''
+    return os.path.join(cache_dir, "{}_{}_{}{}.grp".format(map_name, key[2][:16], key[3], suffix))
+
+
+def tile_path(cache_dir, key, tile_size, tile):
+    """
+    Returns the file used to store the edge waypoints of a map tile.
+    Every tile size has its own directory, as the same (i, j) covers different edges.
+
+        :param cache_dir: directory of the cache files
+        :param key: key returned by cache_key
+        :param tile_size: side of the tiles in meters
+        :param tile: (i, j) tile
+    """
+    directory = "{}_tiles_{}".format(os.path.splitext(cache_path(cache_dir, key))[0], float(tile_size))
+    return os.path.join(directory, "{}_{}.tile".format(tile[0], tile[1]))
+
+
+def _encode_path(path):
+    # Paths are None in lazy mode until they are computed
+    if path is None:
+        return None
+    return [encode_waypoint(wp) for wp in path]
+
+
+def _decode_path(wmap, path, memo):
+    if path is None:
+        return None
+    return [decode_waypoint(wmap, wp, memo) for wp in path]
+
+
+def encode_waypoint(waypoint):
+    """Returns a picklable representation of a carla.Waypoint"""
+    location = waypoint.transform.location
+    return (waypoint.road_id, waypoint.lane_id, waypoint.s, location.x, location.y, location.z)
+
+
+def decode_waypoint(wmap, encoded, memo=None):
+    """
+    Rebuilds a carla.Waypoint from the output of encode_waypoint
+
+        :param wmap: carla.Map instance
+        :param encoded: encoded waypoint
+        :param memo: optional dictionary used to share the waypoints decoded more than once
+    """
+    if memo is not None and encoded in memo:
+        return memo[encoded]
+
+    road_id, lane_id, s, x, y, z = encoded
+    waypoint = wmap.get_waypoint_xodr(road_id, lane_id, s)
+    if waypoint is None:
+        # Floating point imprecision at the end of the road, project the location instead
+        waypoint = wmap.get_waypoint(carla.Location(x=x, y=y, z=z))
+
+    if memo is not None:
+        memo[encoded] = waypoint
+    return waypoint
+
+
+def _encode_edge(attributes):
+    encoded = dict(attributes)
+    for name in WAYPOINT_ATTRIBUTES:
+        if name in encoded:
+            encoded[name] = encode_waypoint(encoded[name])
+    encoded['path'] = _encode_path(encoded['path'])
+    return encoded
+
+
+def _decode_edge(wmap, encoded, memo):
+    attributes = dict(encoded)
+    for name in WAYPOINT_ATTRIBUTES:
+        if name in attributes:
+            attributes[name] = decode_waypoint(wmap, attributes[name], memo)
+    attributes['path'] = _decode_path(wmap, attributes['path'], memo)
+    return attributes
+
+
+def _write(path, data):
+    # Written to a temporary location first, so that an interrupted run never leaves a truncated file
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, 'wb') as fp:
+        pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _read(path):
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as fp:
+            return pickle.load(fp)
+    except Exception as e:
+        print("Warning: Ignoring the route planner cache '{}': {}".format(path, e))
+        return None
+
+
+def save(path, key, topology, graph, id_map, road_id_to_edge, landmarks=None):
+    """
+    Stores the route planner data at the given path.
+    The file is written to a temporary location first, so that an interrupted
+    run never leaves a truncated cache behind.
+
+        :param path: destination file
+        :param key: key returned by cache_key
+        :param topology: list of road segments, as built by GlobalRoutePlanner._build_topology
+        :param graph: networkx.DiGraph of the route planner
+        :param id_map: mapping from (x,y,z) to node id
+        :param road_id_to_edge: mapping from road, section and lane ids to edges
+        :param landmarks: optional dictionary with the landmark preprocessing of the graph
+    """
+    data = {
+        'key': key,
+        'topology': [{
+            'entry': encode_waypoint(segment['entry']),
+            'exit': encode_waypoint(segment['exit']),
+            'entryxyz': segment['entryxyz'],
+            'exitxyz': segment['exitxyz'],
+            'path': _encode_path(segment['path'])
+        } for segment in topology],
+        'nodes': list(graph.nodes(data=True)),
+        'edges': [(n1, n2, _encode_edge(attributes)) for n1, n2, attributes in graph.edges(data=True)],
+        'id_map': id_map,
+        'road_id_to_edge': road_id_to_edge,
+        'landmarks': landmarks,
+    }
+
+    _write(path, data)
+
+
+def load(path, key, wmap):
+    """
+    Loads the route planner data stored at the given path.
+
+        :param path: cache file
+        :param key: expected key, as returned by cache_key
+        :param wmap: carla.Map instance used to rebuild the waypoints
+        :return: dictionary with the 'topology', 'graph', 'id_map', 'road_id_to_edge' and
+            'landmarks' entries, or None if the file is missing or was built for a different key
+    """
+    data = _read(path)
+    if data is None or data.get('key') != key:
+        return None
+
+    memo = {}
+    topology = []
+    for segment in data['topology']:
+        topology.append({
+            'entry': decode_waypoint(wmap, segment['entry'], memo),
+            'exit': decode_waypoint(wmap, segment['exit'], memo),
+            'entryxyz': segment['entryxyz'],
+            'exitxyz': segment['exitxyz'],
+            'path': _decode_path(wmap, segment['path'], memo)
+        })
+
+    graph = nx.DiGraph()
+    graph.add_nodes_from(data['nodes'])
+    for n1, n2, attributes in data['edges']:
+        graph.add_edge(n1, n2, **_decode_edge(wmap, attributes, memo))
+
+    return {
+        'topology': topology,
+        'graph': graph,
+        'id_map': data['id_map'],
+        'road_id_to_edge': data['road_id_to_edge'],
+        'landmarks': data.get('landmarks'),
+    }
+
+
+def save_tile(path, key, paths):
+    """
+    Stores the edge waypoints of a map tile at the given path
+
+        :param path: destination file, see tile_path
+        :param key: key returned by cache_key
+        :param paths: dictionary {edge: [carla.Waypoint, ...]}
+    """
+    _write(path, {'key': key, 'paths': {edge: _encode_path(wps) for edge, wps in paths.items()}})
+
+
+def load_tile(path, key, wmap):
+    """
+    Loads the edge waypoints of a map tile stored at the given path
+
+        :return: dictionary {edge: [carla.Waypoint, ...]}, or None if the file
+            is missing or was built for a different key
+    """
+    data = _read(path)
+    if data is None or data.get('key') != key:
+        return None
+    memo = {}
+    return {edge: _decode_path(wmap, wps, memo) for edge, wps in data['paths'].items()}
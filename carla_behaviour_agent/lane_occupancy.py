@@ -0,0 +1,123 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides LaneOccupancy, the actors around the ego vehicle grouped by
+the lane they are in, built once per tick.
+"""
+
+from bisect import bisect_left, bisect_right
+
+import carla
+
+
+def lane_key(waypoint):
+    """Returns the (road_id, section_id, lane_id) of the lane of a waypoint"""
+    return (waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+
+
+def _direction(lane_id):
+    """Returns +1 if the lane is driven along increasing OpenDRIVE s, -1 otherwise"""
+    return 1.0 if lane_id < 0 else -1.0
+
+
+class LaneOccupancy(object):
+    """
+    LaneOccupancy maps every lane to the actors in it, sorted by their OpenDRIVE s:
+
+        (road_id, section_id, lane_id) -> [(s, actor), ...]
+
+    Every actor is projected on the map once, when the index is built. The queries take
+    a waypoint, and look for actors in its lane with a binary search on s. Distances are
+    measured along s between the projections of the actors' centers, positive in the
+    driving direction of the lane, and don't go past the lane section.
+    """
+
+    def __init__(self, snapshot, waypoint_cache, pattern="*vehicle*", max_distance=50.0):
+        """
+        Constructor method.
+
+            :param snapshot: WorldSnapshot of the current tick
+            :param waypoint_cache: WaypointCache used to project the actors
+            :param pattern: wildcard pattern of the types of the actors indexed
+            :param max_distance: only the actors closer than this to the ego vehicle are indexed
+        """
+        self._waypoints = {}
+        lanes = {}
+        for actor in snapshot.near(pattern, snapshot.ego_location, max_distance, exclude_ego=True):
+            waypoint = waypoint_cache.get_waypoint(snapshot.location(actor), lane_type=carla.LaneType.Any)
+            if waypoint is None:
+                continue
+            self._waypoints[actor.id] = waypoint
+            lanes.setdefault(lane_key(waypoint), []).append((waypoint.s, actor.id, actor))
+
+        self._s = {}
+        self._actors = {}
+        for key, entries in lanes.items():
+            entries.sort(key=lambda entry: (entry[0], entry[1]))
+            self._s[key] = [s for s, _, _ in entries]
+            self._actors[key] = [actor for _, _, actor in entries]
+
+    def __len__(self):
+        return len(self._waypoints)
+
+    def waypoint(self, actor):
+        """Returns the waypoint an actor was projected on, None if it isn't indexed"""
+        return self._waypoints.get(actor.id)
+
+    def lane(self, waypoint):
+        """Returns the [(s, actor), ...] of the lane of a waypoint, sorted by s"""
+        key = lane_key(waypoint)
+        return list(zip(self._s.get(key, []), self._actors.get(key, [])))
+
+    def within(self, waypoint, behind, ahead):
+        """
+        Returns the actors in the lane of waypoint from behind meters behind it to ahead
+        meters ahead of it, as a list of (distance, actor) sorted by distance
+
+            :param waypoint: carla.Waypoint the distances are measured from
+            :param behind: distance behind the waypoint, in meters
+            :param ahead: distance ahead of the waypoint, in meters
+        """
+        key = lane_key(waypoint)
+        s_list = self._s.get(key)
+        if not s_list:
+            return []
+        direction = _direction(waypoint.lane_id)
+        low, high = sorted((waypoint.s - direction * behind, waypoint.s + direction * ahead))
+        start, end = bisect_left(s_list, low), bisect_right(s_list, high)
+        actors = self._actors[key]
+        found = [(direction * (s_list[i] - waypoint.s), actors[i]) for i in range(start, end)]
+        return sorted(found, key=lambda entry: entry[0])
+
+    def ahead(self, waypoint, max_distance):
+        """
+        Returns the (distance, actor) of the closest actor in the lane of waypoint ahead
+        of it, not farther than max_distance, or (None, None)
+        """
+        return self._closest(waypoint, max_distance, 1.0)
+
+    def behind(self, waypoint, max_distance):
+        """
+        Returns the (distance, actor) of the closest actor in the lane of waypoint behind
+        it, not farther than max_distance, or (None, None). The distance is positive
+        """
+        return self._closest(waypoint, max_distance, -1.0)
+
+    def _closest(self, waypoint, max_distance, side):
+        key = lane_key(waypoint)
+        s_list = self._s.get(key)
+        if not s_list:
+            return (None, None)
+        # Direction of increasing s in which to search
+        step = side * _direction(waypoint.lane_id)
+        if step > 0:
+            index = bisect_right(s_list, waypoint.s)
+        else:
+            index = bisect_left(s_list, waypoint.s) - 1
+        if index < 0 or index >= len(s_list):
+            return (None, None)
+        distance = step * (s_list[index] - waypoint.s)
+        if distance > max_distance:
+            return (None, None)
+        return (distance, self._actors[key][index])
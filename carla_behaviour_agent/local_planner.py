@@ -6,12 +6,15 @@
 """ This module contains a local planner to perform low-level waypoint following based on PID controllers. """
 
 from enum import IntEnum
-from collections import deque
 import random
 
 import carla
 from controller import VehicleController
 from misc import draw_waypoints, get_speed
+from route_trace import RouteTrace
+from route_progress import RouteProgress
+from waypoint_queue import WaypointQueue
+from frenet_frame import FrenetFrame
 
 
 class RoadOption(IntEnum):
@@ -70,10 +73,18 @@ class LocalPlanner(object):
         self.target_waypoint = None
         self.target_road_option = None
 
-        self._waypoints_queue = deque(maxlen=10000)
+        self._waypoints_queue = WaypointQueue(maxlen=10000)
         self._min_waypoint_queue_length = 100
         self._stop_waypoint_creation = False
 
+        # Array-backed copy of the queue, see get_plan_trace. The first
+        # _plan_trace_offset entries have already been removed from the queue
+        self._plan_trace = None
+        self._plan_trace_offset = 0
+
+        # Position of the vehicle along the trajectory of the controller, see get_route_progress
+        self._progress = RouteProgress()
+
         # Base parameters
         self._dt = 1.0 / 20.0
         self._target_speed = 20.0  # Km/h
@@ -130,12 +141,14 @@ class LocalPlanner(object):
                                                         offset=self._offset,
                                                         max_throttle=self._max_throt,
                                                         max_brake=self._max_brake,
-                                                        max_steering=self._max_steer)
+                                                        max_steering=self._max_steer,
+                                                        progress=self._progress)
 
         # Compute the current vehicle waypoint
         current_waypoint = self._map.get_waypoint(self._vehicle.get_location())
         self.target_waypoint, self.target_road_option = (current_waypoint, RoadOption.LANEFOLLOW)
         self._waypoints_queue.append((self.target_waypoint, self.target_road_option))
+        self._plan_trace = None
 
     def set_speed(self, speed):
         """
@@ -188,14 +201,16 @@ class LocalPlanner(object):
                     road_option)]
 
             self._waypoints_queue.append((next_waypoint, road_option))
+            self._plan_trace = None
 
     def set_global_plan(self, current_plan, stop_waypoint_creation=True, clean_queue=True):
         """
         Adds a new plan to the local planner. A plan must be a list of [carla.Waypoint, RoadOption] pairs
+        or a RouteTrace.
         The 'clean_queue` parameter erases the previous plan if True, otherwise, it adds it to the old one
         The 'stop_waypoint_creation' flag stops the automatic creation of random waypoints
 
-        :param current_plan: list of (carla.Waypoint, RoadOption)
+        :param current_plan: list of (carla.Waypoint, RoadOption), or RouteTrace
         :param stop_waypoint_creation: bool
         :param clean_queue: bool
         :return:
@@ -203,57 +218,74 @@ class LocalPlanner(object):
         if clean_queue:
             self._waypoints_queue.clear()
 
-        # Remake the waypoints queue if the new plan has a higher length than the queue
-        new_plan_length = len(current_plan) + len(self._waypoints_queue)
-        if new_plan_length > self._waypoints_queue.maxlen:
-            new_waypoint_queue = deque(maxlen=new_plan_length)
-            for wp in self._waypoints_queue:
-                new_waypoint_queue.append(wp)
-            self._waypoints_queue = new_waypoint_queue
-            
-
-        for elem in current_plan:
-            self._waypoints_queue.append(elem)
+        # The queue grows if the new plan doesn't fit in it
+        self._waypoints_queue.extend(current_plan)
 
         self._stop_waypoint_creation = stop_waypoint_creation
-        self._vehicle_controller.setWaypoints(self._waypoints_queue)
 
-    def run_step(self, debug=False):
+        if clean_queue and isinstance(current_plan, RouteTrace):
+            self._plan_trace = current_plan
+        else:
+            self._plan_trace = RouteTrace.from_waypoints(self._waypoints_queue, self._map)
+        self._plan_trace_offset = 0
+        self._progress.reset(self._plan_trace)
+        self._vehicle_controller.setWaypoints(self._plan_trace)
+
+    def splice_plan(self, detour, end_index, start_index=0):
+        """
+        Replaces part of the plan with a detour, such as a lane change or an alternative route,
+        keeping the rest of the plan untouched. The detour replaces the entries from start_index
+        to end_index of the plan, as returned by GlobalRoutePlanner.repair_route or
+        GlobalRoutePlanner.alternative_route for get_plan_trace().
+
+        :param detour: list of (carla.Waypoint, RoadOption), or RouteTrace
+        :param end_index: index in the current plan of the entry the detour ends on
+        :param start_index: index in the current plan of the entry the detour starts from
+        :return:
+        """
+        if not isinstance(detour, RouteTrace):
+            detour = RouteTrace.from_waypoints(detour, self._map)
+        plan = self.get_plan_trace()
+
+        self._waypoints_queue.replace(start_index, end_index, detour)
+
+        self._plan_trace = RouteTrace.concatenate([plan[:start_index], detour, plan[end_index + 1:]], self._map)
+        self._plan_trace_offset = 0
+        self._progress.reset(self._plan_trace)
+        self._vehicle_controller.setWaypoints(self._plan_trace)
+
+    def run_step(self, debug=False, snapshot=None):
         """
         Execute one step of local planning which involves running the longitudinal and lateral PID controllers to
         follow the waypoints trajectory.
 
         :param debug: boolean flag to activate waypoints debugging
+        :param snapshot: WorldSnapshot of the current tick, shared with the controllers.
+            If None, the vehicle is queried
         :return: control to be applied
         """
         if self._follow_speed_limits:
-            self._target_speed = self._vehicle.get_speed_limit()
+            self._target_speed = snapshot.speed_limit if snapshot is not None else self._vehicle.get_speed_limit()
 
         # Add more waypoints too few in the horizon
         if not self._stop_waypoint_creation and len(self._waypoints_queue) < self._min_waypoint_queue_length:
             self._compute_next_waypoints(k=self._min_waypoint_queue_length)
 
         # Purge the queue of obsolete waypoints
-        veh_location = self._vehicle.get_location()
-        vehicle_speed = get_speed(self._vehicle) / 3.6
+        if snapshot is not None:
+            veh_location = snapshot.ego_location
+            vehicle_speed = snapshot.ego_speed / 3.6
+        else:
+            veh_location = self._vehicle.get_location()
+            vehicle_speed = get_speed(self._vehicle) / 3.6
         self._min_distance = self._base_min_distance + self._distance_ratio * vehicle_speed
 
-        num_waypoint_removed = 0
-        for waypoint, _ in self._waypoints_queue:
-
-            if len(self._waypoints_queue) - num_waypoint_removed == 1:
-                min_distance = 1  # Don't remove the last waypoint until very close by
-            else:
-                min_distance = self._min_distance
-
-            if veh_location.distance(waypoint.transform.location) < min_distance:
-                num_waypoint_removed += 1
-            else:
-                break
+        # Don't remove the last waypoint until very close by
+        num_waypoint_removed = self._waypoints_queue.purge(veh_location, self._min_distance, last_min_distance=1)
+        self._plan_trace_offset += num_waypoint_removed
 
-        if num_waypoint_removed > 0:
-            for _ in range(num_waypoint_removed):
-                self._waypoints_queue.popleft()
+        # Advance the route progress, shared with the lateral controller
+        self._progress.update(veh_location)
 
         # Get the target waypoint and move using the PID controllers. Stop if no target waypoint
         if len(self._waypoints_queue) == 0:
@@ -265,7 +297,7 @@ class LocalPlanner(object):
             control.manual_gear_shift = False
         else:
             self.target_waypoint, self.target_road_option = self._waypoints_queue[0]
-            control = self._vehicle_controller.run_step(self._target_speed, self.target_waypoint)
+            control = self._vehicle_controller.run_step(self._target_speed, self.target_waypoint, snapshot)
 
         #if debug:
         #    draw_waypoints(self._vehicle.get_world(), [self.target_waypoint], 1.0)
@@ -288,10 +320,51 @@ class LocalPlanner(object):
             except IndexError as i:
                 return None, RoadOption.VOID
 
+    def waypoint_at_distance(self, distance):
+        """
+        Returns the waypoint and direction of the plan at a distance ahead, measured along
+        the plan from its first waypoint, or the last ones if the plan is shorter.
+        Unlike get_incoming_waypoint_and_direction, it doesn't depend on the waypoint spacing.
+
+            :param distance: distance in meters along the plan
+        """
+        plan = self._current_plan_trace()
+        if len(plan) == self._plan_trace_offset:
+            return None, RoadOption.VOID
+        return plan[plan.index_at_distance(distance, self._plan_trace_offset)]
+
     def get_plan(self):
         """Returns the current plan of the local planner"""
         return self._waypoints_queue
 
+    def get_route_progress(self):
+        """Returns the RouteProgress of the vehicle along the trajectory followed by the controller"""
+        return self._progress
+
+    def get_plan_trace(self):
+        """Returns the current plan of the local planner as a RouteTrace"""
+        return self._current_plan_trace()[self._plan_trace_offset:]
+
+    def get_reference_line(self, max_distance=None):
+        """
+        Returns the plan as a FrenetFrame, with the arc length of the plan, None if the plan
+        has less than two points
+
+            :param max_distance: length of the plan kept, all of it if None
+        """
+        return FrenetFrame.from_trace(self.get_plan_trace(), max_distance)
+
+    def _current_plan_trace(self):
+        """
+        Returns the RouteTrace whose entries from _plan_trace_offset on are the plan.
+        It is built again only after the plan changes, so every caller shares it
+        and the waypoints it rebuilds within a tick
+        """
+        if self._plan_trace is None:
+            self._plan_trace = RouteTrace.from_waypoints(self._waypoints_queue, self._map)
+            self._plan_trace_offset = 0
+        return self._plan_trace
+
     def done(self):
         """
         Returns whether or not the planner has finished
@@ -0,0 +1,79 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a NumPy separating axis test between oriented bounding boxes
+and convex quadrilaterals, seen from above, for many of them at once.
+"""
+
+import numpy as np
+
+
+def box_corners(centers, yaws, extents):
+    """
+    Returns the (n, 4, 2) corners of oriented boxes, in order around each box
+
+        :param centers: (n, 2) or (n, 3) array with the centers of the boxes
+        :param yaws: (n,) array with the yaws of the boxes, in degrees
+        :param extents: (n, 2) or (n, 3) array with the half length and half width of the boxes
+    """
+    centers = np.asarray(centers, dtype=np.float64)[:, :2]
+    extents = np.asarray(extents, dtype=np.float64)
+    yaw = np.radians(np.asarray(yaws, dtype=np.float64))
+    forward = np.stack((np.cos(yaw), np.sin(yaw)), axis=1) * extents[:, 0:1]
+    right = np.stack((-np.sin(yaw), np.cos(yaw)), axis=1) * extents[:, 1:2]
+    return np.stack((centers + forward + right, centers + forward - right,
+                     centers - forward - right, centers - forward + right), axis=1)
+
+
+def _bounding_circles(polygons):
+    """Returns the centers (n, 2) and radii (n,) of circles containing the polygons"""
+    centers = polygons.mean(axis=1)
+    radii = np.sqrt(((polygons - centers[:, None, :]) ** 2).sum(axis=2)).max(axis=1)
+    return centers, radii
+
+
+def pair_overlap(first, second):
+    """
+    Returns the (p,) boolean array telling if each convex polygon of first intersects
+    the convex polygon of second at the same index, touching included
+
+        :param first, second: (p, k, 2) arrays with the corners of the polygons, in order
+    """
+    # Candidate separating axes: the normals of the edges of both polygons
+    corners = np.concatenate((first, second), axis=1)
+    edges = np.concatenate((np.roll(first, -1, axis=1) - first, np.roll(second, -1, axis=1) - second), axis=1)
+    axes = np.stack((-edges[:, :, 1], edges[:, :, 0]), axis=2)
+
+    # Projections (p, axes, corners) of the corners of both polygons on every axis
+    projection = np.matmul(axes, corners.transpose(0, 2, 1))
+    k = first.shape[1]
+    first_min, first_max = projection[:, :, :k].min(axis=2), projection[:, :, :k].max(axis=2)
+    second_min, second_max = projection[:, :, k:].min(axis=2), projection[:, :, k:].max(axis=2)
+    separated = (second_max < first_min) | (second_min > first_max)
+    return ~separated.any(axis=1)
+
+
+def convex_overlap(first, second):
+    """
+    Returns the (n, m) boolean array telling which of n convex polygons intersect which
+    of m convex polygons, touching included as in shapely's intersects.
+    Only the pairs whose bounding circles meet go through the separating axis test.
+
+        :param first: (n, k, 2) array with the corners of the first polygons, in order
+        :param second: (m, k, 2) array with the corners of the second polygons, in order
+    """
+    first = np.asarray(first, dtype=np.float64)
+    second = np.asarray(second, dtype=np.float64)
+    overlap = np.zeros((len(first), len(second)), dtype=bool)
+    if len(first) == 0 or len(second) == 0:
+        return overlap
+
+    first_centers, first_radii = _bounding_circles(first)
+    second_centers, second_radii = _bounding_circles(second)
+    offsets = first_centers[:, None, :] - second_centers[None, :, :]
+    reach = first_radii[:, None] + second_radii[None, :]
+    rows, columns = np.nonzero((offsets ** 2).sum(axis=2) <= reach ** 2)
+    if len(rows):
+        overlap[rows, columns] = pair_overlap(first[rows], second[columns])
+    return overlap
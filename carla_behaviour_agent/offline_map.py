@@ -0,0 +1,208 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a stand-in for carla.Map, to build and query the
+GlobalRoutePlanner without a running simulator.
+
+The town is a grid of two way roads with two lanes per direction, joined at
+every crossing by straight junction connectors. Only the part of the
+carla.Map and carla.Waypoint API used by the route planner is implemented.
+"""
+
+import math
+import time
+import hashlib
+
+import numpy as np
+
+import carla
+
+
+class _LaneMarking(object):
+    def __init__(self, lane_change):
+        self.lane_change = lane_change
+
+
+class _Lane(object):
+    """Straight lane from p0 to p1"""
+
+    def __init__(self, road_id, lane_id, p0, p1, is_junction):
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.p0 = np.array(p0, dtype=np.float64)
+        self.p1 = np.array(p1, dtype=np.float64)
+        self.length = float(np.linalg.norm(self.p1 - self.p0))
+        self.direction = (self.p1 - self.p0) / self.length
+        self.is_junction = is_junction
+        self.successors = []
+        self.left = None  # (lane, whether s is reversed on it)
+        self.right = None
+        self.left_change = carla.LaneChange.NONE
+        self.right_change = carla.LaneChange.NONE
+
+
+class OfflineWaypoint(object):
+    """Stand-in for carla.Waypoint"""
+
+    def __init__(self, wmap, lane, s):
+        self._map = wmap
+        self._lane = lane
+        self.s = min(max(s, 0.0), lane.length)
+        point = lane.p0 + lane.direction * self.s
+        yaw = math.degrees(math.atan2(lane.direction[1], lane.direction[0]))
+        self.transform = carla.Transform(
+            carla.Location(x=float(point[0]), y=float(point[1]), z=0.0), carla.Rotation(yaw=yaw))
+        self.road_id = lane.road_id
+        self.section_id = 0
+        self.lane_id = lane.lane_id
+        self.is_junction = lane.is_junction
+        self.lane_type = carla.LaneType.Driving
+        self.lane_width = OfflineMap.LANE_WIDTH
+        self.left_lane_marking = _LaneMarking(lane.left_change)
+        self.right_lane_marking = _LaneMarking(lane.right_change)
+        self.id = hash((self.road_id, self.lane_id, round(self.s, 3)))
+
+    def next(self, distance):
+        self._map.wait()
+        s = self.s + distance
+        if s <= self._lane.length + 1e-9:
+            return [OfflineWaypoint(self._map, self._lane, s)]
+
+        remaining = s - self._lane.length
+        waypoints = []
+        for successor in self._lane.successors:
+            if remaining <= successor.length:
+                waypoints.append(OfflineWaypoint(self._map, successor, remaining))
+            else:
+                waypoints.extend(OfflineWaypoint(self._map, successor, 0.0).next(remaining))
+        return waypoints
+
+    def _side_lane(self, side):
+        if side is None:
+            return None
+        lane, reversed_s = side
+        return OfflineWaypoint(self._map, lane, lane.length - self.s if reversed_s else self.s)
+
+    def get_left_lane(self):
+        return self._side_lane(self._lane.left)
+
+    def get_right_lane(self):
+        return self._side_lane(self._lane.right)
+
+
+class OfflineMap(object):
+    """
+    Stand-in for carla.Map: a size x size grid of crossings, spacing meters apart.
+    Every Waypoint.next and get_waypoint call waits latency seconds, to model
+    the cost of querying the simulator.
+    """
+
+    LANE_WIDTH = 3.5
+
+    def __init__(self, size=4, spacing=100.0, junction_radius=10.0, latency=0.0,
+                 name='Carla/Maps/OfflineGrid'):
+        """
+        Constructor method.
+
+            :param size: number of crossings per side of the grid
+            :param spacing: distance in meters between two crossings
+            :param junction_radius: distance in meters between a crossing and the roads reaching it
+            :param latency: seconds waited by every query
+            :param name: name of the map
+        """
+        self.name = name
+        self.latency = latency
+        self.calls = 0
+        self._lanes = []
+        self._lanes_by_id = {}
+        self._build(size, spacing, junction_radius)
+
+    def _build(self, size, spacing, junction_radius):
+        incoming, outgoing = {}, {}
+        for i in range(size):
+            for j in range(size):
+                for di, dj in ((1, 0), (0, 1)):
+                    if i + di >= size or j + dj >= size:
+                        continue
+                    start = np.array([i * spacing, j * spacing])
+                    end = np.array([(i + di) * spacing, (j + dj) * spacing])
+                    direction = (end - start) / spacing
+                    right = np.array([-direction[1], direction[0]])
+                    start, end = start + direction * junction_radius, end - direction * junction_radius
+
+                    road_id = len(self._lanes_by_id) // 4 + 1
+                    lanes = {}
+                    for lane_id, offset in ((-1, 0.5), (-2, 1.5)):
+                        offset *= self.LANE_WIDTH
+                        lanes[lane_id] = _Lane(road_id, lane_id, start + right * offset, end + right * offset, False)
+                    for lane_id, offset in ((1, 0.5), (2, 1.5)):
+                        offset *= self.LANE_WIDTH
+                        lanes[lane_id] = _Lane(road_id, lane_id, end - right * offset, start - right * offset, False)
+
+                    lanes[-1].right, lanes[-2].left = (lanes[-2], False), (lanes[-1], False)
+                    lanes[1].right, lanes[2].left = (lanes[2], False), (lanes[1], False)
+                    lanes[-1].left, lanes[1].left = (lanes[1], True), (lanes[-1], True)
+                    lanes[-1].right_change = lanes[1].right_change = carla.LaneChange.Right
+                    lanes[-2].left_change = lanes[2].left_change = carla.LaneChange.Left
+                    for lane in lanes.values():
+                        self._add_lane(lane)
+
+                    for lane_id in (-1, -2):
+                        incoming.setdefault((i + di, j + dj), []).append(lanes[lane_id])
+                        outgoing.setdefault((i, j), []).append(lanes[lane_id])
+                    for lane_id in (1, 2):
+                        incoming.setdefault((i, j), []).append(lanes[lane_id])
+                        outgoing.setdefault((i + di, j + dj), []).append(lanes[lane_id])
+
+        # Junction connectors, one road each, between the lanes with the same lane number
+        road_id = len(self._lanes_by_id) // 4 + 1
+        for crossing in sorted(incoming):
+            for lane_in in incoming[crossing]:
+                for lane_out in outgoing.get(crossing, []):
+                    if lane_out.road_id == lane_in.road_id or abs(lane_out.lane_id) != abs(lane_in.lane_id):
+                        continue
+                    road_id += 1
+                    connector = _Lane(road_id, -1, lane_in.p1, lane_out.p0, True)
+                    self._add_lane(connector)
+                    lane_in.successors.append(connector)
+                    connector.successors.append(lane_out)
+
+    def _add_lane(self, lane):
+        self._lanes.append(lane)
+        self._lanes_by_id[lane.road_id, lane.lane_id] = lane
+
+    def wait(self):
+        """Models the cost of one query to the simulator"""
+        self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_topology(self):
+        return [(OfflineWaypoint(self, lane, 0.0), OfflineWaypoint(self, lane, lane.length))
+                for lane in self._lanes]
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        self.wait()
+        point = np.array([location.x, location.y])
+        best, best_distance, best_s = None, float('inf'), 0.0
+        for lane in self._lanes:
+            s = float(np.clip(np.dot(point - lane.p0, lane.direction), 0.0, lane.length))
+            distance = float(np.linalg.norm(lane.p0 + lane.direction * s - point))
+            # Lanes win over the junction connectors overlapping them
+            if distance < best_distance - 1e-6 or \
+                    (abs(distance - best_distance) <= 1e-6 and best.is_junction and not lane.is_junction):
+                best, best_distance, best_s = lane, distance, s
+        return OfflineWaypoint(self, best, best_s)
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        self.wait()
+        lane = self._lanes_by_id.get((road_id, lane_id))
+        if lane is None or s < -1e-6 or s > lane.length + 1e-6:
+            return None
+        return OfflineWaypoint(self, lane, s)
+
+    def to_opendrive(self):
+        # Not an OpenDRIVE file, but it identifies the layout for the route planner cache
+        return hashlib.sha1(repr([(lane.road_id, lane.lane_id, tuple(lane.p0), tuple(lane.p1))
+                                  for lane in self._lanes]).encode('utf-8')).hexdigest()
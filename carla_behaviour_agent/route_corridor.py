@@ -0,0 +1,199 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides RouteCorridor, the area swept by the ego vehicle along its plan,
+kept from one tick to the next and intersected with the footprints of the actors.
+"""
+
+import math
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from obb_overlap import box_corners, convex_overlap
+
+
+def actor_corners(snapshot, indices):
+    """
+    Returns the (n, 4, 2) corners of the bounding boxes of some actors of a WorldSnapshot,
+    seen from above and centered on the actors
+
+        :param snapshot: WorldSnapshot of the current tick
+        :param indices: indices of the actors in the snapshot arrays
+    """
+    return box_corners(snapshot.positions[indices], snapshot.yaws[indices], snapshot.extents[indices])
+
+
+def actor_footprints(snapshot, indices):
+    """Returns the shapely Polygons of the bounding boxes of some actors of a WorldSnapshot, see actor_corners"""
+    return shapely.polygons(actor_corners(snapshot, indices))
+
+
+class RouteCorridor(object):
+    """
+    RouteCorridor is the plan widened on both sides, as one quadrilateral per pair of
+    consecutive plan entries, plus the quadrilateral from the ego vehicle to the first entry.
+
+    The quadrilaterals of the plan are kept between ticks: when the plan only lost entries
+    at its front and gained some at its end, the first ones are dropped and the new ones
+    added, and everything is built again only when the plan changed. Without the kernel,
+    they are also kept as prepared geometries, so each one is only indexed once.
+
+    The actors are tested against all the quadrilaterals in a single call, with the NumPy
+    separating axis kernel of obb_overlap, or with a query of the quadrilaterals against
+    an STRtree of the actor footprints. Each hit is kept with the distance the corridor has
+    to reach for it, so that detectors with different ranges share the same query.
+    """
+
+    def __init__(self, horizon=60.0, use_kernel=True):
+        """
+        Constructor method.
+
+            :param horizon: length of plan covered by the corridor, measured from the ego vehicle
+            :param use_kernel: whether to test the actors with the separating axis kernel
+                instead of shapely
+        """
+        self._horizon = horizon
+        self._use_kernel = use_kernel
+        self._sides = None
+        self._x = np.empty(0)
+        self._y = np.empty(0)
+        self._yaw = np.empty(0)
+        self._pieces = np.empty(0, dtype=object)
+        self._corners = np.empty((0, 4, 2))
+        self._builds = 0
+        self._extensions = 0
+
+    @property
+    def horizon(self):
+        """Length of plan covered by the corridor, in meters"""
+        return self._horizon
+
+    def cover(self, distance):
+        """
+        Extends the horizon to distance if it is shorter, so that no hit is lost
+        farther than the horizon. The next update adds the missing part of the plan.
+
+            :param distance: length of plan the corridor has to cover, in meters
+        """
+        if distance > self._horizon:
+            self._horizon = distance
+
+    def _quads(self, right, left, start, end):
+        """
+        Returns the prepared quadrilaterals between the entries start and end of the window,
+        and the (n, 4, 2) array of their corners. The quadrilaterals are only built when
+        the actors are tested with shapely, the array is empty otherwise.
+        """
+        yaw = np.radians(self._yaw[start:end])
+        right_x, right_y = -np.sin(yaw), np.cos(yaw)
+        x, y = self._x[start:end], self._y[start:end]
+        right_points = np.stack((x + right * right_x, y + right * right_y), axis=1)
+        left_points = np.stack((x + left * right_x, y + left * right_y), axis=1)
+        corners = np.stack((right_points[:-1], right_points[1:], left_points[1:], left_points[:-1]), axis=1)
+        if self._use_kernel:
+            return np.empty(0, dtype=object), corners
+        quads = shapely.polygons(corners)
+        shapely.prepare(quads)
+        return quads, corners
+
+    def update(self, trace, right, left):
+        """
+        Moves the corridor to the plan of the current tick
+
+            :param trace: RouteTrace of the plan, from the next entry to follow
+            :param right: displacement of the right border from the plan, in meters
+            :param left: displacement of the left border from the plan, in meters
+        """
+        count = min(trace.index_at_distance(self._horizon) + 2, len(trace)) if len(trace) else 0
+        x, y, yaw = trace.x[:count], trace.y[:count], trace.yaw[:count]
+
+        # Entries of the window still at the front of the plan
+        kept = 0
+        if self._sides == (right, left) and len(self._x) and count:
+            match = np.flatnonzero((self._x == x[0]) & (self._y == y[0]))
+            if len(match):
+                first = int(match[0])
+                kept = min(len(self._x) - first, count)
+                if not (np.array_equal(self._x[first:first + kept], x[:kept])
+                        and np.array_equal(self._y[first:first + kept], y[:kept])):
+                    kept = 0
+
+        if kept:
+            pieces = self._pieces[first:first + kept - 1]
+            corners = self._corners[first:first + kept - 1]
+            self._x, self._y, self._yaw = x.copy(), y.copy(), yaw.copy()
+            if count > kept:
+                new_pieces, new_corners = self._quads(right, left, kept - 1, count)
+                pieces = np.concatenate((pieces, new_pieces))
+                corners = np.concatenate((corners, new_corners))
+                self._extensions += 1
+        else:
+            self._x, self._y, self._yaw = x.copy(), y.copy(), yaw.copy()
+            if count >= 2:
+                pieces, corners = self._quads(right, left, 0, count)
+            else:
+                pieces, corners = np.empty(0, dtype=object), np.empty((0, 4, 2))
+            self._builds += 1
+        self._pieces = pieces
+        self._corners = corners
+        self._sides = (right, left)
+
+    def query(self, snapshot, ego_transform, indices):
+        """
+        Returns {actor id: distance} of the actors whose footprint intersects the corridor.
+        The distance is the one the corridor has to reach for it, following the plan
+        from the ego vehicle while its entries are not farther than that from the ego
+
+            :param snapshot: WorldSnapshot of the current tick
+            :param ego_transform: carla.Transform the corridor starts from
+            :param indices: indices of the actors to test in the snapshot arrays
+        """
+        if len(self._x) == 0 or len(indices) == 0:
+            return {}
+        right, left = self._sides
+        ego_location = ego_transform.location
+        yaw = math.radians(ego_transform.rotation.yaw)
+        right_x, right_y = -math.sin(yaw), math.cos(yaw)
+        x0, y0 = float(self._x[0]), float(self._y[0])
+        yaw0 = math.radians(float(self._yaw[0]))
+        right_x0, right_y0 = -math.sin(yaw0), math.cos(yaw0)
+        ego_corners = np.array([
+            [ego_location.x + right * right_x, ego_location.y + right * right_y],
+            [x0 + right * right_x0, y0 + right * right_y0],
+            [x0 + left * right_x0, y0 + left * right_y0],
+            [ego_location.x + left * right_x, ego_location.y + left * right_y]])
+
+        # The corridor reaches entry k once all the entries up to k are within range
+        distances = np.hypot(self._x - ego_location.x, self._y - ego_location.y)
+        reach = np.maximum.accumulate(distances)
+        piece_reach = np.concatenate((reach[:1], reach[1:len(self._corners) + 1]))
+
+        ids = snapshot.ids[indices]
+        if self._use_kernel:
+            corners = np.concatenate((ego_corners[None], self._corners))
+            overlap = convex_overlap(actor_corners(snapshot, indices), corners)
+            actor_reach = np.where(overlap, piece_reach[None, :], np.inf).min(axis=1)
+            hit = np.flatnonzero(np.isfinite(actor_reach))
+            return {int(ids[k]): float(actor_reach[k]) for k in hit.tolist()}
+
+        pieces = np.concatenate((shapely.polygons(ego_corners[None]), self._pieces))
+        tree = STRtree(actor_footprints(snapshot, indices))
+        piece_index, actor_index = tree.query(pieces, predicate='intersects')
+
+        hits = {}
+        for piece, actor in zip(piece_index.tolist(), actor_index.tolist()):
+            actor_id = int(ids[actor])
+            distance = float(piece_reach[piece])
+            if distance < hits.get(actor_id, float('inf')):
+                hits[actor_id] = distance
+        return hits
+
+    def info(self):
+        """
+        Returns the statistics of the corridor as a dictionary with the 'builds' and 'extensions'
+        counts and the number of 'pieces' kept
+        """
+        return {'builds': self._builds, 'extensions': self._extensions, 'pieces': len(self._corners)}
@@ -0,0 +1,430 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a compressed sparse row (CSR) representation of the
+route planner graph, together with an A*/Dijkstra search working on integer ids.
+"""
+
+import math
+import heapq
+from itertools import count
+
+import numpy as np
+import networkx as nx
+
+
+class CSRGraph(object):
+    """
+    CSRGraph stores a directed graph in compressed sparse row form:
+    the successors of the node with index i are indices[indptr[i]:indptr[i+1]],
+    and every per-edge quantity is stored in a typed array aligned with indices.
+
+    Node indices are contiguous (0..n-1); node_ids maps them back to the ids
+    of the networkx graph the CSRGraph was built from.
+    """
+
+    def __init__(self, node_ids, coordinates, indptr, indices, lengths, types, intersections):
+        """
+        Constructor method.
+
+            :param node_ids: int64 array, id in the original graph of each node index
+            :param coordinates: float64 array (n, 3), (x,y,z) position of each node
+            :param indptr: int64 array (n + 1), offsets of each node's successors
+            :param indices: int32 array (m), successor node index of each edge
+            :param lengths: float64 array (m), weight of each edge
+            :param types: int8 array (m), RoadOption value of each edge
+            :param intersections: bool array (m), whether each edge belongs to an intersection
+        """
+        self.node_ids = node_ids
+        self.coordinates = coordinates
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.types = types
+        self.intersections = intersections
+        self._index = {int(node_id): i for i, node_id in enumerate(node_ids)}
+
+        # Number of nodes expanded by the last search
+        self.expanded_nodes = 0
+
+        # Python lists are much faster than numpy arrays to index one element at a time,
+        # so the search loop works on these copies
+        indices_list, lengths_list = indices.tolist(), lengths.tolist()
+        self._adjacency = [
+            list(zip(indices_list[start:end], lengths_list[start:end]))
+            for start, end in zip(indptr[:-1].tolist(), indptr[1:].tolist())]
+        self._xyz_list = [tuple(xyz) for xyz in coordinates.tolist()]
+        self._node_ids_list = node_ids.tolist()
+        self._reverse_adjacency = None
+
+        # Landmark (ALT) lower bounds, see build_landmarks
+        self.landmarks = None
+        self.landmark_from = None
+        self.landmark_to = None
+        self._landmark_bounds = None
+
+    @classmethod
+    def from_networkx(cls, graph, weight='length'):
+        """
+        Builds a CSRGraph from the networkx graph of the route planner.
+        Successors keep the adjacency order of the networkx graph, so that searches
+        break ties in the same way as the networkx algorithms.
+
+            :param graph: networkx.DiGraph with a 'vertex' attribute on every node
+            :param weight: name of the edge attribute used as weight, or function
+                returning the weight of an edge from its attribute dictionary
+        """
+        if not callable(weight):
+            weight_name = weight
+            weight = lambda edge: edge[weight_name]
+
+        node_ids = list(graph.nodes)
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        coordinates = np.array([graph.nodes[n]['vertex'] for n in node_ids], dtype=np.float64)
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        indices, lengths, types, intersections = [], [], [], []
+        for i, node_id in enumerate(node_ids):
+            for neighbor, edge in graph.adj[node_id].items():
+                indices.append(index[neighbor])
+                lengths.append(weight(edge))
+                types.append(int(edge['type']))
+                intersections.append(bool(edge['intersection']))
+            indptr[i + 1] = len(indices)
+
+        return cls(
+            np.array(node_ids, dtype=np.int64),
+            coordinates.reshape(-1, 3),
+            indptr,
+            np.array(indices, dtype=np.int32),
+            np.array(lengths, dtype=np.float64),
+            np.array(types, dtype=np.int8),
+            np.array(intersections, dtype=bool))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        """Number of edges of the graph"""
+        return len(self.indices)
+
+    def index(self, node_id):
+        """Returns the contiguous index of a node id of the original graph"""
+        return self._index[node_id]
+
+    def successors(self, i):
+        """Returns the indices of the successors of node index i"""
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def distances_to(self, target):
+        """Returns the Euclidean distance of every node to node index target"""
+        return np.linalg.norm(self.coordinates - self.coordinates[target], axis=1)
+
+    def _reverse(self):
+        """Returns the predecessors of every node as lists of (node, length)"""
+        if self._reverse_adjacency is None:
+            self._reverse_adjacency = [[] for _ in range(len(self))]
+            for node, edges in enumerate(self._adjacency):
+                for neighbor, length in edges:
+                    self._reverse_adjacency[neighbor].append((node, length))
+        return self._reverse_adjacency
+
+    def distances_from(self, source, reverse=False):
+        """
+        Returns the shortest path distance from node index source to every node
+        (from every node to source if reverse is True), inf for the unreachable ones.
+        """
+        if reverse:
+            adjacency = self._reverse()
+        else:
+            adjacency = self._adjacency
+
+        push, pop = heapq.heappush, heapq.heappop
+        dist = [float('inf')] * len(self)
+        dist[source] = 0.0
+        queue = [(0.0, source)]
+        while queue:
+            d, node = pop(queue)
+            if d > dist[node]:
+                continue
+            for neighbor, length in adjacency[node]:
+                nd = d + length
+                if nd < dist[neighbor]:
+                    dist[neighbor] = nd
+                    push(queue, (nd, neighbor))
+        return np.array(dist, dtype=np.float64)
+
+    def shortest_path_tree(self, source):
+        """
+        Runs Dijkstra from node index source over the whole graph, to answer
+        many shortest path queries from the same source with tree_path.
+
+            :return: tuple (distance list, parent list), parent is -1 for the
+                source and the unreachable nodes
+        """
+        adjacency = self._adjacency
+        push, pop = heapq.heappush, heapq.heappop
+        dist = [float('inf')] * len(self)
+        parent = [-1] * len(self)
+        dist[source] = 0.0
+        queue = [(0.0, source)]
+        while queue:
+            d, node = pop(queue)
+            if d > dist[node]:
+                continue
+            for neighbor, length in adjacency[node]:
+                nd = d + length
+                if nd < dist[neighbor]:
+                    dist[neighbor] = nd
+                    parent[neighbor] = node
+                    push(queue, (nd, neighbor))
+        return dist, parent
+
+    def shortest_path_to_any(self, source, targets, max_length=float('inf')):
+        """
+        Finds the shortest path from node index source to the closest of a set of node
+        indices, with a Dijkstra search that stops as soon as one of them is reached.
+
+            :param source: node index of the start of the path
+            :param targets: set of node indices
+            :param max_length: length above which the search gives up
+            :return: list of node indices from source to the target reached, None if none is
+                reachable within max_length
+        """
+        adjacency = self._adjacency
+        push, pop = heapq.heappush, heapq.heappop
+        dist = {source: 0.0}
+        parent = {source: None}
+        queue = [(0.0, source)]
+        self.expanded_nodes = 0
+        while queue:
+            d, node = pop(queue)
+            if d > dist[node]:
+                continue
+            if d > max_length:
+                break
+            self.expanded_nodes += 1
+            if node in targets:
+                path = [node]
+                while parent[node] is not None:
+                    node = parent[node]
+                    path.append(node)
+                path.reverse()
+                return path
+            for neighbor, length in adjacency[node]:
+                nd = d + length
+                if nd < dist.get(neighbor, float('inf')):
+                    dist[neighbor] = nd
+                    parent[neighbor] = node
+                    push(queue, (nd, neighbor))
+        return None
+
+    def tree_path(self, tree, source, target, tolerance=1e-9):
+        """
+        Returns the path from source to target of a tree built by shortest_path_tree,
+        only if it is the only shortest path. When another path is as short, up to
+        tolerance, None is returned: shortest_path could return either of them.
+
+            :return: list of node indices from source to target, or None
+        """
+        dist, parent = tree
+        if dist[target] == float('inf'):
+            raise nx.NetworkXNoPath("Node {} not reachable from {}".format(
+                self.node_ids[target], self.node_ids[source]))
+
+        reverse = self._reverse()
+        path = [target]
+        node = target
+        while node != source:
+            # Unique only if a single predecessor lies on a shortest path
+            tight = 0
+            for predecessor, length in reverse[node]:
+                if dist[predecessor] + length <= dist[node] + tolerance:
+                    tight += 1
+            if tight != 1:
+                return None
+            node = parent[node]
+            path.append(node)
+        path.reverse()
+        return path
+
+    def build_landmarks(self, count=8):
+        """
+        Preprocessing for the ALT (A*, landmarks, triangle inequality) search.
+        The landmarks are spread over the map by farthest point selection, and the
+        distances from and to every landmark are stored for all the nodes.
+        By the triangle inequality, for every landmark L:
+            d(v, t) >= d(L, t) - d(L, v)  and  d(v, t) >= d(v, L) - d(t, L)
+        which gives a consistent lower bound much tighter than the Euclidean distance.
+
+            :param count: number of landmarks
+        """
+        count = min(count, len(self))
+        if count == 0:
+            return
+
+        # Start from the node farthest from the center of the map
+        center = self.coordinates.mean(axis=0)
+        min_distance = np.full(len(self), np.inf)
+        candidate = int(np.argmax(np.linalg.norm(self.coordinates - center, axis=1)))
+
+        landmarks, landmark_from, landmark_to = [], [], []
+        for _ in range(count):
+            landmarks.append(candidate)
+            landmark_from.append(self.distances_from(candidate))
+            landmark_to.append(self.distances_from(candidate, reverse=True))
+            min_distance = np.minimum(min_distance, self.distances_to(candidate))
+            candidate = int(np.argmax(min_distance))
+
+        self.set_landmarks(np.array(landmarks, dtype=np.int64), np.array(landmark_from), np.array(landmark_to))
+
+    def set_landmarks(self, landmarks, landmark_from, landmark_to):
+        """
+        Sets the landmarks computed by build_landmarks, e.g. after loading them from a cache
+
+            :param landmarks: int64 array (k), node index of each landmark
+            :param landmark_from: float64 array (k, n), distance from each landmark to every node
+            :param landmark_to: float64 array (k, n), distance from every node to each landmark
+        """
+        self.landmarks = landmarks
+        self.landmark_from = landmark_from
+        self.landmark_to = landmark_to
+
+        # Unreachable nodes get a large finite distance, so that the differences
+        # of two of them are 0 instead of nan
+        unreachable = 1e12
+        self._landmark_bounds = (np.where(np.isfinite(landmark_from), landmark_from, unreachable),
+                                 np.where(np.isfinite(landmark_to), landmark_to, unreachable))
+
+    def landmark_heuristic(self, target):
+        """
+        Returns the list of the lower bounds of the distance from every node to target,
+        the largest of the Euclidean distance and of the landmark bounds, computed for
+        all the nodes at once. None if no landmarks were built.
+
+            :param target: node index of the end of the path
+        """
+        if self._landmark_bounds is None:
+            return None
+        bounds_from, bounds_to = self._landmark_bounds
+        h = np.linalg.norm(self.coordinates - self.coordinates[target], axis=1)
+        h = np.maximum(h, (bounds_from[:, target:target + 1] - bounds_from).max(axis=0))
+        h = np.maximum(h, (bounds_to - bounds_to[:, target:target + 1]).max(axis=0))
+        return h.tolist()
+
+    def shortest_path(self, source, target, heuristic=True, penalties=None):
+        """
+        Finds the shortest path between two node indices.
+        A* with Euclidean distance heuristic is used by default, plain Dijkstra otherwise.
+        If landmarks were built, the heuristic also takes the landmark lower bounds.
+        The heuristic is admissible and consistent only if no edge weight is shorter
+        than the straight line between its two nodes.
+
+            :param source: node index of the start of the path
+            :param target: node index of the end of the path
+            :param heuristic: whether to use the Euclidean distance heuristic
+            :param penalties: optional dictionary {(node, node): factor} multiplying the weight
+                of some edges. Factors must not be lower than 1, to keep the heuristic admissible
+            :return: list of node indices from source to target
+        """
+        adjacency = self._adjacency
+        xyz = self._xyz_list
+        tx, ty, tz = xyz[target]
+        sqrt = math.sqrt
+        # With landmarks, the heuristic of every node is computed once for the query
+        landmark_h = self.landmark_heuristic(target) if heuristic else None
+        push, pop = heapq.heappush, heapq.heappop
+        counter = count()
+
+        # Same bookkeeping as networkx.astar_path: the cost (and heuristic) each node
+        # was queued with, and the parent it was explored from (None for the source)
+        enqueued = {}
+        explored = {}
+        queue = [(0, next(counter), source, 0, None)]
+        self.expanded_nodes = 0
+
+        while queue:
+            _, __, node, dist, parent = pop(queue)
+
+            if node == target:
+                path = [node]
+                while parent is not None:
+                    path.append(parent)
+                    parent = explored[parent]
+                path.reverse()
+                return path
+
+            if node in explored:
+                # The source is never explored again
+                if explored[node] is None:
+                    continue
+                # Skip bad paths that were queued before a better one was found
+                if enqueued[node][0] < dist:
+                    continue
+
+            explored[node] = parent
+            self.expanded_nodes += 1
+
+            for neighbor, length in adjacency[node]:
+                if penalties is not None:
+                    length *= penalties.get((node, neighbor), 1.0)
+                ncost = dist + length
+                queued = enqueued.get(neighbor)
+                if queued is not None:
+                    if queued[0] <= ncost:
+                        continue
+                    h = queued[1]
+                elif landmark_h is not None:
+                    h = landmark_h[neighbor]
+                elif heuristic:
+                    x, y, z = xyz[neighbor]
+                    h = sqrt((x - tx) * (x - tx) + (y - ty) * (y - ty) + (z - tz) * (z - tz))
+                else:
+                    h = 0
+                enqueued[neighbor] = (ncost, h)
+                push(queue, (ncost + h, next(counter), neighbor, ncost, node))
+
+        raise nx.NetworkXNoPath("Node {} not reachable from {}".format(
+            self.node_ids[target], self.node_ids[source]))
+
+    def alternative_paths(self, source, target, k, penalty=1.0, avoid=()):
+        """
+        Finds up to k different paths between two node indices with the penalty method:
+        once a path is found, the weight of its edges is multiplied by 1 + penalty, so that
+        the following searches prefer other edges. The paths found are different but not
+        necessarily the k shortest ones.
+
+            :param source: node index of the start of the paths
+            :param target: node index of the end of the paths
+            :param k: maximum number of paths
+            :param penalty: increase of the weight of an edge every time a path uses it
+            :param avoid: (node, node) edges penalized from the start, e.g. those of the current route
+            :return: list of paths, as lists of node indices
+        """
+        penalties = {}
+        for edge in avoid:
+            penalties[edge] = 1.0 + penalty
+        paths = []
+        # Searches giving an already known path only raise its penalties
+        for _ in range(2 * k):
+            try:
+                path = self.shortest_path(source, target, penalties=penalties)
+            except nx.NetworkXNoPath:
+                break
+            if path not in paths:
+                paths.append(path)
+                if len(paths) == k:
+                    break
+            for edge in zip(path[:-1], path[1:]):
+                penalties[edge] = penalties.get(edge, 1.0) + penalty
+        return paths
+
+    def shortest_path_ids(self, source_id, target_id, heuristic=True):
+        """
+        Same as shortest_path, but takes and returns node ids of the original graph
+        """
+        path = self.shortest_path(self._index[source_id], self._index[target_id], heuristic)
+        node_ids = self._node_ids_list
+        return [node_ids[i] for i in path]
@@ -0,0 +1,61 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides RouteProgress, the position of the vehicle along its route,
+shared by the LocalPlanner and the lateral controller.
+"""
+
+import numpy as np
+
+
+class RouteProgress(object):
+    """
+    RouteProgress is a cursor on a RouteTrace: the index of the entry closest to the
+    vehicle, which only moves forward. Every update searches a window of entries
+    from the last match, and goes on only while the distance keeps decreasing,
+    so its cost doesn't depend on the length of the route.
+    """
+
+    def __init__(self, window=20):
+        """
+        Constructor method.
+
+            :param window: number of entries searched at once, at least 2
+        """
+        self.trace = None
+        self.index = 0
+        self._window = max(window, 2)
+
+    def reset(self, trace):
+        """
+        Moves the cursor back to the start of a new trace
+
+            :param trace: RouteTrace being followed
+        """
+        self.trace = trace
+        self.index = 0
+
+    def update(self, location):
+        """
+        Moves the cursor to the entry closest to location, searching forward from the
+        current one, and returns its index
+
+            :param location: carla.Location of the vehicle
+        """
+        trace = self.trace
+        if trace is None or len(trace) == 0:
+            return self.index
+
+        x, y = location.x, location.y
+        start = self.index
+        while True:
+            end = min(start + self._window, len(trace))
+            distances = (trace.x[start:end] - x) ** 2 + (trace.y[start:end] - y) ** 2
+            best = start + int(np.argmin(distances))
+            # The closest entry can only be past the window if the last one is the closest
+            if best < end - 1 or end == len(trace):
+                break
+            start = best
+        self.index = best
+        return best
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Reports how many nodes the route search expands on the routes of a leaderboard
+route file, comparing the metric edge weights of the GlobalRoutePlanner with
+the legacy ones (number of waypoints per edge, zero for lane changes).
+
+    python route_search_report.py --routes ../routes/route_1_avddiem.xml --port 2000
+"""
+
+import argparse
+import xml.etree.ElementTree as ET
+
+import carla
+from global_route_planner import GlobalRoutePlanner
+from local_planner import RoadOption
+from route_graph import CSRGraph
+
+
+def legacy_weight(edge):
+    """Edge weight used before the metric one: number of waypoints, zero for lane changes"""
+    if edge['type'] in (RoadOption.CHANGELANELEFT, RoadOption.CHANGELANERIGHT):
+        return 0
+    return len(edge['path'] or ()) + 1
+
+
+def read_routes(filename):
+    """
+    Returns the routes of a leaderboard route file as a list of (id, town, [carla.Location])
+    """
+    routes = []
+    for route in ET.parse(filename).getroot().iter('route'):
+        locations = [carla.Location(x=float(p.attrib['x']), y=float(p.attrib['y']), z=float(p.attrib['z']))
+                     for p in route.iter('position')]
+        routes.append((route.attrib['id'], route.attrib['town'], locations))
+    return routes
+
+
+def route_length(grp, route):
+    """Length in meters of a route given as list of node ids"""
+    return sum(grp._graph.edges[n1, n2]['length'] for n1, n2 in zip(route[:-1], route[1:]))
+
+
+def report(grp, locations):
+    """
+    Prints, for every leg of a route, the nodes expanded and the length of the path
+    found with the legacy and the metric weights.
+    """
+    legacy = CSRGraph.from_networkx(grp._graph, weight=legacy_weight)
+    metric = grp._csr
+    totals = [0, 0]
+
+    print("{:>4} {:>10} {:>10} {:>12} {:>12}".format(
+        "leg", "legacy", "metric", "legacy [m]", "metric [m]"))
+    for i, (origin, destination) in enumerate(zip(locations[:-1], locations[1:])):
+        start, end = grp._localize(origin), grp._localize(destination)
+        if start is None or end is None:
+            print("{:>4} unable to localize the leg".format(i))
+            continue
+
+        legacy_route = legacy.shortest_path_ids(start[0], end[0])
+        metric_route = metric.shortest_path_ids(start[0], end[0])
+        totals[0] += legacy.expanded_nodes
+        totals[1] += metric.expanded_nodes
+        print("{:>4} {:>10} {:>10} {:>12.1f} {:>12.1f}".format(
+            i, legacy.expanded_nodes, metric.expanded_nodes,
+            route_length(grp, legacy_route), route_length(grp, metric_route)))
+    print("{:>4} {:>10} {:>10}".format("all", totals[0], totals[1]))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--routes', required=True, help='leaderboard route file')
+    argparser.add_argument('--host', default='localhost', help='IP of the host server')
+    argparser.add_argument('--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('--sampling-resolution', default=2.0, type=float)
+    argparser.add_argument('--cache-dir', default=None, help='route planner cache directory')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(300.0)
+
+    for route_id, town, locations in read_routes(args.routes):
+        world = client.get_world()
+        if not world.get_map().name.endswith(town):
+            world = client.load_world(town)
+        grp = GlobalRoutePlanner(world.get_map(), args.sampling_resolution, cache_dir=args.cache_dir)
+
+        print("Route {} ({}, {} legs)".format(route_id, town, len(locations) - 1))
+        report(grp, locations)
+
+
+if __name__ == '__main__':
+    main()
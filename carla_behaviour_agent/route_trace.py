@@ -0,0 +1,200 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides RouteTrace, an array-backed list of (carla.Waypoint, RoadOption).
+"""
+
+import numpy as np
+
+import carla
+
+
+class RouteTrace(object):
+    """
+    RouteTrace stores a route as parallel NumPy arrays, one entry per waypoint:
+
+        x, y, z: location of the waypoint
+        yaw: yaw of the waypoint in degrees
+        distance: arc length along the route, in meters. Slices keep the values of the whole route
+        road_id, section_id, lane_id: OpenDRIVE ids of the lane of the waypoint
+        lane_s: OpenDRIVE s of the waypoint along its road
+        option: RoadOption value of the waypoint, as int8
+
+    It still behaves as a sequence of (carla.Waypoint, RoadOption) pairs, and the
+    carla.Waypoint objects not given at construction are rebuilt from the map the
+    first time they are accessed. Slicing returns a RouteTrace sharing the arrays.
+    """
+
+    def __init__(self, x, y, z, yaw, road_id, section_id, lane_id, lane_s, option,
+                 waypoints=None, wmap=None, distance=None):
+        """
+        Constructor method.
+
+            :param x, y, z, yaw: float64 arrays with the pose of every waypoint
+            :param road_id, section_id, lane_id: int32 arrays with the lane of every waypoint
+            :param lane_s: float64 array with the OpenDRIVE s of every waypoint
+            :param option: int8 array with the RoadOption of every waypoint
+            :param waypoints: optional list with the carla.Waypoint of every entry (None if unknown)
+            :param wmap: carla.Map used to rebuild the waypoints not given
+            :param distance: float64 array with the arc length of every waypoint,
+                computed from x, y, z if not given
+        """
+        self.x = x
+        self.y = y
+        self.z = z
+        self.yaw = yaw
+        self.road_id = road_id
+        self.section_id = section_id
+        self.lane_id = lane_id
+        self.lane_s = lane_s
+        self.option = option
+        if distance is None:
+            steps = np.sqrt(np.diff(x) ** 2 + np.diff(y) ** 2 + np.diff(z) ** 2)
+            distance = np.concatenate(([0.0], np.cumsum(steps)))
+        self.distance = distance
+
+        self._waypoints = waypoints if waypoints is not None else [None] * len(x)
+        self._wmap = wmap
+
+    @classmethod
+    def from_waypoints(cls, plan, wmap=None, keep_waypoints=True):
+        """
+        Builds a RouteTrace from a list of (carla.Waypoint, RoadOption)
+
+            :param plan: iterable of (carla.Waypoint, RoadOption)
+            :param wmap: carla.Map used to rebuild the waypoints when they aren't kept
+            :param keep_waypoints: whether to keep a reference to the given waypoints
+        """
+        plan = list(plan)
+        n = len(plan)
+        pose = np.empty((n, 4), dtype=np.float64)
+        ids = np.empty((n, 3), dtype=np.int32)
+        lane_s = np.empty(n, dtype=np.float64)
+        option = np.empty(n, dtype=np.int8)
+        for i, (waypoint, road_option) in enumerate(plan):
+            transform = waypoint.transform
+            location = transform.location
+            pose[i] = (location.x, location.y, location.z, transform.rotation.yaw)
+            ids[i] = (waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+            lane_s[i] = waypoint.s
+            option[i] = int(road_option)
+
+        waypoints = [waypoint for waypoint, _ in plan] if keep_waypoints else None
+        return cls(pose[:, 0].copy(), pose[:, 1].copy(), pose[:, 2].copy(), pose[:, 3].copy(),
+                   ids[:, 0].copy(), ids[:, 1].copy(), ids[:, 2].copy(), lane_s, option,
+                   waypoints=waypoints, wmap=wmap)
+
+    @classmethod
+    def concatenate(cls, traces, wmap=None):
+        """
+        Builds a RouteTrace with the entries of several ones, in order.
+        The arc length is computed again along the whole result.
+
+            :param traces: list of RouteTrace
+            :param wmap: carla.Map used to rebuild the waypoints, the one of the first trace if None
+        """
+        if wmap is None and traces:
+            wmap = traces[0]._wmap
+        waypoints = []
+        for trace in traces:
+            waypoints.extend(trace._waypoints)
+        return cls(*[np.concatenate([getattr(trace, name) for trace in traces])
+                     for name in ('x', 'y', 'z', 'yaw', 'road_id', 'section_id', 'lane_id', 'lane_s', 'option')],
+                   waypoints=waypoints, wmap=wmap)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RouteTrace(
+                self.x[index], self.y[index], self.z[index], self.yaw[index],
+                self.road_id[index], self.section_id[index], self.lane_id[index],
+                self.lane_s[index], self.option[index], waypoints=self._waypoints[index],
+                wmap=self._wmap, distance=self.distance[index])
+        return self.waypoint(index), self.road_option(index)
+
+    def __getstate__(self):
+        # carla.Waypoint and carla.Map can't be pickled, waypoints are rebuilt once bound to a map
+        state = dict(self.__dict__)
+        state['_waypoints'] = [None] * len(self)
+        state['_wmap'] = None
+        return state
+
+    def bind(self, wmap):
+        """Sets the carla.Map used to rebuild the waypoints, e.g. after unpickling"""
+        self._wmap = wmap
+
+    def take(self, indices):
+        """Returns a RouteTrace with the entries at the given indices, in order"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return RouteTrace(
+            self.x[indices], self.y[indices], self.z[indices], self.yaw[indices],
+            self.road_id[indices], self.section_id[indices], self.lane_id[indices],
+            self.lane_s[indices], self.option[indices], waypoints=[self._waypoints[i] for i in indices.tolist()],
+            wmap=self._wmap, distance=self.distance[indices])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.waypoint(i), self.road_option(i)
+
+    def road_option(self, index):
+        """Returns the RoadOption of an entry"""
+        # local_planner imports this module, so RoadOption can't be imported at the top
+        from local_planner import RoadOption
+        return RoadOption(int(self.option[index]))
+
+    def location(self, index):
+        """Returns the carla.Location of an entry, without building its waypoint"""
+        return carla.Location(x=float(self.x[index]), y=float(self.y[index]), z=float(self.z[index]))
+
+    def waypoint(self, index):
+        """Returns the carla.Waypoint of an entry, rebuilding it from the map if needed"""
+        waypoint = self._waypoints[index]
+        if waypoint is None:
+            if self._wmap is None:
+                raise ValueError("RouteTrace without map can't rebuild its waypoints")
+            waypoint = self._wmap.get_waypoint_xodr(
+                int(self.road_id[index]), int(self.lane_id[index]), float(self.lane_s[index]))
+            if waypoint is None:
+                waypoint = self._wmap.get_waypoint(self.location(index))
+            self._waypoints[index] = waypoint
+        return waypoint
+
+    def index_at_distance(self, distance, start=0):
+        """
+        Returns the index of the first entry at least distance meters along the trace
+        from the entry start, the last one if the trace is shorter. Binary search on the arc length.
+        """
+        index = int(np.searchsorted(self.distance, self.distance[start] + distance, side='left'))
+        return min(max(index, start), len(self) - 1)
+
+    def leading_within(self, location, max_distance):
+        """
+        Returns how many entries, from the first one, are not farther than max_distance
+        from location, stopping at the first one that is
+        """
+        distances = np.sqrt((self.x - location.x) ** 2 + (self.y - location.y) ** 2 + (self.z - location.z) ** 2)
+        farther = np.flatnonzero(distances > max_distance)
+        return int(farther[0]) if len(farther) else len(self)
+
+    def side_points(self, right, left, count=None):
+        """
+        Returns, for each of the first count entries, the points displaced right and left meters
+        along the right vector of the waypoint, as a list [[x, y, z], [x, y, z], ...]
+        alternating the right and the left point of each entry
+
+            :param right: displacement of the first point, in meters
+            :param left: displacement of the second point, in meters
+            :param count: number of entries, all of them if None
+        """
+        yaw = np.radians(self.yaw[:count])
+        # Right vector of a rotation without roll
+        right_x, right_y = -np.sin(yaw), np.cos(yaw)
+        points = np.empty((len(yaw), 2, 3), dtype=np.float64)
+        for k, offset in enumerate((right, left)):
+            points[:, k, 0] = self.x[:count] + offset * right_x
+            points[:, k, 1] = self.y[:count] + offset * right_y
+            points[:, k, 2] = self.z[:count]
+        return points.reshape(-1, 3).tolist()
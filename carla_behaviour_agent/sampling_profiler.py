@@ -0,0 +1,167 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides SamplingProfiler, a statistical profiler of the agent ticks.
+The stacks it collects are written in the folded format read by flamegraph.pl
+and speedscope, one file per behavior branch.
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+
+class SamplingProfiler(object):
+    """
+    SamplingProfiler runs a background thread that, rate times per second, reads the
+    Python stack of the thread running the agent while it is inside a tick.
+    The samples of a tick are kept aside until the tick ends, and then counted
+    under the behavior branch and the route arc length the tick ended with:
+
+        profiler.begin()
+        control = agent.run_step()
+        profiler.end(agent.get_branch(), agent.get_route_distance())
+
+    Reading a stack holds the interpreter lock, so the time it takes is taken from
+    the agent. It is measured and reported as the overhead by info.
+    """
+
+    def __init__(self, rate=100.0, max_depth=64, distance_bin=50.0):
+        """
+        Constructor method.
+
+            :param rate: samples per second
+            :param max_depth: maximum number of frames kept per sample, from the innermost one
+            :param distance_bin: length of the route arc length bins, in meters
+        """
+        self._interval = 1.0 / rate
+        self._max_depth = max_depth
+        self._distance_bin = distance_bin
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._target = None
+        self._pending = []
+        self._labels = {}
+
+        self._stacks = defaultdict(Counter)
+        self._distances = defaultdict(Counter)
+        self._ticks = 0
+        self._samples = 0
+        self._sampling_time = 0.0
+        self._active_time = 0.0
+        self._tick_start = None
+
+    def start(self):
+        """Starts the sampling thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the sampling thread, the samples collected are kept"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def begin(self):
+        """Marks the start of a tick on the calling thread, whose stack is sampled until end"""
+        with self._lock:
+            self._pending = []
+            self._target = threading.get_ident()
+        self._tick_start = time.perf_counter()
+
+    def end(self, branch, distance=None):
+        """
+        Marks the end of the tick, and counts its samples under branch
+
+            :param branch: name of the behavior branch taken by the tick
+            :param distance: arc length of the vehicle along the route, in meters, if known
+        """
+        with self._lock:
+            self._target = None
+            pending, self._pending = self._pending, []
+        if self._tick_start is not None:
+            self._active_time += time.perf_counter() - self._tick_start
+            self._tick_start = None
+
+        branch = branch or 'unknown'
+        self._ticks += 1
+        self._stacks[branch].update(pending)
+        if distance is not None and pending and math.isfinite(distance):
+            bin_start = math.floor(distance / self._distance_bin) * self._distance_bin
+            self._distances[branch][bin_start] += len(pending)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            self._labels[code] = label
+        return label
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self._interval):
+            start = time.perf_counter()
+            with self._lock:
+                target = self._target
+                if target is None:
+                    continue
+                frame = sys._current_frames().get(target)
+                labels = []
+                while frame is not None and len(labels) < self._max_depth:
+                    labels.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                del frame
+                self._pending.append(';'.join(reversed(labels)))
+                self._samples += 1
+            self._sampling_time += time.perf_counter() - start
+
+    def info(self):
+        """
+        Returns the statistics of the profiler as a dictionary with the 'ticks' and 'samples'
+        counts, the 'branches' {branch: samples} and the 'overhead', the time spent
+        reading stacks over the time spent in ticks
+        """
+        return {
+            'ticks': self._ticks,
+            'samples': self._samples,
+            'branches': {branch: sum(stacks.values()) for branch, stacks in self._stacks.items()},
+            'overhead': self._sampling_time / self._active_time if self._active_time > 0 else 0.0,
+        }
+
+    def write(self, directory):
+        """
+        Writes the folded stacks of every branch to <directory>/<branch>.folded, and the
+        samples per branch and arc length bin to <directory>/arc_length.csv
+
+            :param directory: output directory, created if needed
+            :return: list of the paths written
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        paths = []
+        for branch, stacks in sorted(self._stacks.items()):
+            path = os.path.join(directory, "{}.folded".format(branch))
+            with open(path, "w") as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write("{} {}\n".format(stack, count))
+            paths.append(path)
+
+        path = os.path.join(directory, "arc_length.csv")
+        with open(path, "w") as f:
+            f.write("branch,arc_length,samples\n")
+            for branch, bins in sorted(self._distances.items()):
+                for bin_start, count in sorted(bins.items()):
+                    f.write("{},{:.1f},{}\n".format(branch, bin_start, count))
+        paths.append(path)
+        return paths
@@ -0,0 +1,139 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a uniform grid index over the waypoints of the route planner edges,
+answering nearest edge and nearest waypoint queries without querying the carla.Map.
+"""
+
+import math
+import numpy as np
+
+
+class PathPointIndex(object):
+    """
+    PathPointIndex stores the (x,y,z) points of every edge in contiguous arrays,
+    edge after edge, and buckets them in a uniform 2D grid. Points of the same
+    cell are contiguous in the sorted order, so a cell is just a (start, end) range.
+    """
+
+    def __init__(self, cell_size=4.0):
+        """
+        Constructor method.
+
+            :param cell_size: side in meters of the cells of the grid
+        """
+        self._cell_size = cell_size
+        self._keys = []
+        self._slots = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._points = np.zeros((0, 3), dtype=np.float64)
+        self._point_slot = np.zeros(0, dtype=np.int32)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def build(self, edges):
+        """
+        Builds the index.
+
+            :param edges: iterable of (key, points), where key identifies the edge
+                and points is a list of (x,y,z) along it
+        """
+        keys, offsets, points = [], [0], []
+        for key, edge_points in edges:
+            keys.append(key)
+            points.extend(edge_points)
+            offsets.append(len(points))
+
+        self._keys = keys
+        self._slots = {key: slot for slot, key in enumerate(keys)}
+        self._offsets = np.array(offsets, dtype=np.int64)
+        self._points = np.array(points, dtype=np.float64).reshape(-1, 3)
+        self._point_slot = np.repeat(np.arange(len(keys), dtype=np.int32), np.diff(self._offsets))
+
+        # Sort the points by cell, and store the range of each cell
+        cells = np.floor(self._points[:, :2] / self._cell_size).astype(np.int64)
+        self._order = np.lexsort((cells[:, 1], cells[:, 0]))
+        sorted_cells = cells[self._order]
+        if len(sorted_cells) == 0:
+            self._cells = {}
+            return
+        change = np.any(sorted_cells[1:] != sorted_cells[:-1], axis=1)
+        starts = np.concatenate(([0], np.nonzero(change)[0] + 1))
+        ends = np.concatenate((starts[1:], [len(sorted_cells)]))
+        self._cells = {
+            (int(cell[0]), int(cell[1])): (int(start), int(end))
+            for cell, start, end in zip(sorted_cells[starts], starts, ends)}
+
+    def _candidates(self, ci, cj, ring):
+        """Returns the point ids of the cells at Chebyshev distance ring from (ci, cj)"""
+        ranges = []
+        for i in range(ci - ring, ci + ring + 1):
+            for j in range(cj - ring, cj + ring + 1):
+                if max(abs(i - ci), abs(j - cj)) != ring:
+                    continue
+                cell = self._cells.get((i, j))
+                if cell is not None:
+                    ranges.append(self._order[cell[0]:cell[1]])
+        if not ranges:
+            return None
+        return np.concatenate(ranges)
+
+    def nearest(self, x, y, z, max_distance=float('inf')):
+        """
+        Finds the point closest to (x,y,z).
+
+            :param max_distance: points farther than this are ignored
+            :return: tuple (edge key, index of the point along the edge, distance),
+                or None if there is no point within max_distance
+        """
+        if len(self._points) == 0:
+            return None
+
+        ci = int(math.floor(x / self._cell_size))
+        cj = int(math.floor(y / self._cell_size))
+        query = np.array([x, y, z])
+        max_ring = int(math.ceil(min(max_distance, 1e6) / self._cell_size)) + 1
+
+        best_point, best_distance = -1, float('inf')
+        ring = 0
+        while ring <= max_ring:
+            # Every point of this ring or beyond is at least (ring - 1) * cell_size away
+            if best_distance <= (ring - 1) * self._cell_size:
+                break
+            candidates = self._candidates(ci, cj, ring)
+            if candidates is not None:
+                distances = np.linalg.norm(self._points[candidates] - query, axis=1)
+                distance = float(distances.min())
+                # Same tie-breaking as a linear scan: the lowest point id wins
+                point = int(candidates[distances == distance].min())
+                if distance < best_distance or (distance == best_distance and point < best_point):
+                    best_point, best_distance = point, distance
+            ring += 1
+
+        if best_point < 0 or best_distance > max_distance:
+            return None
+
+        slot = self._point_slot[best_point]
+        return self._keys[slot], best_point - int(self._offsets[slot]), best_distance
+
+    def closest_on_edge(self, key, x, y, z, start=0, end=None):
+        """
+        Returns the index of the point of an edge closest to (x,y,z),
+        considering only the points between start and end (python slice semantics).
+        Ties go to the lowest index, as in a linear scan.
+        """
+        slot = self._slots[key]
+        offset, count = int(self._offsets[slot]), int(self._offsets[slot + 1] - self._offsets[slot])
+        start, end, _ = slice(start, end).indices(count)
+        if end <= start:
+            return -1
+        points = self._points[offset + start:offset + end]
+        distances = np.linalg.norm(points - np.array([x, y, z]), axis=1)
+        return start + int(np.argmin(distances))
+
+    def __contains__(self, key):
+        return key in self._slots
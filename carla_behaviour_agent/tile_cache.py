@@ -0,0 +1,151 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a paged cache of the route planner edge waypoints.
+
+The map is split in square tiles, and the waypoints of the edges starting in a
+tile are loaded and evicted together. Resident tiles are kept in LRU order under
+a budget on the total number of waypoints, and tiles can be loaded ahead of
+time by a background thread.
+"""
+
+import math
+import queue
+import threading
+from collections import OrderedDict
+
+
+def tile_of(x, y, tile_size):
+    """Returns the (i, j) tile containing the point (x, y)"""
+    return (int(math.floor(x / tile_size)), int(math.floor(y / tile_size)))
+
+
+class TileCache(object):
+    """
+    TileCache keeps the waypoints of the edges of some tiles of the map.
+    A tile is a dictionary {edge: [carla.Waypoint, ...]} built by the loader
+    function the first time it's requested, and again after being evicted.
+    """
+
+    def __init__(self, loader, budget):
+        """
+        Constructor method.
+
+            :param loader: function taking a tile and returning its dictionary of edge waypoints
+            :param budget: maximum number of waypoints kept in memory. The tile being
+                requested is always kept, even if it alone exceeds the budget
+        """
+        self._loader = loader
+        self._budget = budget
+        self._tiles = OrderedDict()
+        self._sizes = {}
+        self._resident = 0
+        self._loading = set()
+        self._condition = threading.Condition()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        self._prefetch_queue = None
+        self._prefetch_thread = None
+        self._queued = set()
+
+    def get(self, tile):
+        """
+        Returns the dictionary of edge waypoints of a tile, loading it if needed
+        """
+        with self._condition:
+            while tile in self._loading:
+                self._condition.wait()
+            paths = self._tiles.get(tile)
+            if paths is not None:
+                self._tiles.move_to_end(tile)
+                self._hits += 1
+                return paths
+            self._misses += 1
+            self._loading.add(tile)
+
+        # The loader runs outside the lock, so other tiles can be served meanwhile.
+        # The tile is stored in the same critical section that ends its loading, so a
+        # waiter finds it resident as soon as it wakes up
+        paths = None
+        try:
+            paths = self._loader(tile)
+        finally:
+            with self._condition:
+                if paths is not None:
+                    self._insert(tile, paths)
+                self._loading.discard(tile)
+                self._condition.notify_all()
+        return paths
+
+    def _insert(self, tile, paths):
+        """Stores a loaded tile and evicts the least recently used ones above the budget"""
+        self._resident -= self._sizes.get(tile, 0)
+        self._tiles[tile] = paths
+        self._tiles.move_to_end(tile)
+        self._sizes[tile] = sum(len(path) for path in paths.values())
+        self._resident += self._sizes[tile]
+        while self._resident > self._budget and len(self._tiles) > 1:
+            evicted, _ = self._tiles.popitem(last=False)
+            self._resident -= self._sizes.pop(evicted)
+            self._evictions += 1
+
+    def __contains__(self, tile):
+        with self._condition:
+            return tile in self._tiles
+
+    def prefetch(self, tiles):
+        """
+        Loads the given tiles in a background thread, skipping the resident ones
+        """
+        with self._condition:
+            tiles = [tile for tile in tiles
+                     if tile not in self._tiles and tile not in self._loading and tile not in self._queued]
+            self._queued.update(tiles)
+        if not tiles:
+            return
+
+        if self._prefetch_thread is None:
+            self._prefetch_queue = queue.Queue()
+            self._prefetch_thread = threading.Thread(target=self._prefetch_loop, name='TileCachePrefetch')
+            self._prefetch_thread.daemon = True
+            self._prefetch_thread.start()
+        for tile in tiles:
+            self._prefetch_queue.put(tile)
+
+    def _prefetch_loop(self):
+        while True:
+            tile = self._prefetch_queue.get()
+            if tile is None:
+                break
+            try:
+                self.get(tile)
+            except Exception as e:
+                print("Warning: Unable to prefetch the map tile {}: {}".format(tile, e))
+            with self._condition:
+                self._queued.discard(tile)
+
+    def stop(self):
+        """Stops the background thread, if running"""
+        if self._prefetch_thread is not None:
+            self._prefetch_queue.put(None)
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+
+    def info(self):
+        """
+        Returns the statistics of the cache as a dictionary with the 'hits', 'misses',
+        'evictions', 'tiles', 'waypoints' and 'budget' entries
+        """
+        with self._condition:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'tiles': len(self._tiles),
+                'waypoints': self._resident,
+                'budget': self._budget,
+            }
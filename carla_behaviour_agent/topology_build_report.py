@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Reports the time taken by the GlobalRoutePlanner to build its graph for an
+increasing number of worker threads, and checks that the graph doesn't change.
+Without --host the offline stand-in map is used, with a simulated query latency.
+
+    python topology_build_report.py --workers 1 2 4 8 --latency 0.0002
+    python topology_build_report.py --host localhost --port 2000
+"""
+
+import argparse
+import time
+
+from global_route_planner import GlobalRoutePlanner
+import graph_cache
+
+
+def graph_signature(grp):
+    """Returns a comparable summary of the graph of a route planner"""
+    edges = []
+    for n1, n2, edge in grp._graph.edges(data=True):
+        path = edge['path']
+        if path is not None:
+            path = [graph_cache.encode_waypoint(wp) for wp in path]
+        edges.append((n1, n2, int(edge['type']), round(edge['length'], 6), path))
+    return sorted(grp._id_map.items()), edges
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default=None, help='IP of the host server, offline map if not given')
+    argparser.add_argument('--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('--workers', default=[1, 2, 4, 8], type=int, nargs='+')
+    argparser.add_argument('--sampling-resolution', default=2.0, type=float)
+    argparser.add_argument('--size', default=6, type=int, help='crossings per side of the offline map')
+    argparser.add_argument('--latency', default=0.0002, type=float, help='seconds per query of the offline map')
+    argparser.add_argument('--lazy', action='store_true', help='build the graph in lazy mode')
+    args = argparser.parse_args()
+
+    if args.host:
+        import carla
+        client = carla.Client(args.host, args.port)
+        client.set_timeout(300.0)
+        wmap = client.get_world().get_map()
+    else:
+        from offline_map import OfflineMap
+        wmap = OfflineMap(size=args.size, latency=args.latency)
+
+    print("{:>8} {:>10} {:>8} {:>10}".format("workers", "time [s]", "speedup", "same graph"))
+    reference, reference_time = None, None
+    for workers in args.workers:
+        start = time.time()
+        grp = GlobalRoutePlanner(wmap, args.sampling_resolution, lazy=args.lazy, workers=workers)
+        elapsed = time.time() - start
+
+        signature = graph_signature(grp)
+        if reference is None:
+            reference, reference_time = signature, elapsed
+        print("{:>8} {:>10.2f} {:>8.2f} {:>10}".format(
+            workers, elapsed, reference_time / elapsed, str(signature == reference)))
+
+
+if __name__ == '__main__':
+    main()
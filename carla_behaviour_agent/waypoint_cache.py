@@ -0,0 +1,104 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides WaypointCache, a cache of the projections of locations on the
+lanes of the map, used by the agents instead of calling carla.Map.get_waypoint.
+"""
+
+import math
+from collections import OrderedDict
+
+import carla
+
+
+class WaypointCache(object):
+    """
+    WaypointCache answers carla.Map.get_waypoint queries in two layers:
+
+        memo: the exact queries of the current tick, cleared by new_tick
+        cells: the space is split in cubic cells of side resolution, and the waypoint
+            of a cell is the projection of its center. Cells are kept in LRU order,
+            up to maxsize of them
+
+    A cached waypoint is the projection of a point at most resolution * sqrt(3) / 2
+    meters from the queried location.
+    """
+
+    def __init__(self, wmap, resolution=0.1, maxsize=4096):
+        """
+        Constructor method.
+
+            :param wmap: carla.Map the waypoints are projected on
+            :param resolution: side of the cells, in meters
+            :param maxsize: maximum number of cells kept
+        """
+        self._map = wmap
+        self._resolution = resolution
+        self._maxsize = max(int(maxsize), 1)
+        self._cells = OrderedDict()
+        self._memo = {}
+
+        self._memo_hits = 0
+        self._cell_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def new_tick(self):
+        """Clears the queries memorized during the previous tick"""
+        self._memo.clear()
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """
+        Returns the waypoint of location, like carla.Map.get_waypoint
+
+            :param location: carla.Location to project
+            :param project_to_road: whether to project on the closest lane, or return None outside of lanes
+            :param lane_type: carla.LaneType of the lanes considered
+        """
+        options = (bool(project_to_road), int(lane_type))
+        key = (location.x, location.y, location.z) + options
+        if key in self._memo:
+            self._memo_hits += 1
+            return self._memo[key]
+
+        resolution = self._resolution
+        cell = (int(math.floor(location.x / resolution)), int(math.floor(location.y / resolution)),
+                int(math.floor(location.z / resolution))) + options
+        if cell in self._cells:
+            self._cells.move_to_end(cell)
+            self._cell_hits += 1
+            waypoint = self._cells[cell]
+        else:
+            self._misses += 1
+            center = carla.Location(x=(cell[0] + 0.5) * resolution, y=(cell[1] + 0.5) * resolution,
+                                    z=(cell[2] + 0.5) * resolution)
+            waypoint = self._map.get_waypoint(center, project_to_road=project_to_road, lane_type=lane_type)
+            self._cells[cell] = waypoint
+            if len(self._cells) > self._maxsize:
+                self._cells.popitem(last=False)
+                self._evictions += 1
+
+        self._memo[key] = waypoint
+        return waypoint
+
+    def clear(self):
+        """Removes all the cached waypoints, e.g. after the map changed"""
+        self._cells.clear()
+        self._memo.clear()
+
+    def info(self):
+        """
+        Returns the statistics of the cache as a dictionary with the 'queries', 'memo_hits',
+        'cell_hits', 'misses', 'evictions', 'cells' and 'hit_rate' entries
+        """
+        queries = self._memo_hits + self._cell_hits + self._misses
+        return {
+            'queries': queries,
+            'memo_hits': self._memo_hits,
+            'cell_hits': self._cell_hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'cells': len(self._cells),
+            'hit_rate': (self._memo_hits + self._cell_hits) / queries if queries else 0.0,
+        }
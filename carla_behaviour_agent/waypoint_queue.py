@@ -0,0 +1,219 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides WaypointQueue, the queue of (carla.Waypoint, RoadOption)
+followed by the LocalPlanner.
+"""
+
+import numpy as np
+
+from route_trace import RouteTrace
+
+
+class WaypointQueue(object):
+    """
+    WaypointQueue is a ring buffer of (carla.Waypoint, RoadOption) entries, with the
+    location of every entry stored in preallocated NumPy arrays. The entries between
+    the head and the tail indices are the queue, and the buffers grow when full.
+
+    It can be used like a collections.deque of (carla.Waypoint, RoadOption). Entries
+    added from a RouteTrace are only stored as the trace and their index in it, copied
+    as arrays, and their (carla.Waypoint, RoadOption) is built when they are accessed.
+    """
+
+    def __init__(self, maxlen=10000):
+        """
+        Constructor method.
+
+            :param maxlen: initial capacity of the buffers
+        """
+        self._capacity = max(int(maxlen), 1)
+        self._xyz = np.empty((self._capacity, 3), dtype=np.float64)
+        self._items = [None] * self._capacity
+        # RouteTrace of every entry, as an index in self._traces (-1 for the plain entries),
+        # and the index of the entry in it
+        self._source = np.full(self._capacity, -1, dtype=np.int32)
+        self._index = np.zeros(self._capacity, dtype=np.int64)
+        self._traces = []
+        self._head = 0
+        self._size = 0
+
+    @property
+    def maxlen(self):
+        """Number of entries that fit in the buffers before they have to grow"""
+        return self._capacity
+
+    def __len__(self):
+        return self._size
+
+    def _slot(self, index):
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError("WaypointQueue index out of range")
+        return (self._head + index) % self._capacity
+
+    def _slots(self, start, count):
+        return (self._head + start + np.arange(count)) % self._capacity
+
+    def _resolve(self, slot):
+        item = self._items[slot]
+        if item is None:
+            item = self._traces[self._source[slot]][int(self._index[slot])]
+            self._items[slot] = item
+        return item
+
+    def __getitem__(self, index):
+        return self._resolve(self._slot(index))
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield self._resolve((self._head + index) % self._capacity)
+
+    def _reserve(self, size):
+        """Grows the buffers to hold at least size entries, keeping the queue from slot 0"""
+        if size <= self._capacity:
+            return
+        capacity = max(size, 2 * self._capacity)
+        slots = self._slots(0, self._size)
+        xyz = np.empty((capacity, 3), dtype=np.float64)
+        xyz[:self._size] = self._xyz[slots]
+        source = np.full(capacity, -1, dtype=np.int32)
+        source[:self._size] = self._source[slots]
+        index = np.zeros(capacity, dtype=np.int64)
+        index[:self._size] = self._index[slots]
+        items = [self._items[slot] for slot in slots.tolist()] + [None] * (capacity - self._size)
+        self._xyz, self._items, self._capacity, self._head = xyz, items, capacity, 0
+        self._source, self._index = source, index
+
+    def append(self, item):
+        """Adds a (carla.Waypoint, RoadOption) entry at the end of the queue"""
+        self._reserve(self._size + 1)
+        slot = (self._head + self._size) % self._capacity
+        location = item[0].transform.location
+        self._xyz[slot] = (location.x, location.y, location.z)
+        self._items[slot] = item
+        self._source[slot] = -1
+        self._size += 1
+
+    def extend(self, plan):
+        """
+        Adds the entries of a plan at the end of the queue
+
+            :param plan: list of (carla.Waypoint, RoadOption), or RouteTrace
+        """
+        if isinstance(plan, RouteTrace):
+            count = len(plan)
+            xyz = np.column_stack((plan.x, plan.y, plan.z))
+            items = None
+        else:
+            items = list(plan)
+            count = len(items)
+            xyz = np.empty((count, 3), dtype=np.float64)
+            for i, (waypoint, _) in enumerate(items):
+                location = waypoint.transform.location
+                xyz[i] = (location.x, location.y, location.z)
+
+        if count == 0:
+            return
+        self._reserve(self._size + count)
+        slots = self._slots(self._size, count)
+        self._xyz[slots] = xyz
+        if items is None:
+            self._source[slots] = len(self._traces)
+            self._index[slots] = np.arange(count)
+            self._traces.append(plan)
+            items = [None] * count
+        else:
+            self._source[slots] = -1
+        # The new entries can wrap around the end of the buffers
+        first = min(count, self._capacity - slots[0])
+        self._items[slots[0]:slots[0] + first] = items[:first]
+        self._items[:count - first] = items[first:]
+        self._size += count
+
+    def popleft(self):
+        """Removes and returns the first entry of the queue"""
+        if self._size == 0:
+            raise IndexError("pop from an empty WaypointQueue")
+        item = self[0]
+        self.discard(1)
+        return item
+
+    def discard(self, count):
+        """Removes count entries from the front of the queue, without building their waypoints"""
+        count = min(count, self._size)
+        for slot in self._slots(0, count).tolist():
+            self._items[slot] = None
+        self._head = (self._head + count) % self._capacity
+        self._size -= count
+        if self._size == 0:
+            self._traces = []
+
+    def clear(self):
+        """Removes all the entries"""
+        self._items = [None] * self._capacity
+        self._traces = []
+        self._head = 0
+        self._size = 0
+
+    def replace(self, start, end, plan):
+        """
+        Replaces the entries from start to end, both included, with the entries of a plan
+
+            :param plan: list of (carla.Waypoint, RoadOption), or RouteTrace
+        """
+        start, end = max(start, 0), min(end + 1, self._size)
+        slots = self._slots(0, self._size).tolist()
+        suffix_xyz = self._xyz[slots[end:]]
+        suffix_source = self._source[slots[end:]]
+        suffix_index = self._index[slots[end:]]
+        suffix_items = [self._items[slot] for slot in slots[end:]]
+
+        # Drop the tail from start on, then add the plan and the suffix back
+        for slot in slots[start:]:
+            self._items[slot] = None
+        self._size = start
+        self.extend(plan)
+
+        self._reserve(self._size + len(suffix_items))
+        new_slots = self._slots(self._size, len(suffix_items))
+        self._xyz[new_slots] = suffix_xyz
+        self._source[new_slots] = suffix_source
+        self._index[new_slots] = suffix_index
+        for slot, item in zip(new_slots.tolist(), suffix_items):
+            self._items[slot] = item
+        self._size += len(suffix_items)
+
+    def locations(self, start=0, count=None):
+        """Returns the (count, 3) array with the locations of count entries from start, all if None"""
+        if count is None:
+            count = self._size - start
+        return self._xyz[self._slots(start, max(min(count, self._size - start), 0))]
+
+    def purge(self, location, min_distance, last_min_distance=1.0, window=32):
+        """
+        Removes from the front of the queue the entries closer than min_distance to location,
+        stopping at the first one that isn't. The distances are computed window entries at a time.
+
+            :param location: carla.Location of the vehicle
+            :param min_distance: distance under which an entry is removed
+            :param last_min_distance: distance under which the last entry of the queue is removed
+            :param window: number of entries tested at once
+            :return: number of entries removed
+        """
+        point = np.array([location.x, location.y, location.z])
+        removed = 0
+        while self._size > 0:
+            count = min(window, self._size)
+            distances = np.sqrt(((self.locations(0, count) - point) ** 2).sum(axis=1))
+            close = distances < min_distance
+            if count == self._size:
+                close[-1] = distances[-1] < last_min_distance
+            passed = count if close.all() else int(np.argmin(close))
+            self.discard(passed)
+            removed += passed
+            if passed < count:
+                break
+        return removed
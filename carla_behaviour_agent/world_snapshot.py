@@ -0,0 +1,194 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides WorldSnapshot, the state of the ego vehicle and of the other
+actors read once per tick and shared by the agent, the planner and the controllers.
+"""
+
+import math
+from fnmatch import fnmatch
+
+import numpy as np
+
+import carla
+
+
+class WorldSnapshot(object):
+    """
+    WorldSnapshot stores the state of every actor at one tick as parallel NumPy arrays,
+    one entry per actor:
+
+        ids: actor ids
+        type_ids: blueprint ids, e.g. 'vehicle.tesla.model3'
+        positions: (n, 3) locations, in meters
+        rotations: (n, 3) pitch, yaw and roll, in degrees. yaws is the middle column
+        velocities: (n, 3) velocities, in m/s
+        extents: (n, 3) half sizes of the bounding boxes, in meters (zero if none)
+
+    The positions and velocities come from a single world.get_snapshot() query. The actor
+    objects, the types and the extents don't change while an actor lives, so they are
+    taken from the previous snapshot when the actors are the same, and only queried
+    again with world.get_actors() when an actor is spawned or destroyed.
+    The ego transform, velocity, speed and speed limit are read once too.
+    """
+
+    def __init__(self, world, vehicle, previous=None):
+        """
+        Constructor method.
+
+            :param world: carla.World
+            :param vehicle: ego carla.Vehicle
+            :param previous: WorldSnapshot of the previous tick, whose actors are reused if unchanged
+        """
+        snapshot = world.get_snapshot()
+        self.frame = snapshot.frame
+        states = list(snapshot)
+        ids = np.array([state.id for state in states], dtype=np.int64)
+
+        if previous is not None and np.array_equal(ids, previous.ids):
+            self.actors = previous.actors
+            self.type_ids = previous.type_ids
+            self.extents = previous.extents
+            self._filters = previous._filters
+        else:
+            registry = {actor.id: actor for actor in world.get_actors(ids.tolist())}
+            # Drop the actors destroyed between the two queries
+            states = [state for state in states if state.id in registry]
+            ids = np.array([state.id for state in states], dtype=np.int64)
+            self.actors = [registry[actor_id] for actor_id in ids.tolist()]
+            self.type_ids = np.array([actor.type_id for actor in self.actors], dtype=object)
+            self.extents = np.zeros((len(ids), 3), dtype=np.float64)
+            for i, actor in enumerate(self.actors):
+                bounding_box = getattr(actor, 'bounding_box', None)
+                if bounding_box is not None:
+                    extent = bounding_box.extent
+                    self.extents[i] = (extent.x, extent.y, extent.z)
+            self._filters = {}
+
+        self.ids = ids
+        self._index = {actor_id: i for i, actor_id in enumerate(ids.tolist())}
+        self.positions = np.empty((len(ids), 3), dtype=np.float64)
+        self.rotations = np.empty((len(ids), 3), dtype=np.float64)
+        self.velocities = np.empty((len(ids), 3), dtype=np.float64)
+        for i, state in enumerate(states):
+            transform = state.get_transform()
+            location, rotation = transform.location, transform.rotation
+            velocity = state.get_velocity()
+            self.positions[i] = (location.x, location.y, location.z)
+            self.rotations[i] = (rotation.pitch, rotation.yaw, rotation.roll)
+            self.velocities[i] = (velocity.x, velocity.y, velocity.z)
+
+        # Ego vehicle, read from the actor arrays when it is in the snapshot
+        self.ego_id = vehicle.id
+        if vehicle.id in self._index:
+            self._ego_transform = self.transform(vehicle)
+            self.ego_velocity = self.velocity(vehicle)
+        else:
+            self._ego_transform = vehicle.get_transform()
+            self.ego_velocity = vehicle.get_velocity()
+        velocity = self.ego_velocity
+        self.ego_speed = 3.6 * math.sqrt(velocity.x ** 2 + velocity.y ** 2 + velocity.z ** 2)
+        self.speed_limit = vehicle.get_speed_limit()
+
+    @property
+    def yaws(self):
+        """Yaw of every actor, in degrees"""
+        return self.rotations[:, 1]
+
+    @property
+    def ego_transform(self):
+        """carla.Transform of the ego vehicle, a new object at every access"""
+        transform = self._ego_transform
+        return carla.Transform(
+            carla.Location(x=transform.location.x, y=transform.location.y, z=transform.location.z),
+            carla.Rotation(pitch=transform.rotation.pitch, yaw=transform.rotation.yaw, roll=transform.rotation.roll))
+
+    @property
+    def ego_location(self):
+        """carla.Location of the ego vehicle, a new object at every access"""
+        location = self._ego_transform.location
+        return carla.Location(x=location.x, y=location.y, z=location.z)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, actor):
+        """Returns the index of an actor in the arrays, None if it isn't in the snapshot"""
+        return self._index.get(actor.id)
+
+    def indices(self, pattern):
+        """Returns the indices of the actors whose type matches a wildcard pattern"""
+        indices = self._filters.get(pattern)
+        if indices is None:
+            indices = np.array([i for i, type_id in enumerate(self.type_ids) if fnmatch(type_id, pattern)],
+                               dtype=np.int64)
+            self._filters[pattern] = indices
+        return indices
+
+    def filter(self, pattern):
+        """
+        Returns the actors whose type matches a wildcard pattern, like carla.ActorList.filter
+
+            :param pattern: wildcard pattern, e.g. '*vehicle*'
+        """
+        return [self.actors[i] for i in self.indices(pattern).tolist()]
+
+    def near(self, pattern, location, max_distance, exclude_ego=False):
+        """
+        Returns the actors whose type matches a wildcard pattern closer than max_distance to location
+
+            :param pattern: wildcard pattern, e.g. '*vehicle*'
+            :param location: carla.Location the distances are measured from
+            :param max_distance: distance in meters
+            :param exclude_ego: whether to leave the ego vehicle out
+        """
+        return [self.actors[i] for i in self.near_indices(location, max_distance, pattern, exclude_ego).tolist()]
+
+    def near_indices(self, location, max_distance, pattern=None, exclude_ego=False):
+        """
+        Returns the indices of the actors closer than max_distance to location
+
+            :param location: carla.Location the distances are measured from
+            :param max_distance: distance in meters
+            :param pattern: wildcard pattern of the types of the actors, all of them if None
+            :param exclude_ego: whether to leave the ego vehicle out
+        """
+        indices = self.indices(pattern) if pattern is not None else np.arange(len(self.ids))
+        offsets = self.positions[indices] - (location.x, location.y, location.z)
+        indices = indices[np.sqrt((offsets ** 2).sum(axis=1)) < max_distance]
+        if exclude_ego:
+            indices = indices[self.ids[indices] != self.ego_id]
+        return indices
+
+    def transform(self, actor):
+        """Returns a new carla.Transform of an actor, queried from the actor if it isn't in the snapshot"""
+        i = self._index.get(actor.id)
+        if i is None:
+            return actor.get_transform()
+        x, y, z = self.positions[i].tolist()
+        pitch, yaw, roll = self.rotations[i].tolist()
+        return carla.Transform(carla.Location(x=x, y=y, z=z), carla.Rotation(pitch=pitch, yaw=yaw, roll=roll))
+
+    def location(self, actor):
+        """Returns a new carla.Location of an actor, queried from the actor if it isn't in the snapshot"""
+        i = self._index.get(actor.id)
+        if i is None:
+            return actor.get_location()
+        x, y, z = self.positions[i].tolist()
+        return carla.Location(x=x, y=y, z=z)
+
+    def velocity(self, actor):
+        """Returns the carla.Vector3D velocity of an actor, queried from the actor if it isn't in the snapshot"""
+        i = self._index.get(actor.id)
+        if i is None:
+            return actor.get_velocity()
+        x, y, z = self.velocities[i].tolist()
+        return carla.Vector3D(x=x, y=y, z=z)
+
+    def speed(self, actor):
+        """Returns the speed of an actor in Km/h"""
+        if actor.id == self.ego_id:
+            return self.ego_speed
+        velocity = self.velocity(actor)
+        return 3.6 * math.sqrt(velocity.x ** 2 + velocity.y ** 2 + velocity.z ** 2)